@@ -0,0 +1,176 @@
+# answerSets.py - generate the randomized partOne answer sets for the repeater test
+
+# each answer set is a permutation: row[letterPosition] = index into the repeaters list,
+#  so row 0 of a set for 24 repeaters says which repeater gets letter A, etc.
+#
+# constraints:
+#  - minDistance: every pair of answer sets must differ in at least this many letter
+#     positions (Hamming distance), so that members sitting next to each other don't
+#     get identical or nearly identical maps
+#  - balanced: spread each repeater evenly over the letter positions, by drawing the
+#     answer sets in blocks of Latin squares (within one block, every repeater appears
+#     exactly once at each letter position, and every pair of rows differs everywhere)
+#
+# candidate permutations are drawn in vectorized batches with numpy; near-duplicates
+#  are rejected using a multi-index hash (see NearDuplicateIndex) instead of comparing
+#  every new candidate against every accepted answer set
+#
+# requires numpy
+
+import logging
+import math
+import itertools
+import numpy as np
+
+# multi-index hash for Hamming-distance queries on fixed-length permutations
+#  two rows closer than minDistance agree in at least size-minDistance+1 positions;
+#  if the positions are split into nBlocks blocks, then (pigeonhole) some block holds at
+#  least t=ceil(agreements/nBlocks) of those agreements, so every t-position subset of
+#  every block is used as a hash key, and only rows sharing a key are compared exactly
+#  nBlocks is chosen to minimize (keys per row) + (expected random collisions per row)
+class NearDuplicateIndex():
+	def __init__(self,size,minDistance,capacity=1024):
+		self.size=size
+		self.minDistance=minDistance
+		self.rows=np.zeros((capacity,size),dtype=np.uint8)
+		self.count=0
+		self.subsets=np.zeros((0,1),dtype=np.int64)
+		if minDistance>0:
+			self.subsets=chooseSubsets(size,size-minDistance+1,capacity)
+		t=self.subsets.shape[1]
+		# the values at a subset of positions are packed into one integer key: sum(value * size**j)
+		self.weights=np.array([size**j for j in range(t)],dtype=np.int64)
+		# for each subset: sorted keys of the indexed rows, and the matching row numbers
+		self.sortedKeys=[np.zeros(0,dtype=np.int64) for s in range(len(self.subsets))]
+		self.sortedIDs=[np.zeros(0,dtype=np.int64) for s in range(len(self.subsets))]
+
+	def blockKeys(self,rows):
+		rows=np.asarray(rows,dtype=np.int64).reshape(-1,self.size)
+		return rows[:,self.subsets]@self.weights
+
+	# returns a boolean array: True for each row of the batch that is within minDistance
+	#  of any indexed row, or of an earlier row of the same batch
+	def findConflicts(self,batch,keys=None):
+		batch=np.asarray(batch,dtype=np.uint8)
+		conflicts=np.zeros(len(batch),dtype=bool)
+		if self.minDistance<=0:
+			return conflicts
+		if keys is None:
+			keys=self.blockKeys(batch)
+		for k in range(len(self.subsets)):
+			q=keys[:,k]
+			order=np.argsort(q,kind='stable')
+			sortedQ=q[order]
+			# against the indexed rows: every (batch row, indexed row) pair sharing this key
+			#  (searching with sorted queries is much faster than with random ones)
+			if self.count:
+				lo=np.searchsorted(self.sortedKeys[k],sortedQ,'left')
+				hi=np.searchsorted(self.sortedKeys[k],sortedQ,'right')
+				counts=hi-lo
+				if counts.any():
+					batchRows=np.repeat(order,counts)
+					offsets=np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts,counts)
+					indexedRows=self.sortedIDs[k][np.repeat(lo,counts)+offsets]
+					close=(self.rows[indexedRows]!=batch[batchRows]).sum(axis=1)<self.minDistance
+					conflicts[batchRows[close]]=True
+			# within the batch: every pair sharing this key; the later row of a close pair is rejected
+			shift=1
+			while shift<len(q):
+				same=sortedQ[shift:]==sortedQ[:-shift]
+				if not same.any():
+					break
+				first=order[:-shift][same]
+				second=order[shift:][same]
+				close=(batch[first]!=batch[second]).sum(axis=1)<self.minDistance
+				conflicts[np.maximum(first,second)[close]]=True
+				shift+=1
+		return conflicts
+
+	def add(self,batch,keys=None):
+		batch=np.asarray(batch,dtype=np.uint8)
+		while self.count+len(batch)>len(self.rows):
+			self.rows=np.concatenate([self.rows,np.zeros_like(self.rows)])
+		if keys is None:
+			keys=self.blockKeys(batch)
+		ids=np.arange(self.count,self.count+len(batch))
+		self.rows[ids]=batch
+		for k in range(len(self.subsets)):
+			order=np.argsort(keys[:,k])
+			pos=np.searchsorted(self.sortedKeys[k],keys[order,k])
+			self.sortedKeys[k]=np.insert(self.sortedKeys[k],pos,keys[order,k])
+			self.sortedIDs[k]=np.insert(self.sortedIDs[k],pos,ids[order])
+		self.count+=len(batch)
+
+# pick the block layout for NearDuplicateIndex: returns an array of position subsets
+#  (one row per hash key); n is the expected number of indexed rows
+def chooseSubsets(size,agreements,n):
+	best=None
+	for nBlocks in range(1,size+1):
+		t=-(-agreements//nBlocks)
+		if t>13: # size**t must fit in an int64 key
+			continue
+		blocks=np.array_split(np.arange(size),nBlocks)
+		nKeys=sum(math.comb(len(b),t) for b in blocks)
+		if nKeys>100000:
+			continue
+		# chance that a given key of a random row matches a given indexed row
+		collision=1.0/math.perm(size,t)
+		cost=nKeys*(1+n*collision)
+		if best is None or cost<best[0]:
+			best=(cost,blocks,t)
+	(cost,blocks,t)=best
+	return np.array([c for b in blocks for c in itertools.combinations(b.tolist(),t)],dtype=np.int64)
+
+# one batch of candidate permutations
+#  unbalanced: independent uniformly random permutations
+#  balanced: a stack of Latin squares; in each square, row i = p[(i + c) mod size]
+#   for random permutations p and c
+def drawBatch(rng,size,batchSize,balanced):
+	if balanced:
+		nSquares=max(1,batchSize//size)
+		p=rng.random((nSquares,size)).argsort(axis=1)
+		c=rng.random((nSquares,size)).argsort(axis=1)
+		shifts=(np.arange(size)[None,:,None]+c[:,None,:])%size
+		squares=np.take_along_axis(p[:,None,:].repeat(size,axis=1),shifts,axis=2)
+		return squares.reshape(-1,size)
+	return rng.random((batchSize,size)).argsort(axis=1)
+
+# generate n answer sets of the given size (number of repeaters); returns an (n,size)
+#  uint8 array, or None if the constraints could not be met
+#  maxRejects: give up after this many consecutive batches that add nothing
+def generateAnswerSets(n,size,minDistance=0,balanced=False,seed=None,batchSize=4096,maxRejects=5):
+	rng=np.random.default_rng(seed)
+	if minDistance>size:
+		logging.info('ERROR: minimum distance '+str(minDistance)+' is larger than the number of repeaters ('+str(size)+')')
+		return None
+	index=NearDuplicateIndex(size,minDistance,capacity=max(n,1))
+	rejects=0
+	rejected=0
+	while index.count<n:
+		batch=drawBatch(rng,size,min(batchSize,max(n-index.count,size)),balanced)
+		keys=index.blockKeys(batch)
+		conflicts=index.findConflicts(batch,keys)
+		if balanced:
+			# keep a whole Latin square or none of it, so that the balance holds;
+			#  rows within one square already differ in every position
+			conflicts=conflicts.reshape(-1,size).any(axis=1).repeat(size)
+		keep=np.flatnonzero(~conflicts)[:n-index.count]
+		rejected+=int(conflicts.sum())
+		if len(keep)==0:
+			rejects+=1
+			if rejects>=maxRejects:
+				logging.info('ERROR: could only generate '+str(index.count)+' of '+str(n)+' answer sets with minimum distance '+str(minDistance))
+				return None
+			continue
+		rejects=0
+		index.add(batch[keep],keys[keep])
+	logging.info('generated '+str(n)+' answer sets ('+str(rejected)+' candidates rejected as near-duplicates)')
+	return index.rows[:n].copy()
+
+# smallest pairwise Hamming distance in a set of answer sets - O(n^2), for spot checks only
+def minPairwiseDistance(answerSets):
+	answerSets=np.asarray(answerSets)
+	best=answerSets.shape[1]
+	for i in range(1,len(answerSets)):
+		best=min(best,int((answerSets[:i]!=answerSets[i]).sum(axis=1).min()))
+	return best
@@ -0,0 +1,309 @@
+# asyncServe.py - serve signin_api as an ASGI app, for many slow or long-lived requests
+
+# under WSGI, every request holds a worker thread until it's done: a webhook waiting on
+#  SendGrid, a finalize waiting on D4H (sdbPush), or an open event stream; here:
+#   - /api/v1/events/stream is served by the event loop: one shared poller queries
+#     sdbGetEvents (in the thread pool) every streamInterval seconds while anyone is
+#     listening, and sends the changes to every open stream, so an open stream costs a
+#     queue, not a thread
+#   - every other route is the same Flask view, called (as WSGI) in a bounded thread pool
+#     (--threads), so the blocking database calls and sdbPush never block the event loop,
+#     and no more than --threads of them run at once
+#   - the graded results email is posted to SendGrid by the event loop (see
+#     signin_api.sendGradedEmail), so the webhook's thread is free as soon as grading is
+#     done; gradedEmailSent is recorded when SendGrid accepts it
+#   - the database calls made outside of a Flask request (the stream's polls) give back
+#     their pooled connections themselves (see dbPool.py)
+#
+# application is the ASGI app; run it under an ASGI server, e.g.
+#  'uvicorn asyncServe:application --http h11 --timeout-keep-alive 5', or 'python
+#  asyncServe.py', which runs uvicorn with serverLimits (no TLS; put it behind the host's
+#  proxy, like the WSGI app); the app itself answers 413 to a request body over maxBody
+#  bytes and 408 to one that takes more than bodyTimeout seconds to arrive; uvicorn
+#  doesn't time out a client that stalls before its headers are complete, which the
+#  host's proxy does
+#
+# requires httpx (the SendGrid posts), and uvicorn for 'python asyncServe.py'
+
+import io
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import urllib.parse
+import concurrent.futures
+import httpx
+from sendgrid.helpers.mail import Mail
+import signin_api
+
+sendgridURL='https://api.sendgrid.com/v3/mail/send'
+mailTimeout=30
+
+maxBody=1024*1024 # bytes
+bodyTimeout=30 # seconds
+
+# uvicorn settings for 'python asyncServe.py' (and loadTest's serve-async mode)
+serverLimits={
+	'http':'h11',
+	'timeout_keep_alive':5, # seconds an idle keep-alive connection stays open
+	'h11_max_incomplete_event_size':16*1024, # bytes of request line and headers
+	'limit_concurrency':1000 # connections; 503 after that
+}
+
+#########################################################
+# event stream
+#########################################################
+
+# sdbGetEvents outside of a Flask request (in a pool thread): give back this thread's
+#  pooled database connections afterwards, as signin_api's request teardown does
+def getEvents(since):
+	try:
+		return signin_api.sdbGetEvents(since,0,False)
+	finally:
+		signin_api.dbPool.releaseAll()
+
+# one poller for all of the open streams
+class EventBroadcaster():
+	def __init__(self,executor,interval):
+		self.executor=executor
+		self.interval=interval
+		self.queues=set()
+		self.since=time.time()
+		self.task=None
+
+	def subscribe(self):
+		q=asyncio.Queue()
+		self.queues.add(q)
+		if self.task is None or self.task.done():
+			self.task=asyncio.get_running_loop().create_task(self.poll())
+		return q
+
+	def unsubscribe(self,q):
+		self.queues.discard(q)
+
+	async def poll(self):
+		loop=asyncio.get_running_loop()
+		while self.queues:
+			try:
+				events=await loop.run_in_executor(self.executor,getEvents,self.since)
+			except Exception as e:
+				logging.info('ERROR: event stream poll failed: '+str(e))
+				events=[]
+			if events:
+				self.since=signin_api.newestEdit(events,self.since)
+				for q in list(self.queues):
+					q.put_nowait(events)
+			await asyncio.sleep(self.interval)
+
+#########################################################
+# the app
+#########################################################
+
+class AsyncSigninAPI():
+	def __init__(self,threads=8,mailURL=sendgridURL,streamInterval=None):
+		self.executor=concurrent.futures.ThreadPoolExecutor(threads,thread_name_prefix='signin_api')
+		self.mailURL=mailURL
+		self.broadcaster=EventBroadcaster(self.executor,streamInterval or signin_api.streamInterval)
+		self.loop=None
+		self.client=None # the httpx client for the SendGrid posts, on this app's event loop
+		self.lock=threading.Lock() # for emailsQueued, counted in the pool threads
+		self.stats={'streamsOpen':0,'streamsTotal':0,'emailsQueued':0,'emailsSent':0,'emailsFailed':0}
+
+	def start(self):
+		if self.loop is None:
+			self.loop=asyncio.get_running_loop()
+			self.client=httpx.AsyncClient(timeout=mailTimeout)
+			signin_api.sendGradedEmail=self.sendGradedEmail
+
+	async def __call__(self,scope,receive,send):
+		if scope['type']=='lifespan':
+			while True:
+				message=await receive()
+				if message['type']=='lifespan.startup':
+					self.start()
+					await send({'type':'lifespan.startup.complete'})
+				elif message['type']=='lifespan.shutdown':
+					self.executor.shutdown(wait=False)
+					if self.client:
+						await self.client.aclose()
+					await send({'type':'lifespan.shutdown.complete'})
+					return
+		if scope['type']!='http':
+			return
+		self.start()
+		if scope['path']=='/api/v1/events/stream' and scope['method']=='GET':
+			await self.stream(scope,receive,send)
+		else:
+			await self.wsgi(scope,receive,send)
+
+	# called by gradeResponse, in a pool thread: queue the post and return right away (None:
+	#  not sent yet; markGradedEmailSent records it once SendGrid accepts it)
+	def sendGradedEmail(self,sarID,**email):
+		with self.lock:
+			self.stats['emailsQueued']+=1
+		asyncio.run_coroutine_threadsafe(self.mail(sarID,email),self.loop)
+
+	async def mail(self,sarID,email):
+		body=json.dumps(Mail(**email).get()).encode()
+		headers={'Authorization':'Bearer '+str(signin_api.SENDGRID_API_KEY),'Content-Type':'application/json'}
+		try:
+			response=await self.client.post(self.mailURL,content=body,headers=headers)
+			(status,responseBody)=(response.status_code,response.content)
+		except Exception as e:
+			status=None
+			responseBody=str(e).encode()
+		if status is None or status>299:
+			self.stats['emailsFailed']+=1
+			logging.info('ERROR: email not sent; mailer response: '+str(status)+' '+responseBody.decode(errors='replace'))
+			return
+		self.stats['emailsSent']+=1
+		logging.info('  email sent')
+		await asyncio.get_running_loop().run_in_executor(self.executor,signin_api.markGradedEmailSent,sarID)
+
+	# the request body, or None if the client went away or the body was refused (413, 408)
+	async def readBody(self,receive,send):
+		chunks=[]
+		size=0
+		end=time.monotonic()+bodyTimeout
+		while True:
+			try:
+				message=await asyncio.wait_for(receive(),max(0,end-time.monotonic()))
+			except asyncio.TimeoutError:
+				await self.respond(send,408,[('Content-Type','text/html'),('Connection','close')],b'<h1>408</h1><p>Request body not received in time.</p>')
+				return None
+			if message['type']=='http.disconnect':
+				return None
+			chunks.append(message.get('body',b''))
+			size+=len(chunks[-1])
+			if size>maxBody:
+				await self.respond(send,413,[('Content-Type','text/html'),('Connection','close')],b'<h1>413</h1><p>Request body too large.</p>')
+				return None
+			if not message.get('more_body',False):
+				return b''.join(chunks)
+
+	async def respond(self,send,status,headers,body):
+		await send({'type':'http.response.start','status':status,'headers':[(k.lower().encode('latin-1'),v.encode('latin-1')) for (k,v) in headers]})
+		await send({'type':'http.response.body','body':body})
+
+	async def wsgi(self,scope,receive,send):
+		body=await self.readBody(receive,send)
+		if body is None:
+			return
+		environ=wsgiEnviron(scope,body)
+		(status,headers,content)=await asyncio.get_running_loop().run_in_executor(self.executor,callWSGI,signin_api.app.wsgi_app,environ)
+		await self.respond(send,status,headers,content)
+
+	# the same checks and messages as signin_api.api_streamEvents
+	async def stream(self,scope,receive,send):
+		headers={k.decode('latin-1'):v.decode('latin-1') for (k,v) in scope['headers']}
+		client=signin_api.clientFor(headers.get('authorization',None))
+		if not client:
+			await self.respond(send,401,[('Content-Type','text/html')],b'<h1>401</h1><p>Unauthorized.</p>')
+			return
+		(allowed,retryAfter)=signin_api.rateLimiter.take(client,'api_streamEvents')
+		if not allowed:
+			await self.respond(send,429,[('Content-Type','text/html'),('Retry-After',str(retryAfter))],
+				('<h1>429</h1><p>Too many requests; try again in '+str(retryAfter)+' seconds.</p>').encode())
+			return
+		query=urllib.parse.parse_qs(scope['query_string'].decode('latin-1'))
+		try:
+			since=float(query.get('lastEditSince',['0'])[0])
+		except ValueError:
+			since=0.0
+		if await self.readBody(receive,send) is None:
+			return
+		q=self.broadcaster.subscribe()
+		self.stats['streamsOpen']+=1
+		self.stats['streamsTotal']+=1
+		disconnected=asyncio.get_running_loop().create_task(receive())
+		try:
+			await send({'type':'http.response.start','status':200,'headers':[(b'content-type',b'text/event-stream'),(b'cache-control',b'no-cache')]})
+			# catch up from the client's lastEditSince; after that, the shared poller's changes
+			events=await asyncio.get_running_loop().run_in_executor(self.executor,getEvents,since)
+			if events:
+				since=signin_api.newestEdit(events,since)
+				await send({'type':'http.response.body','body':signin_api.streamMessage(events),'more_body':True})
+			end=time.monotonic()+signin_api.streamDuration
+			while time.monotonic()<end:
+				getter=asyncio.get_running_loop().create_task(q.get())
+				(done,pending)=await asyncio.wait({getter,disconnected},timeout=min(signin_api.streamKeepalive,end-time.monotonic()),return_when=asyncio.FIRST_COMPLETED)
+				if getter not in done:
+					getter.cancel()
+					if disconnected in done:
+						break
+					await send({'type':'http.response.body','body':signin_api.streamMessage(None),'more_body':True})
+					continue
+				events=[e for e in getter.result() if float(e.get('LastEditEpoch',0) or 0)>since]
+				if events:
+					since=signin_api.newestEdit(events,since)
+					await send({'type':'http.response.body','body':signin_api.streamMessage(events),'more_body':True})
+			if not disconnected.done():
+				await send({'type':'http.response.body','body':b''})
+		except (ConnectionError,OSError):
+			pass
+		finally:
+			self.broadcaster.unsubscribe(q)
+			disconnected.cancel()
+			self.stats['streamsOpen']-=1
+
+def wsgiEnviron(scope,body):
+	(serverName,serverPort)=scope.get('server',None) or ('localhost',80)
+	environ={
+		'REQUEST_METHOD':scope['method'],
+		'SCRIPT_NAME':scope.get('root_path',''),
+		'PATH_INFO':scope['path'],
+		'QUERY_STRING':scope['query_string'].decode('latin-1'),
+		'SERVER_NAME':str(serverName),
+		'SERVER_PORT':str(serverPort),
+		'SERVER_PROTOCOL':'HTTP/'+scope.get('http_version','1.1'),
+		'REMOTE_ADDR':scope['client'][0] if scope.get('client') else '',
+		'wsgi.version':(1,0),
+		'wsgi.url_scheme':scope.get('scheme','http'),
+		'wsgi.input':io.BytesIO(body),
+		'wsgi.errors':sys.stderr,
+		'wsgi.multithread':True,
+		'wsgi.multiprocess':False,
+		'wsgi.run_once':False
+	}
+	for (k,v) in scope['headers']:
+		(k,v)=(k.decode('latin-1').upper().replace('-','_'),v.decode('latin-1'))
+		if k in ('CONTENT_TYPE','CONTENT_LENGTH'):
+			environ[k]=v
+		elif 'HTTP_'+k in environ:
+			environ['HTTP_'+k]+=','+v
+		else:
+			environ['HTTP_'+k]=v
+	return environ
+
+# run a WSGI app to completion (in a pool thread); returns (status, headers, body)
+def callWSGI(wsgiApp,environ):
+	started=[]
+	def start_response(status,headers,exc_info=None):
+		started[:]=[status,headers]
+	result=wsgiApp(environ,start_response)
+	try:
+		body=b''.join(result)
+	finally:
+		if hasattr(result,'close'):
+			result.close()
+	return (int(started[0].split(' ',1)[0]),started[1],body)
+
+application=AsyncSigninAPI()
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='serve signin_api as an ASGI app')
+	parser.add_argument('--host',default='127.0.0.1')
+	parser.add_argument('--port',type=int,default=8000)
+	parser.add_argument('--threads',type=int,default=8,help='thread pool for the Flask views and database calls')
+	args=parser.parse_args(argv)
+	logging.basicConfig(format='%(asctime)s:%(message)s',level=logging.INFO)
+	import uvicorn
+	global application
+	application=AsyncSigninAPI(args.threads)
+	uvicorn.run(application,host=args.host,port=args.port,**serverLimits)
+
+if __name__=='__main__':
+	sys.exit(main())
@@ -0,0 +1,197 @@
+# benchmark.py - time each stage of the repeater test pipeline on synthetic cohorts
+
+# for each cohort size, this generates fake D4H member json and jotform payloads (half
+#  in the old dict-of-dicts InputTable format, half in the new list format), then times:
+#   members - getEmailsFromMembersJson + assignTests
+#   buildKeys - buildSolutionDict
+#   makePDFs - a sample of map PDFs (perItem is per map; projected is for the whole cohort)
+#   grade - gradeResponse for every submission
+#   saveTestDict - writing testDict (testDict.sqlite) with all of the graded entries
+#   webhook - jotform webhook requests through the flask test client (needs signin_api
+#     and its signin_db dependency to be importable; otherwise the stage is skipped)
+# sending email is stubbed out everywhere; everything is written to a temporary directory
+#
+# each cohort uses its own copy of the test spec (testSpec.json in the cohort's directory),
+#  with the current test's mapID range extended to fit the cohort, so that every member's
+#  mapID is in range and every submission is really graded
+#
+# results are written as json; to record a baseline and check later runs against it:
+#   python benchmark.py --sizes 1000 10000 --out bench_baseline.json
+#   python benchmark.py --sizes 1000 10000 --baseline bench_baseline.json
+#  a stage whose perItem time is more than --tolerance slower than the baseline is
+#  reported as a regression, and the exit code is 1
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import repeaterTest as rt
+
+# write workDir/testSpec.json: the test spec, with the range of the test being worked on
+#  extended to at least n mapIDs, and work on that test from then on (the template and
+#  part two key stay where they were); also used by loadTest.py
+def useCohortSpec(workDir,n):
+	with open(rt.testSpecFile,'r') as f:
+		d=json.load(f)
+	for entry in d['tests']:
+		if entry['name']==rt.test.name:
+			entry['lastMapID']=max(int(entry['lastMapID']),int(entry['firstMapID'])+n-1)
+	fileName=os.path.join(os.path.abspath(workDir),'testSpec.json')
+	with open(fileName,'w') as f:
+		json.dump(d,f,indent=3)
+	(template,partTwoFile)=(rt.fillable_pdf,rt.partTwoFile)
+	rt.testSpecs=rt.loadSpecs(fileName)
+	rt.useTest(rt.testSpecs[rt.test.name])
+	(rt.fillable_pdf,rt.partTwoFile)=(template,partTwoFile)
+	return fileName
+
+def fakeMembers(n):
+	return {'data':[{'ref':str(100+i),'email':'member'+str(100+i)+'@example.com','name':'Member '+str(100+i)} for i in range(n)]}
+
+# one jotform submission for the given key; correct: roughly the fraction of partOne answers
+#  that are correct (wrong answers are swaps, since each letter is used once on the form)
+def fakeSubmission(rng,sarID,mapID,key,partTwoSolution,oldFormat,correct=0.8):
+	letters=[key[r] for r in rt.repeaters]
+	for n in range(len(letters)):
+		if rng.random()>correct:
+			m=rng.randrange(len(letters))
+			(letters[n],letters[m])=(letters[m],letters[n])
+	partTwo=[]
+	for location in rt.locations:
+		selected=[r for r in partTwoSolution[location]['required'] if rng.random()<0.8]
+		selected+=rng.sample(rt.repeaters,rng.randint(0,3))
+		partTwo.append(sorted(set(selected)))
+	if oldFormat:
+		# a json string: one dict per row, with the selected column holding its name
+		partOne=json.dumps({str(n):{str(c):(letter if rt.letters[c]==letter else False) for c in range(len(rt.letters))} for (n,letter) in enumerate(letters)})
+		partTwo=json.dumps({str(n):{str(c):(r if r in selected else False) for (c,r) in enumerate(rt.repeaters)} for (n,selected) in enumerate(partTwo)})
+	else:
+		# a list with one single-entry dict per row, except that column zero comes out as a list
+		partOne=[[letter] if letter=='A' else {str(ord(letter)-65):letter} for letter in letters]
+	return {'SARNumber':sarID,'mapID':str(mapID),'partOne':partOne,'partTwo':partTwo}
+
+# the form data that jotform posts to the webhook
+def fakeWebhookForm(submission):
+	raw={'q3_SARNumber':submission['SARNumber'],'q4_mapID':submission['mapID'],'q5_partOne':submission['partOne'],'q6_partTwo':submission['partTwo']}
+	return {'rawRequest':json.dumps(raw)}
+
+def timeStage(results,name,items,function,*args):
+	t0=time.perf_counter()
+	rval=function(*args)
+	seconds=time.perf_counter()-t0
+	results[name]={'seconds':round(seconds,4),'items':items,'perItem':round(seconds/max(items,1),7)}
+	logging.info('  '+name.ljust(14)+str(round(seconds,3)).rjust(10)+' s   '+str(round(seconds/max(items,1)*1000,3)).rjust(10)+' ms/item   ('+str(items)+' items)')
+	return rval
+
+def runCohort(n,workDir,pdfSample=10,gradeLimit=None,webhookLimit=200,seed=0):
+	rng=random.Random(seed)
+	results={}
+	with open(os.path.join(workDir,'members.json'),'w') as f:
+		json.dump(fakeMembers(n),f)
+	useCohortSpec(workDir,n)
+	def members():
+		rt.testDict=rt.getEmailsFromMembersJson(os.path.join(workDir,'members.json'))
+		rt.assignTests(rt.firstMapID)
+	timeStage(results,'members',n,members)
+	mapIDs=list(range(rt.firstMapID,rt.firstMapID+n))
+	keyFile=os.path.join(workDir,rt.test.partOneKey)
+	rt.solutionDict.clear()
+	timeStage(results,'buildKeys',n,rt.buildSolutionDict,mapIDs,keyFile,12,False,seed)
+	rt.readSolutionDicts(keyFile,rt.partTwoFile)
+	sample=[str(m) for m in mapIDs[:pdfSample]]
+	timeStage(results,'makePDFs',len(sample),rt.makePDFs,sample,workDir)
+	results['makePDFs']['projected']=round(results['makePDFs']['perItem']*n,2)
+	submissions=[]
+	for (sarID,d) in list(rt.testDict.items())[:gradeLimit or n]:
+		key=rt.solutionDicts['partOne'][str(d['mapID'])]
+		submissions.append(fakeSubmission(rng,sarID,d['mapID'],key,rt.solutionDicts['partTwo'],oldFormat=len(submissions)%2==0))
+	def grade():
+		for s in submissions:
+			rt.gradeResponse(s['mapID'],s)
+	timeStage(results,'grade',len(submissions),grade)
+	timeStage(results,'saveTestDict',n,rt.saveTestDict,os.path.join(workDir,'testDict.json'))
+	# both formats, like the grade stage (the server parses them with responses.py too)
+	webhook(results,workDir,submissions[:webhookLimit])
+	return results
+
+# jotform webhook requests through the flask test client; each request loads testDict and
+#  the solution dicts, grades, and updates that member's testDict entry, just like on the server
+def webhook(results,workDir,submissions):
+	try:
+		import signin_api
+	except Exception as e:
+		results['webhook']={'skipped':'signin_api could not be imported: '+str(e)}
+		logging.info('  webhook        skipped ('+results['webhook']['skipped']+')')
+		return
+	signin_api.rtPath=workDir
+	signin_api.sendEmail=lambda **kwargs:True
+	shutil.copy(rt.partTwoFile,os.path.join(workDir,rt.test.partTwoKey))
+	client=signin_api.app.test_client()
+	def post():
+		for s in submissions:
+			client.post('/api/v1/jotform_webhook',data=fakeWebhookForm(s),base_url='https://localhost')
+	timeStage(results,'webhook',len(submissions),post)
+
+# returns a list of regressions: stages whose perItem time grew by more than tolerance
+def compareToBaseline(run,baseline,tolerance=0.2):
+	regressions=[]
+	for (size,stages) in run['cohorts'].items():
+		for (stage,r) in stages.items():
+			b=baseline.get('cohorts',{}).get(size,{}).get(stage,{})
+			if 'perItem' in r and b.get('perItem'):
+				ratio=r['perItem']/b['perItem']
+				if ratio>1+tolerance:
+					regressions.append({'size':size,'stage':stage,'perItem':r['perItem'],'baseline':b['perItem'],'ratio':round(ratio,2)})
+	return regressions
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='benchmark the repeater test pipeline on synthetic cohorts')
+	parser.add_argument('--sizes',type=int,nargs='+',default=[1000,10000,100000])
+	parser.add_argument('--pdf-sample',type=int,default=10,help='number of map PDFs to build per cohort')
+	parser.add_argument('--grade-limit',type=int,default=None,help='grade at most this many submissions per cohort')
+	parser.add_argument('--webhook-limit',type=int,default=200,help='webhook requests per cohort')
+	parser.add_argument('--seed',type=int,default=0)
+	parser.add_argument('--out',default='bench_'+time.strftime('%Y%m%d%H%M%S')+'.json')
+	parser.add_argument('--baseline',default=None,help='earlier results to compare against')
+	parser.add_argument('--tolerance',type=float,default=0.2,help='allowed slowdown per item (0.2 = 20%%)')
+	args=parser.parse_args(argv)
+	logging.basicConfig(format='%(message)s',level=logging.INFO,stream=sys.stdout)
+	# the pipeline logs every key and response at .info; only the benchmark's own lines are wanted
+	logging.getLogger().handlers[0].addFilter(lambda record:record.pathname==os.path.abspath(__file__))
+	rt.sendEmail=lambda **kwargs:True
+	here=os.getcwd()
+	# the template and part two key are found relative to repeaterTest.py, since each cohort
+	#  runs in its own temporary directory
+	rtDir=os.path.dirname(os.path.abspath(rt.__file__))
+	rt.fillable_pdf=os.path.join(rtDir,rt.fillable_pdf)
+	rt.partTwoFile=os.path.join(rtDir,rt.partTwoFile)
+	run={'time':time.strftime('%Y-%m-%d %H:%M:%S'),'python':platform.python_version(),'machine':platform.machine(),'cohorts':{}}
+	for n in args.sizes:
+		logging.info('cohort of '+str(n)+':')
+		workDir=tempfile.mkdtemp(prefix='repeaterTestBench')
+		os.chdir(workDir) # gradeResponse writes summary.txt and itemStats.json in the current directory
+		try:
+			run['cohorts'][str(n)]=runCohort(n,workDir,args.pdf_sample,args.grade_limit,args.webhook_limit,args.seed)
+		finally:
+			os.chdir(here)
+			shutil.rmtree(workDir,ignore_errors=True)
+	with open(args.out,'w') as f:
+		json.dump(run,f,indent=3)
+	logging.info('results written to '+args.out)
+	if args.baseline:
+		with open(args.baseline,'r') as f:
+			regressions=compareToBaseline(run,json.load(f),args.tolerance)
+		for r in regressions:
+			logging.info('REGRESSION: cohort '+r['size']+' '+r['stage']+': '+str(r['perItem'])+' s/item vs baseline '+str(r['baseline'])+' ('+str(r['ratio'])+'x)')
+		if regressions:
+			return 1
+	return 0
+
+if __name__=='__main__':
+	sys.exit(main())
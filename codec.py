@@ -0,0 +1,264 @@
+# codec.py - compact binary answer keys and responses, read through mmap without copying
+
+# partOne keys and responses are stored as one byte per repeater (row, in the order of the
+#  repeaters list): the index of the letter for that repeater (255 = no answer), so a key
+#  is a 24-byte permutation
+# partTwo solutions and selections are stored as one 32-bit mask per location, with bit n
+#  set for the n'th repeater
+#
+# key archive (e.g. keys.bin):
+#   header, then mapIDs (sorted int32), then one key row per mapID, then the partTwo
+#   solution masks (required, optional, unlikely for each location)
+# response archive (e.g. responses.bin):
+#   header, then fixed-size records sorted by SAR number:
+#     SAR number (8 bytes, ascii, zero-padded), mapID (int32), partOne row, partTwo masks
+#
+# header: 8-byte magic, uint32 length of the json metadata (repeaters, locations, letters,
+#  counts and offsets), then the metadata; all numbers are little-endian
+#
+# lookups by mapID and SAR number are binary searches directly in the mapped file; key(),
+#  partOne() and partTwo() return memoryview slices of it, so nothing is copied until a
+#  caller asks for a dict; with numpy, keysArray() / responseArrays() are views of the
+#  same memory for vectorized analytics
+#
+# this module only uses the standard library (numpy only for the optional array views),
+#  so that it can be imported from signin_api
+
+import sys
+import json
+import mmap
+import bisect
+import struct
+from responses import parsePartOne,parsePartTwo
+from scoring import partTwoWeights
+
+keyMagic=b'RTKEYS1\0'
+responseMagic=b'RTRESP1\0'
+noAnswer=255
+sarIDSize=8
+
+if sys.byteorder!='little':
+	raise ImportError('codec.py reads the archives with native byte order views, so it needs a little-endian machine')
+
+def pad4(n):
+	return (n+3)//4*4
+
+def encodeKey(key,repeaters,letters):
+	return bytes(letters.index(key[r]) for r in repeaters)
+
+def decodeKey(row,repeaters,letters):
+	return {r:letters[row[n]] for (n,r) in enumerate(repeaters)}
+
+# letterList: parsePartOne output (one letter or None per repeater row)
+def encodePartOne(letterList,repeaters,letters):
+	row=[noAnswer]*len(repeaters)
+	for (n,letter) in enumerate(letterList[:len(repeaters)]):
+		if letter in letters:
+			row[n]=letters.index(letter)
+	return bytes(row)
+
+def encodeMask(names,repeaters):
+	mask=0
+	for name in names:
+		if name in repeaters:
+			mask|=1<<repeaters.index(name)
+	return mask
+
+def decodeMask(mask,repeaters):
+	return [r for (n,r) in enumerate(repeaters) if mask>>n&1]
+
+# selections: parsePartTwo output (list of selected repeater names per location)
+def encodePartTwo(selections,repeaters,locations):
+	masks=[encodeMask(s,repeaters) for s in selections[:len(locations)]]
+	return masks+[0]*(len(locations)-len(masks))
+
+def writeArchive(fileName,magic,meta,body):
+	metaBytes=json.dumps(meta).encode()
+	header=magic+struct.pack('<I',len(metaBytes))+metaBytes
+	header+=b'\0'*(pad4(len(header))-len(header))
+	with open(fileName,'wb') as f:
+		f.write(header)
+		f.write(body)
+
+# partOneKeys: solutionDicts['partOne'] (mapID : repeater : letter)
+# partTwoSolution: solutionDicts['partTwo']
+def writeKeyArchive(fileName,partOneKeys,partTwoSolution,repeaters,locations,letters):
+	mapIDs=sorted(int(m) for m in partOneKeys.keys())
+	rowSize=pad4(len(repeaters))
+	parts=[struct.pack('<'+str(len(mapIDs))+'i',*mapIDs)]
+	for mapID in mapIDs:
+		parts.append(encodeKey(partOneKeys[str(mapID)],repeaters,letters).ljust(rowSize,b'\0'))
+	for location in locations:
+		parts.append(struct.pack('<3I',*[encodeMask(partTwoSolution[location][c],repeaters) for c in ['required','optional','unlikely']]))
+	meta={'repeaters':repeaters,'locations':locations,'letters':letters,'count':len(mapIDs),'rowSize':rowSize}
+	writeArchive(fileName,keyMagic,meta,b''.join(parts))
+	return len(mapIDs)
+
+# records come from the guesses saved in testDict by gradeResponse; members without
+#  guesses are skipped; returns the number of records written
+def writeResponseArchive(fileName,testDict,repeaters,locations,letters):
+	rowSize=pad4(len(repeaters))
+	recordFormat='<'+str(sarIDSize)+'si'+str(rowSize)+'s'+str(len(locations))+'I'
+	records=[]
+	for (sarID,d) in testDict.items():
+		guesses=d.get('guesses',None)
+		if not guesses:
+			continue
+		sarIDBytes=str(sarID).encode('ascii')
+		if len(sarIDBytes)>sarIDSize:
+			raise ValueError('SAR number '+str(sarID)+' is longer than '+str(sarIDSize)+' characters')
+		partOne=encodePartOne(parsePartOne(guesses['partOne']),repeaters,letters).ljust(rowSize,bytes([noAnswer]))
+		partTwo=encodePartTwo(parsePartTwo(guesses['partTwo']),repeaters,locations)
+		records.append(struct.pack(recordFormat,sarIDBytes.ljust(sarIDSize,b'\0'),int(guesses['mapID']),partOne,*partTwo))
+	records.sort(key=lambda r:r[:sarIDSize])
+	meta={'repeaters':repeaters,'locations':locations,'letters':letters,'count':len(records),'rowSize':rowSize,'recordSize':struct.calcsize(recordFormat)}
+	writeArchive(fileName,responseMagic,meta,b''.join(records))
+	return len(records)
+
+class Archive():
+	def __init__(self,fileName,magic):
+		self.f=open(fileName,'rb')
+		self.mm=mmap.mmap(self.f.fileno(),0,access=mmap.ACCESS_READ)
+		self.view=memoryview(self.mm)
+		if bytes(self.view[:8])!=magic:
+			raise ValueError(fileName+' is not a '+magic[:-1].decode()+' archive')
+		(metaLength,)=struct.unpack_from('<I',self.view,8)
+		self.meta=json.loads(bytes(self.view[12:12+metaLength]))
+		self.dataOffset=pad4(12+metaLength)
+		self.repeaters=self.meta['repeaters']
+		self.locations=self.meta['locations']
+		self.letters=self.meta['letters']
+		self.count=self.meta['count']
+
+	def __len__(self):
+		return self.count
+
+	def close(self):
+		self.view.release()
+		self.mm.close()
+		self.f.close()
+
+class KeyArchive(Archive):
+	def __init__(self,fileName):
+		Archive.__init__(self,fileName,keyMagic)
+		n=self.count
+		self.rowSize=self.meta['rowSize']
+		self.mapIDs=self.view[self.dataOffset:self.dataOffset+4*n].cast('i')
+		self.keysOffset=self.dataOffset+4*n
+		masksOffset=self.keysOffset+self.rowSize*n
+		masks=self.view[masksOffset:masksOffset+12*len(self.locations)].cast('I')
+		self.partTwoMasks=[(masks[3*l],masks[3*l+1],masks[3*l+2]) for l in range(len(self.locations))]
+
+	def position(self,mapID):
+		i=bisect.bisect_left(self.mapIDs,int(mapID))
+		if i<self.count and self.mapIDs[i]==int(mapID):
+			return i
+		return None
+
+	# the key row for one map (a memoryview of the mapped file), or None
+	def key(self,mapID):
+		i=self.position(mapID)
+		if i is None:
+			return None
+		start=self.keysOffset+i*self.rowSize
+		return self.view[start:start+len(self.repeaters)]
+
+	# the same key as the solutionDicts['partOne'] entry: repeater : letter
+	def keyDict(self,mapID):
+		row=self.key(mapID)
+		return decodeKey(row,self.repeaters,self.letters) if row is not None else None
+
+	def partTwoSolution(self):
+		return {location:{c:decodeMask(m,self.repeaters) for (c,m) in zip(['required','optional','unlikely'],self.partTwoMasks[l])}
+			for (l,location) in enumerate(self.locations)}
+
+	# numpy views: (mapIDs, keys[map][repeater])
+	def keysArray(self):
+		import numpy as np
+		mapIDs=np.frombuffer(self.mm,dtype='<i4',count=self.count,offset=self.dataOffset)
+		keys=np.frombuffer(self.mm,dtype=np.uint8,count=self.count*self.rowSize,offset=self.keysOffset).reshape(self.count,self.rowSize)[:,:len(self.repeaters)]
+		return (mapIDs,keys)
+
+# a sequence of the SAR number field of each record, for bisect
+class SARIDColumn():
+	def __init__(self,archive):
+		self.a=archive
+
+	def __len__(self):
+		return self.a.count
+
+	def __getitem__(self,i):
+		start=self.a.dataOffset+i*self.a.recordSize
+		return self.a.view[start:start+sarIDSize].tobytes()
+
+class ResponseArchive(Archive):
+	def __init__(self,fileName):
+		Archive.__init__(self,fileName,responseMagic)
+		self.rowSize=self.meta['rowSize']
+		self.recordSize=self.meta['recordSize']
+		self.sarIDColumn=SARIDColumn(self)
+
+	def position(self,sarID):
+		target=str(sarID).encode('ascii').ljust(sarIDSize,b'\0')
+		i=bisect.bisect_left(self.sarIDColumn,target)
+		if i<self.count and self.sarIDColumn[i]==target:
+			return i
+		return None
+
+	def recordStart(self,i):
+		return self.dataOffset+i*self.recordSize
+
+	def sarID(self,i):
+		return self.sarIDColumn[i].rstrip(b'\0').decode('ascii')
+
+	def mapID(self,i):
+		return struct.unpack_from('<i',self.view,self.recordStart(i)+sarIDSize)[0]
+
+	# partOne row (memoryview) and partTwo masks (memoryview of uint32) of record i
+	def partOne(self,i):
+		start=self.recordStart(i)+sarIDSize+4
+		return self.view[start:start+len(self.repeaters)]
+
+	def partTwo(self,i):
+		start=self.recordStart(i)+sarIDSize+4+self.rowSize
+		return self.view[start:start+4*len(self.locations)].cast('I')
+
+	def __iter__(self):
+		for i in range(self.count):
+			yield (self.sarID(i),self.mapID(i),self.partOne(i),self.partTwo(i))
+
+	# numpy views: (sarIDs, mapIDs, partOne[record][repeater], partTwo[record][location])
+	def responseArrays(self):
+		import numpy as np
+		dtype=np.dtype([('sarID','S'+str(sarIDSize)),('mapID','<i4'),('partOne',np.uint8,(self.rowSize,)),('partTwo','<u4',(len(self.locations),))])
+		records=np.frombuffer(self.mm,dtype=dtype,count=self.count,offset=self.dataOffset)
+		return (records['sarID'],records['mapID'],records['partOne'][:,:len(self.repeaters)],records['partTwo'])
+
+def popcount(x):
+	return bin(x).count('1')
+
+# score one response from its key row and masks, with the same rules as gradeResponse:
+#  returns (partOne correct count, list of partTwo points per location)
+def scoreCodes(keyRow,partOneRow,partTwoMasks,responseMasks,weights=partTwoWeights):
+	correct=sum(1 for (k,g) in zip(keyRow,partOneRow) if k==g)
+	points=[]
+	for ((required,optional,unlikely),selected) in zip(partTwoMasks,responseMasks):
+		missed=popcount(required&~selected)
+		p=weights['allRequired'] if missed==0 else weights['allButOneRequired'] if missed==1 else 0
+		p+=weights['optional']*popcount(optional&selected)+weights['unlikely']*popcount(unlikely&selected)
+		points.append(p)
+	return (correct,points)
+
+# the grade string that gradeResponse would give, for every record in the response archive
+#  returns a dict: key = SAR number, val = grade (None if the map has no key)
+def gradeArchive(keys,responses,weights=partTwoWeights):
+	targetScore=weights['target']*len(responses.locations)
+	grades={}
+	for (sarID,mapID,partOne,partTwo) in responses:
+		keyRow=keys.key(mapID)
+		if keyRow is None:
+			grades[sarID]=None
+			continue
+		(correct,points)=scoreCodes(keyRow,partOne,keys.partTwoMasks,partTwo,weights)
+		grades[sarID]='Part One: '+str(round(float(correct/len(responses.repeaters)*100)))+'%    Part Two: '+str(round(float(sum(points)/targetScore*100)))+'%'
+	return grades
@@ -0,0 +1,148 @@
+# collusion.py - look for suspiciously similar submissions across all members
+
+# each member has a unique letter layout, so a copied partOne shows up as the same
+#  map positions chosen for each repeater, through different letters; each submission
+#  is therefore mapped back to a canonical form first:
+#   partOne: for each repeater (row), the index of the repeater whose map position
+#    the member picked (i.e. row n is correct when canonical[n]==n)
+#   partTwo: the repeater names selected at each location (already layout-independent)
+#
+# correct answers are shared by every good submission, so similarity is measured on
+#  the 'unusual' choices only: partOne wrong answers, and partTwo selections that differ
+#  from the required list (optional or unlikely repeaters selected, required ones left out)
+#
+# similar pairs are found with MinHash signatures and locality-sensitive hashing
+#  (banding), so only candidate pairs are compared in detail, instead of every pair
+#
+# requires numpy
+
+import json
+import zlib
+import logging
+import itertools
+import numpy as np
+from responses import parsePartOne,parsePartTwo
+
+# 32-bit universal hashes (a*x+b) mod p, with p prime > 2**32; a and x are both < 2**32,
+#  so a*x+b fits in a uint64
+hashPrime=np.uint64(4294967311)
+
+# read submissions (extracted jotform data) from .json files (one submission, or a list
+#  of submissions) and/or .jsonl files (one submission per line)
+def loadSubmissions(fileNames):
+	submissions=[]
+	for fileName in fileNames:
+		with open(fileName,'r') as f:
+			if fileName.endswith('.jsonl'):
+				submissions+=[json.loads(line) for line in f if line.strip()]
+			else:
+				j=json.load(f)
+				submissions+=j if isinstance(j,list) else [j]
+	return submissions
+
+# partOne letters (one per repeater row) --> canonical repeater indices (-1 = no valid answer)
+def canonicalPartOne(letters,key,repeaters):
+	repeaterAtLetter={v:k for k,v in key.items()}
+	repeaterIndex={r:n for (n,r) in enumerate(repeaters)}
+	return [repeaterIndex.get(repeaterAtLetter.get(letter),-1) for letter in letters]
+
+# returns a dict with the canonical form and the 'unusual choice' feature set of one
+#  submission, or None if the submission can't be mapped (unknown mapID, missing parts)
+def canonicalSubmission(responseDict,solutionDicts,repeaters,locations):
+	sarID=str(responseDict.get('SARNumber'))
+	mapID=str(responseDict.get('mapID'))
+	key=solutionDicts['partOne'].get(mapID,None)
+	if not key or not responseDict.get('partOne') or not responseDict.get('partTwo'):
+		logging.info('collusion check: skipping SAR '+sarID+' map ID '+mapID+': no key or incomplete response')
+		return None
+	partOne=canonicalPartOne(parsePartOne(responseDict['partOne']),key,repeaters)
+	partTwo=parsePartTwo(responseDict['partTwo'])
+	features=set()
+	wrong=set()
+	for (n,c) in enumerate(partOne):
+		if c!=n:
+			features.add('p1:'+str(n)+':'+str(c))
+			wrong.add('p1:'+str(n)+':'+str(c))
+	for (n,location) in enumerate(locations[:len(partTwo)]):
+		solution=solutionDicts['partTwo'][location]
+		selected=set(partTwo[n])
+		for r in selected-set(solution['required']):
+			features.add('p2:'+str(n)+':+'+r)
+			if r in solution['unlikely']:
+				wrong.add('p2:'+str(n)+':+'+r)
+		for r in set(solution['required'])-selected:
+			features.add('p2:'+str(n)+':-'+r)
+			wrong.add('p2:'+str(n)+':-'+r)
+	return {
+		'sarID':sarID,
+		'mapID':mapID,
+		'partOne':partOne,
+		'partTwo':partTwo,
+		'features':features,
+		'wrong':wrong
+	}
+
+def minhashSignatures(featureSets,numHashes=64,seed=0):
+	rng=np.random.default_rng(seed)
+	a=rng.integers(1,2**32,numHashes,dtype=np.uint64)
+	b=rng.integers(0,2**32,numHashes,dtype=np.uint64)
+	signatures=np.full((len(featureSets),numHashes),np.iinfo(np.uint64).max,dtype=np.uint64)
+	for (i,features) in enumerate(featureSets):
+		if features:
+			x=np.array([zlib.crc32(f.encode()) for f in features],dtype=np.uint64)
+			signatures[i]=((x[:,None]*a+b)%hashPrime).min(axis=0)
+	return signatures
+
+# LSH banding: two submissions become a candidate pair if all rows of at least one band
+#  of their signatures match; with bands*rows=numHashes, pairs with Jaccard similarity
+#  above roughly (1/bands)**(1/rows) are found with high probability
+def candidatePairs(signatures,bands=16,skip=()):
+	rows=signatures.shape[1]//bands
+	pairs=set()
+	for band in range(bands):
+		buckets={}
+		for (i,sig) in enumerate(signatures[:,band*rows:(band+1)*rows]):
+			if i in skip:
+				continue
+			buckets.setdefault(sig.tobytes(),[]).append(i)
+		for members in buckets.values():
+			pairs.update(itertools.combinations(members,2))
+	return pairs
+
+def comparePair(s1,s2):
+	shared=s1['features']&s2['features']
+	union=s1['features']|s2['features']
+	sharedWrong=s1['wrong']&s2['wrong']
+	return {
+		'sarIDs':[s1['sarID'],s2['sarID']],
+		'mapIDs':[s1['mapID'],s2['mapID']],
+		'jaccard':round(len(shared)/len(union),3) if union else 1.0,
+		'partOneSame':sum(1 for (c1,c2) in zip(s1['partOne'],s2['partOne']) if c1==c2),
+		'partOneSharedWrong':len([f for f in sharedWrong if f.startswith('p1:')]),
+		'partTwoSharedWrong':len([f for f in sharedWrong if f.startswith('p2:')]),
+		'sharedWrong':sorted(sharedWrong)
+	}
+
+# returns a list of suspicious pairs, most suspicious first
+#  threshold: minimum Jaccard similarity of the unusual choices
+#  minSharedWrong: minimum number of identical wrong answers (partOne and partTwo combined)
+def findSuspiciousPairs(submissions,solutionDicts,repeaters,locations,threshold=0.5,minSharedWrong=3,numHashes=64,bands=16):
+	canonical=[]
+	for responseDict in submissions:
+		c=canonicalSubmission(responseDict,solutionDicts,repeaters,locations)
+		if c:
+			canonical.append(c)
+	signatures=minhashSignatures([c['features'] for c in canonical],numHashes)
+	# perfect submissions have no unusual choices, so there is nothing to compare
+	skip={i for (i,c) in enumerate(canonical) if not c['features']}
+	pairs=candidatePairs(signatures,bands,skip)
+	logging.info('collusion check: '+str(len(canonical))+' submissions, '+str(len(pairs))+' candidate pairs')
+	suspicious=[]
+	for (i,j) in pairs:
+		if canonical[i]['sarID']==canonical[j]['sarID']:
+			continue # resubmission by the same member
+		result=comparePair(canonical[i],canonical[j])
+		if result['jaccard']>=threshold and result['partOneSharedWrong']+result['partTwoSharedWrong']>=minSharedWrong:
+			suspicious.append(result)
+	suspicious.sort(key=lambda r:(r['partOneSharedWrong']+r['partTwoSharedWrong'],r['jaccard']),reverse=True)
+	return suspicious
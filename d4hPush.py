@@ -0,0 +1,270 @@
+# d4hPush.py - batched push of repeater test qualifications to D4H
+
+# a passing grade used to live only in testDict and the graded results email, and each
+#  member's qualification was then entered in D4H by hand; pushQualifications finds the
+#  members who have passed since the last push and sends their qualifications to D4H in
+#  batches of batchSize members per request:
+#   POST <url>/team/qualifications/<qualification id>/members
+#   {"members":[{"member_id":<D4H member id>,"start_date":"2024-01-30","notes":"..."},...]}
+#
+# - one D4HSession per run keeps a single keep-alive connection to D4H for all of the
+#   batches (reconnecting if it drops), instead of a new connection per request
+# - each request is retried (with backoff, or after Retry-After) on a connection error,
+#   429 or 5xx; any other error fails just that batch, and the run goes on
+# - each batch carries an Idempotency-Key header derived from the qualification and the
+#   batch contents, so a retry of a request whose response was lost, or a re-run with the
+#   same batches, is not applied twice
+# - a pass is judged from the entry's pct, or from its grade text for entries graded before
+#   pct was stored; entries without a test are pushed once, like any other
+# - a member who passed is recorded in testDict as 'd4hQualification' (test, time,
+#   idempotency key) once their batch succeeds, so the next run only pushes new passes (or
+#   passes on a newer test); the batch's members are updated together, in one transaction
+#   (see stateStore.py)
+# - dryRun builds the batches and logs them, without sending anything or changing testDict
+#
+# D4H member ids come from the member index or the members export (the testDict entries
+#  only have the SAR number, which is the D4H 'ref'); members without one are skipped
+#
+# D4HStandIn is a local stand-in for the D4H endpoint (a small http server on localhost),
+#  which keeps the qualifications it receives, honours the idempotency keys, and can fail
+#  the first few requests; 'repeaterTest.py d4h-push --stand-in' runs against it
+#
+# this module only uses the standard library
+
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import http.client
+import http.server
+import urllib.parse
+from stateStore import loadMembers,updateMembers
+from operatorDigest import gradePct
+
+d4hURL='https://api.d4h.org/v2'
+batchSize=50
+passPct={'partOne':80,'partTwo':80}
+retryStatuses=[429,500,502,503,504]
+
+#########################################################
+# http session
+#########################################################
+
+class D4HError(Exception):
+	pass
+
+class D4HSession():
+	def __init__(self,url=d4hURL,token=None,timeout=30,retries=4,backoff=1.0):
+		u=urllib.parse.urlsplit(url)
+		self.https=u.scheme=='https'
+		self.host=u.hostname
+		self.port=u.port
+		self.basePath=u.path.rstrip('/')
+		self.token=token
+		self.timeout=timeout
+		self.retries=retries
+		self.backoff=backoff
+		self.conn=None
+		self.stats={'requests':0,'retries':0,'connections':0}
+
+	def connection(self):
+		if self.conn is None:
+			c=http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+			self.conn=c(self.host,self.port,timeout=self.timeout)
+			self.stats['connections']+=1
+		return self.conn
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn=None
+
+	# returns (status, decoded json body or None); raises D4HError when the retries run out
+	def request(self,method,path,body=None,headers={}):
+		data=json.dumps(body).encode() if body is not None else None
+		h={'Accept':'application/json'}
+		if data is not None:
+			h['Content-Type']='application/json'
+		if self.token:
+			h['Authorization']='Bearer '+self.token
+		h.update(headers)
+		for attempt in range(self.retries+1):
+			wait=self.backoff*2**attempt*(0.5+random.random()/2)
+			try:
+				self.stats['requests']+=1
+				conn=self.connection()
+				conn.request(method,self.basePath+path,body=data,headers=h)
+				response=conn.getresponse()
+				raw=response.read()
+				status=response.status
+				if response.will_close:
+					self.close()
+			except (OSError,http.client.HTTPException) as e:
+				self.close()
+				error='connection error: '+str(e)
+			else:
+				if status not in retryStatuses:
+					try:
+						return (status,json.loads(raw) if raw else None)
+					except ValueError:
+						return (status,None)
+				error='HTTP '+str(status)
+				retryAfter=response.getheader('Retry-After')
+				if retryAfter and retryAfter.isdigit():
+					wait=float(retryAfter)
+			if attempt<self.retries:
+				logging.info('  D4H '+method+' '+path+': '+error+'; retrying in '+str(round(wait,1))+' seconds')
+				self.stats['retries']+=1
+				time.sleep(wait)
+		raise D4HError(method+' '+path+': '+error+' (after '+str(self.retries+1)+' attempts)')
+
+#########################################################
+# qualifications
+#########################################################
+
+# the scores come from the stored pct, or from the grade text of entries graded before pct
+#  was stored (see operatorDigest.gradePct)
+def passed(member,pct=passPct):
+	scores=dict(zip(['partOne','partTwo'],gradePct(member)))
+	return all(scores.get(part,None) is not None and float(scores[part])>=p for (part,p) in pct.items())
+
+# SAR numbers of the members who passed and haven't had a qualification pushed for that test;
+#  an entry without a test (graded before the test was stored) counts as pushed once it
+#  has any d4hQualification
+def newlyPassed(testDict,pct=passPct):
+	def pushed(member):
+		q=member.get('d4hQualification',None)
+		return q is not None and (member.get('test',None) is None or q.get('test',None)==member['test'])
+	return [sarID for (sarID,member) in testDict.items() if passed(member,pct) and not pushed(member)]
+
+def qualificationEntry(memberID,member):
+	# the graded time, e.g. 'Tue Jan 30 2024 19:02:11'
+	try:
+		startDate=time.strftime('%Y-%m-%d',time.strptime(member['graded'],'%a %b %d %Y %H:%M:%S'))
+	except (KeyError,ValueError):
+		startDate=time.strftime('%Y-%m-%d')
+	return {
+		'member_id':memberID,
+		'start_date':startDate,
+		'notes':'Repeater Test '+(str(member['test'])+': ' if member.get('test',None) else '')+str(member.get('grade',''))
+	}
+
+def idempotencyKey(qualificationID,entries):
+	return hashlib.sha256(json.dumps([str(qualificationID),entries],sort_keys=True).encode()).hexdigest()[:32]
+
+# push the qualifications of every newly passed member in testDictFile
+#  memberIDs: key = SAR number (D4H ref), val = D4H member id
+#  session: a D4HSession (not used if dryRun)
+#  returns a report: passed, pushed, batches, skipped and failed (key = SAR number, val = reason)
+def pushQualifications(testDictFile,memberIDs,qualificationID,session=None,pct=passPct,size=batchSize,dryRun=False):
+	testDict=loadMembers(testDictFile)
+	sarIDs=newlyPassed(testDict,pct)
+	report={'passed':len(sarIDs),'pushed':0,'batches':0,'skipped':{},'failed':{}}
+	ready=[]
+	for sarID in sarIDs:
+		memberID=memberIDs.get(str(sarID),None)
+		if memberID is None:
+			report['skipped'][sarID]='no D4H member id'
+		else:
+			ready.append(sarID)
+	path='/team/qualifications/'+urllib.parse.quote(str(qualificationID))+'/members'
+	for start in range(0,len(ready),size):
+		batch=ready[start:start+size]
+		entries=[qualificationEntry(memberIDs[str(sarID)],testDict[sarID]) for sarID in batch]
+		key=idempotencyKey(qualificationID,entries)
+		report['batches']+=1
+		if dryRun:
+			logging.info('  dry run: batch '+str(report['batches'])+' ('+str(len(batch))+' members, key '+key+'): '+' '.join(batch))
+			continue
+		try:
+			(status,body)=session.request('POST',path,{'members':entries},{'Idempotency-Key':key})
+		except D4HError as e:
+			error=str(e)
+		else:
+			error=None if 200<=status<300 else 'HTTP '+str(status)+': '+json.dumps(body)
+		if error:
+			logging.info('ERROR: D4H qualification batch '+str(report['batches'])+' not pushed: '+error)
+			report['failed'].update({sarID:error for sarID in batch})
+			continue
+		pushed={'pushed':time.strftime('%a %b %d %Y %H:%M:%S'),'key':key}
+		updateMembers(testDictFile,{sarID:{'d4hQualification':dict(pushed,test=testDict[sarID].get('test',None))} for sarID in batch})
+		report['pushed']+=len(batch)
+	return report
+
+#########################################################
+# local stand-in
+#########################################################
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version='HTTP/1.1'
+
+	def setup(self):
+		super().setup()
+		self.server.standIn.stats['connections']+=1
+
+	def log_message(self,format,*args):
+		pass
+
+	def reply(self,status,body,headers={}):
+		data=json.dumps(body).encode()
+		self.send_response(status)
+		self.send_header('Content-Type','application/json')
+		self.send_header('Content-Length',str(len(data)))
+		for (k,v) in headers.items():
+			self.send_header(k,v)
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_POST(self):
+		standIn=self.server.standIn
+		body=self.rfile.read(int(self.headers.get('Content-Length',0) or 0))
+		parts=self.path.strip('/').split('/')
+		with standIn.lock:
+			standIn.stats['requests']+=1
+			if standIn.failures>0:
+				standIn.failures-=1
+				self.reply(503,{'error':'stand-in failure'},{'Retry-After':'0'})
+				return
+			if standIn.token and self.headers.get('Authorization','')!='Bearer '+standIn.token:
+				self.reply(401,{'error':'unauthorized'})
+				return
+			if len(parts)<5 or parts[-4:-2]!=['team','qualifications'] or parts[-1]!='members':
+				self.reply(404,{'error':'no such endpoint'})
+				return
+			key=self.headers.get('Idempotency-Key',None)
+			if key and key in standIn.responses:
+				standIn.stats['replayed']+=1
+				self.reply(200,standIn.responses[key])
+				return
+			try:
+				members=json.loads(body)['members']
+			except (ValueError,KeyError,TypeError):
+				self.reply(400,{'error':'bad request body'})
+				return
+			qualification=standIn.qualifications.setdefault(parts[-2],[])
+			qualification.extend(members)
+			response={'statusCode':200,'data':{'added':len(members)}}
+			if key:
+				standIn.responses[key]=response
+			self.reply(200,response)
+
+class D4HStandIn():
+	# failures: the number of requests to answer 503 before working normally
+	def __init__(self,token=None,failures=0):
+		self.token=token
+		self.failures=failures
+		self.lock=threading.Lock()
+		self.qualifications={} # key = qualification id, val = list of member entries received
+		self.responses={} # key = idempotency key, val = response body
+		self.stats={'requests':0,'connections':0,'replayed':0}
+		self.server=http.server.ThreadingHTTPServer(('127.0.0.1',0),StandInHandler)
+		self.server.daemon_threads=True
+		self.server.standIn=self
+		self.url='http://127.0.0.1:'+str(self.server.server_address[1])+'/v2'
+		threading.Thread(target=self.server.serve_forever,daemon=True).start()
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
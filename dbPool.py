@@ -0,0 +1,161 @@
+# dbPool.py - persistent sqlite connections for the sign-in database calls in signin_api
+
+# the sdb* functions in signin_db open a new sqlite connection for each call and close it
+#  when done; each open re-reads the schema and starts with an empty page cache and an
+#  empty prepared statement cache, which is most of the cost of a small polling query
+#
+# ConnectionPool.connect is a drop-in for sqlite3.connect: it hands out a connection
+#  from this worker's idle connections to the same database file (or opens one), and
+#  close() gives it back instead of closing it:
+#   - each connection is opened once with check_same_thread=False (it's only ever used
+#     by one request at a time), a large prepared statement cache (cachedStatements),
+#     and the pragmas below (WAL, so readers don't wait for a writer)
+#   - on release, an uncommitted transaction is rolled back (as closing would have done),
+#     and row_factory / text_factory are reset
+#   - connections that a request didn't close are released at request teardown
+#   - after a fork (e.g. a pre-loading multi-process server), the child drops the
+#     parent's connections and opens its own
+# installPool(module,pool) points a module's sqlite3.connect at the pool, so signin_db
+#  itself doesn't need to change; this only works if signin_db opens its connections
+#  itself, at call time, through one of its own module globals:
+#   import sqlite3 (or import sqlite3 as <name>), then sqlite3.connect(...) in each sdb* call
+#   from sqlite3 import connect (or ... as <name>), then connect(...) in each sdb* call
+#  it does NOT work if the connections are opened by another module that signin_db calls,
+#  through sqlite3.dbapi2, or once at import time and kept; installPool then returns
+#  False, signin_api logs an ERROR at start-up, and /api/v1/dbPool reports
+#  "installed": false
+#
+# this module only uses the standard library
+
+import os
+import types
+import sqlite3
+import threading
+
+defaultPragmas=[
+	'PRAGMA journal_mode=WAL', # persistent in the database file; readers and the writer don't block each other
+	'PRAGMA synchronous=NORMAL', # with WAL: still safe, and commits don't wait for an fsync
+	'PRAGMA busy_timeout=5000',
+	'PRAGMA cache_size=-8000', # 8MB page cache per connection
+	'PRAGMA temp_store=MEMORY'
+]
+
+class PooledConnection():
+	def __init__(self,pool,key,conn):
+		object.__setattr__(self,'_pool',pool)
+		object.__setattr__(self,'_key',key)
+		object.__setattr__(self,'_conn',conn)
+
+	def _connection(self):
+		if self._conn is None:
+			raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+		return self._conn
+
+	def __getattr__(self,name):
+		return getattr(self._connection(),name)
+
+	def __setattr__(self,name,value):
+		setattr(self._connection(),name,value)
+
+	def __enter__(self):
+		self._connection().__enter__()
+		return self
+
+	def __exit__(self,*args):
+		return self._connection().__exit__(*args)
+
+	def close(self):
+		self._pool.release(self)
+
+class ConnectionPool():
+	def __init__(self,pragmas=defaultPragmas,maxIdle=8,cachedStatements=256):
+		self.pragmas=list(pragmas)
+		self.maxIdle=maxIdle
+		self.cachedStatements=cachedStatements
+		self.lock=threading.Lock()
+		self.idle={} # key = (database, detect_types), val = list of connections
+		self.local=threading.local() # checkedOut: the connections handed out to this thread
+		self.pid=os.getpid()
+		self.stats={'opened':0,'reused':0}
+
+	def checkedOut(self):
+		if not hasattr(self.local,'checkedOut'):
+			self.local.checkedOut=set()
+		return self.local.checkedOut
+
+	def open(self,database,timeout,detectTypes):
+		conn=sqlite3.connect(database,timeout=timeout,detect_types=detectTypes,check_same_thread=False,cached_statements=self.cachedStatements)
+		for pragma in self.pragmas:
+			conn.execute(pragma).fetchall()
+		return conn
+
+	# same arguments as sqlite3.connect; anything other than a database file with the
+	#  default settings gets a plain, unpooled connection
+	def connect(self,database,timeout=5.0,detect_types=0,check_same_thread=True,**kwargs):
+		if kwargs or database==':memory:' or str(database).startswith('file:'):
+			return sqlite3.connect(database,timeout=timeout,detect_types=detect_types,check_same_thread=check_same_thread,**kwargs)
+		key=(os.path.abspath(database),detect_types)
+		with self.lock:
+			if os.getpid()!=self.pid:
+				# connections must not be used across a fork; just forget the parent's
+				self.idle={}
+				self.pid=os.getpid()
+			idle=self.idle.get(key,None)
+			conn=idle.pop() if idle else None
+			self.stats['reused' if conn else 'opened']+=1
+		if conn is None:
+			conn=self.open(database,timeout,detect_types)
+		pooled=PooledConnection(self,key,conn)
+		self.checkedOut().add(pooled)
+		return pooled
+
+	def release(self,pooled):
+		conn=pooled._conn
+		if conn is None:
+			return
+		object.__setattr__(pooled,'_conn',None)
+		self.checkedOut().discard(pooled)
+		try:
+			if conn.in_transaction:
+				conn.rollback()
+			conn.row_factory=None
+			conn.text_factory=str
+		except sqlite3.Error:
+			conn.close()
+			return
+		with self.lock:
+			idle=self.idle.setdefault(pooled._key,[])
+			if len(idle)<self.maxIdle:
+				idle.append(conn)
+				return
+		conn.close()
+
+	# release every connection this thread still has (at the end of a request)
+	def releaseAll(self):
+		for pooled in list(self.checkedOut()):
+			self.release(pooled)
+
+	def close(self):
+		with self.lock:
+			for idle in self.idle.values():
+				for conn in idle:
+					conn.close()
+			self.idle={}
+
+# make module's sqlite3.connect use the pool; returns False if module doesn't get its
+#  connections in one of the supported ways (see the top of this file)
+def installPool(module,pool):
+	installed=False
+	shim=None
+	for (name,value) in list(vars(module).items()):
+		if value is sqlite3:
+			if shim is None:
+				shim=types.ModuleType('sqlite3')
+				shim.__dict__.update(sqlite3.__dict__)
+				shim.connect=pool.connect
+			setattr(module,name,shim)
+			installed=True
+		elif value is sqlite3.connect:
+			setattr(module,name,pool.connect)
+			installed=True
+	return installed
@@ -0,0 +1,174 @@
+# followUp.py - member status and follow-up jobs, kept in an index over testDict
+
+# each member's testDict entry is in exactly one status:
+#   unassigned - no mapID yet
+#   assigned - has a mapID, but the assignment email hasn't been sent
+#   awaitingSubmission - assignment sent, no graded submission yet
+#   gradedNotEmailed - graded, but the graded results email wasn't sent (gradedEmailSent missing)
+#   complete - graded results sent
+#
+# and has at most one follow-up job, due at a time given by the cadence:
+#   sendAssignment - for assigned members, if cadence['sendAssignments'] is set
+#   remind - for awaitingSubmission members: remindAfter seconds after the assignment was
+#     sent, then every remindEvery seconds, up to maxReminders reminders
+#   resendGraded - for gradedNotEmailed members with saved guesses: resendAfter seconds
+#     after grading (or after the last attempt), up to maxResends attempts
+#
+# FollowUpIndex keeps the members in sets by status and the jobs in a heap by due time,
+#  so the summary and the next batch of due jobs don't need a scan of testDict; when the
+#  members change (see stateStore.py), only the entries whose follow-up fields changed
+#  are re-indexed
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import time
+import heapq
+from stateStore import loadMembers,membersVersion
+
+timeFormat='%a %b %d %Y %H:%M:%S' # as written to testDict by sendTest and gradeResponse
+
+statuses=['unassigned','assigned','awaitingSubmission','gradedNotEmailed','complete']
+jobs=['sendAssignment','remind','resendGraded']
+
+defaultCadence={
+	'sendAssignments':False,
+	'remindAfter':3*86400,
+	'remindEvery':3*86400,
+	'maxReminders':2,
+	'resendAfter':600,
+	'maxResends':3
+}
+
+# the entry fields that the status and the due job depend on
+followUpFields=['mapID','assignmentSent','reminderSent','remindersSent','graded','gradedEmailSent','gradedResendAttempted','gradedResends']
+
+def parseTime(s):
+	return time.mktime(time.strptime(s,timeFormat)) if s else None
+
+def memberStatus(entry):
+	if entry.get('gradedEmailSent',None):
+		return 'complete'
+	if entry.get('graded',None):
+		return 'gradedNotEmailed'
+	if entry.get('assignmentSent',None):
+		return 'awaitingSubmission'
+	if entry.get('mapID',None):
+		return 'assigned'
+	return 'unassigned'
+
+# returns (due epoch, job) for one member, or None if nothing is due now or later
+def dueJob(entry,cadence=defaultCadence):
+	status=memberStatus(entry)
+	if status=='assigned' and cadence['sendAssignments']:
+		return (0,'sendAssignment')
+	if status=='awaitingSubmission':
+		if entry.get('remindersSent',0)>=cadence['maxReminders']:
+			return None
+		due=parseTime(entry['assignmentSent'])+cadence['remindAfter']
+		last=parseTime(entry.get('reminderSent',None))
+		if last:
+			due=max(due,last+cadence['remindEvery'])
+		return (due,'remind')
+	if status=='gradedNotEmailed':
+		if entry.get('gradedResends',0)>=cadence['maxResends'] or not entry.get('guesses',None):
+			return None
+		due=parseTime(entry['graded'])+cadence['resendAfter']
+		last=parseTime(entry.get('gradedResendAttempted',None))
+		if last:
+			due=max(due,last+cadence['resendAfter'])
+		return (due,'resendGraded')
+	return None
+
+class FollowUpIndex():
+	def __init__(self,cadence=None):
+		self.cadence=dict(defaultCadence,**(cadence or {}))
+		self.byStatus={s:set() for s in statuses}
+		self.status={} # key = sarID, val = status
+		self.due={} # key = sarID, val = (due epoch, job)
+		self.jobCounts={j:0 for j in jobs}
+		self.heap=[] # (due epoch, sarID, job); entries that no longer match self.due are skipped
+		self.fingerprints={}
+		self.version=None
+
+	def update(self,sarID,entry):
+		self.fingerprints[sarID]=tuple(str(entry.get(k,'')) for k in followUpFields)+(bool(entry.get('guesses',None)),)
+		status=memberStatus(entry)
+		old=self.status.get(sarID,None)
+		if old!=status:
+			if old:
+				self.byStatus[old].discard(sarID)
+			self.byStatus[status].add(sarID)
+			self.status[sarID]=status
+		job=dueJob(entry,self.cadence)
+		old=self.due.get(sarID,None)
+		if job!=old:
+			if old:
+				self.jobCounts[old[1]]-=1
+				del self.due[sarID]
+			if job:
+				self.jobCounts[job[1]]+=1
+				self.due[sarID]=job
+				heapq.heappush(self.heap,(job[0],sarID,job[1]))
+
+	def remove(self,sarID):
+		status=self.status.pop(sarID,None)
+		if status:
+			self.byStatus[status].discard(sarID)
+		job=self.due.pop(sarID,None)
+		if job:
+			self.jobCounts[job[1]]-=1
+		self.fingerprints.pop(sarID,None)
+
+	# re-index the entries whose follow-up fields changed, and drop members that are gone
+	def refresh(self,testDict):
+		for (sarID,entry) in testDict.items():
+			fingerprint=tuple(str(entry.get(k,'')) for k in followUpFields)+(bool(entry.get('guesses',None)),)
+			if self.fingerprints.get(sarID,None)!=fingerprint:
+				self.update(sarID,entry)
+		if len(self.status)>len(testDict):
+			for sarID in [s for s in self.status if s not in testDict]:
+				self.remove(sarID)
+
+	# refresh from the member store (e.g. testDict.json), if it changed since the last call;
+	#  returns the testDict that was read, or None if the members haven't changed
+	def refreshFromStore(self,fileName):
+		# the version first: a write after it is seen by the next call
+		version=membersVersion(fileName)
+		if version==self.version:
+			return None
+		testDict=loadMembers(fileName)
+		self.refresh(testDict)
+		self.version=version
+		return testDict
+
+	# up to limit (sarID, job) pairs that are due at or before now, earliest first;
+	#  they stay in the index until update() is called with the member's new entry
+	def dueJobs(self,now=None,limit=None):
+		now=time.time() if now is None else now
+		out=[]
+		while self.heap and self.heap[0][0]<=now and (limit is None or len(out)<limit):
+			(due,sarID,job)=heapq.heappop(self.heap)
+			if self.due.get(sarID,None)==(due,job):
+				out.append((due,sarID,job))
+		for item in out:
+			heapq.heappush(self.heap,item)
+		return [(sarID,job) for (due,sarID,job) in out]
+
+	def nextDue(self):
+		while self.heap:
+			(due,sarID,job)=self.heap[0]
+			if self.due.get(sarID,None)==(due,job):
+				return {'sarID':sarID,'job':job,'due':time.strftime(timeFormat,time.localtime(due))}
+			heapq.heappop(self.heap)
+		return None
+
+	def summary(self):
+		return {
+			'members':len(self.status),
+			'status':{s:len(self.byStatus[s]) for s in statuses},
+			'pendingJobs':dict(self.jobCounts),
+			'nextDue':self.nextDue()
+		}
+
+	def members(self,status):
+		return sorted(self.byStatus[status])
@@ -0,0 +1,80 @@
+# gradedReport.py - the graded results report, rendered as plain text and compact html in one pass
+
+# gradeResponse builds the report as a list of lines, each one a (template name, fields)
+#  pair, instead of concatenating text; renderReport then writes both parts of the email
+#  in a single pass over the lines:
+#   text - the same layout as before (also used for summary.txt)
+#   html - one <pre> block, so the alignment and line breaks need no <br> or &nbsp;;
+#     field values are escaped, and scores are bold
+#  the html part is about the same size as the text part, rather than about six times it
+#
+# each template is compiled once, at import, into a list of (literal, field name) pieces
+#  for each part (with the html literals already escaped and tagged), so rendering a
+#  report is just joins; renderReports renders a batch (e.g. for regrade)
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import html
+import string
+
+# name : (text template, html tag or None)
+lineTemplates={
+	'blank':('',None),
+	'summaryHeader':('SAR{sarID} : Map ID {mapID} : {time}',None),
+	'summaryGrade':('{grade}','b'),
+	'summaryRule':('----------------------------------------',None),
+	'title':('NCSSAR Repeater Test - Results for SAR{sarID}  Map ID {mapID}','b'),
+	'mapIDRerouted':('NOTE: you entered Map ID {claimed}; your answers match your assigned Map ID {mapID}, so they were graded against it',None),
+	'doubleRule':('===================================',None),
+	'rule':('-----------------------------------',None),
+	'partOneHeading':('Part One - match map letters to repeater names','b'),
+	'partOneCorrect':('  CORRECT: {letter} = {repeater}',None),
+	'partOneIncorrect':('INCORRECT: {letter} = {repeater}  (you guessed {guessed})',None),
+	'partOneScore':('Part One Score: {pct}%  ({score} of {count})','b'),
+	'partTwoHeading':('Part Two - repeaters likely to work at listed locations','b'),
+	'location':('{location}:  you selected {selected}',None),
+	'partTwoCorrect':('    CORRECT: Your selections included all of the most likely repeaters ({required})',None),
+	'partTwoPartial':('    PARTIAL: Your selections included all but one of the most likely repeaters ({required})',None),
+	'partTwoIncorrect':('  INCORRECT: Your selections did not include all of the most likely repeaters ({required})',None),
+	'partTwoBonus':('      BONUS: You selected {count} of the other possible repeaters ({optional})',None),
+	'partTwoDeduction':('  DEDUCTION: You selected {count} of the highly-unlikely repeaters ({unlikely})',None),
+	'partTwoScore':('Part Two Score: {pct}%  (your score: {score}   target score: {target})','b'),
+	'error':('ERROR: {message}',None)
+}
+
+htmlHead='<pre style="font-family:monospace;font-size:13px">'
+htmlTail='</pre>'
+
+def compileTemplate(template,tag=None):
+	text=[]
+	htm=[]
+	for (literal,field,spec,conversion) in string.Formatter().parse(template):
+		text.append((literal,field))
+		htm.append((html.escape(literal,quote=False),field))
+	if tag:
+		htm[0]=('<'+tag+'>'+htm[0][0],htm[0][1])
+		htm.append(('</'+tag+'>',None))
+	return (text,htm)
+
+compiledTemplates={name:compileTemplate(t,tag) for (name,(t,tag)) in lineTemplates.items()}
+
+# lines: list of (template name, fields dict)
+#  returns (text, html)
+def renderReport(lines):
+	text=[]
+	htm=[]
+	for (name,fields) in lines:
+		(textPieces,htmlPieces)=compiledTemplates[name]
+		values={k:str(v) for (k,v) in fields.items()}
+		text.append(''.join([literal+values[field] if field else literal for (literal,field) in textPieces]))
+		htm.append(''.join([literal+html.escape(values[field],quote=False) if field else literal for (literal,field) in htmlPieces]))
+	return ('\n'.join(text),htmlHead+'\n'.join(htm)+htmlTail)
+
+# generator: (text, html) for each report in a batch of line lists
+def renderReports(reports):
+	for lines in reports:
+		yield renderReport(lines)
+
+# just the text part (e.g. for summary.txt)
+def renderText(lines):
+	return '\n'.join([''.join([literal+str(fields[field]) if field else literal for (literal,field) in compiledTemplates[name][0]]) for (name,fields) in lines])
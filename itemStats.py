@@ -0,0 +1,150 @@
+# itemStats.py - item-level results, updated incrementally by each grading run
+
+# the stats file holds running counts only, so it stays the same size no matter how many
+#  submissions have been graded; recording a result or reading the report costs the same
+#  for the first submission as for the thousandth
+#
+# only each member's latest submission is counted: when a member resubmits, gradeResponse
+#  replaces their previous submission's counts with the new one's (replaceResult), so the
+#  counts always match the 'guesses' in testDict, and regrade can rebase them exactly
+#
+# stats:
+#   repeaters, locations - the lists the counts are indexed by
+#   submissions - number of members with a graded submission (their latest one)
+#   partOne:
+#     attempts[r] - number of times repeater r was asked about
+#     misses[r] - number of times repeater r was answered incorrectly (or not at all)
+#     confusion[r][g] - number of times repeater r's letter was answered as repeater g
+#   partTwo: key = location
+#     responses - number of responses for this location
+#     required/optional/unlikely - offered: number of (response, repeater) chances to select
+#       a repeater of that category; selected: number of those that were selected
+#     selected - key = repeater name, val = number of times that repeater was selected here
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import json
+import os
+from stateStore import saveJSON,updateJSON
+from responses import parsePartOne,parsePartTwo
+
+categories=['required','optional','unlikely']
+
+def emptyStats(repeaters,locations):
+	n=len(repeaters)
+	return {
+		'repeaters':list(repeaters),
+		'locations':list(locations),
+		'submissions':0,
+		'partOne':{
+			'attempts':[0]*n,
+			'misses':[0]*n,
+			'confusion':[[0]*n for r in range(n)]
+		},
+		'partTwo':{
+			location:dict({'responses':0,'selected':{}},**{c:{'offered':0,'selected':0} for c in categories})
+			for location in locations
+		}
+	}
+
+def loadStats(fileName,repeaters,locations):
+	if not os.path.isfile(fileName):
+		return emptyStats(repeaters,locations)
+	with open(fileName,'r') as f:
+		return json.load(f)
+
+def saveStats(stats,fileName):
+	saveJSON(stats,fileName)
+
+# add one graded submission to the counts; weight=-1 removes a previously recorded one
+#  correctByLetter: letter : correct repeater name (the member's partOne key, inverted)
+#  guessedByLetter: letter : guessed repeater name (partOneResponseDict)
+#  partTwoSolution: solutionDicts['partTwo']
+#  partTwoResponseDict: location : list of selected repeater names
+def updateStats(stats,correctByLetter,guessedByLetter,partTwoSolution,partTwoResponseDict,weight=1):
+	repeaterIndex={r:n for (n,r) in enumerate(stats['repeaters'])}
+	stats['submissions']+=weight
+	partOne=stats['partOne']
+	for (letter,correct) in correctByLetter.items():
+		r=repeaterIndex[correct]
+		guessed=guessedByLetter.get(letter,None)
+		partOne['attempts'][r]+=weight
+		if guessed!=correct:
+			partOne['misses'][r]+=weight
+		if guessed in repeaterIndex:
+			partOne['confusion'][r][repeaterIndex[guessed]]+=weight
+	for (location,selected) in partTwoResponseDict.items():
+		s=stats['partTwo'].get(location,None)
+		solution=partTwoSolution.get(location,None)
+		if s is None or solution is None:
+			continue
+		s['responses']+=weight
+		for c in categories:
+			s[c]['offered']+=weight*len(solution[c])
+			s[c]['selected']+=weight*len([r for r in set(selected) if r in solution[c]])
+		for r in set(selected):
+			s['selected'][r]=s['selected'].get(r,0)+weight
+	return stats
+
+# load, update and save in one call, for use from gradeResponse; the file is locked
+#  for the whole update, so concurrent webhook requests don't lose each other's counts
+def recordResult(fileName,repeaters,locations,correctByLetter,guessedByLetter,partTwoSolution,partTwoResponseDict,weight=1):
+	def update(stats):
+		return updateStats(stats,correctByLetter,guessedByLetter,partTwoSolution,partTwoResponseDict,weight)
+	return updateJSON(fileName,update,emptyStats(repeaters,locations))
+
+# the updateStats arguments for a submission stored in testDict ('guesses'), graded against
+#  partOneKey (repeater name : letter) and partTwoSolution
+def guessesResult(guesses,partOneKey,partTwoSolution,repeaters,locations):
+	guessedByLetter={letter:repeaters[n] for (n,letter) in enumerate(parsePartOne(guesses['partOne'])[:len(repeaters)]) if letter}
+	partTwoResponseDict={locations[n]:s for (n,s) in enumerate(parsePartTwo(guesses['partTwo'])[:len(locations)])}
+	return ({v:k for (k,v) in partOneKey.items()},guessedByLetter,partTwoSolution,partTwoResponseDict)
+
+# replace a member's previously counted submission with their new one, in one locked update
+#  previous, new: updateStats arguments (see guessesResult), or None
+def replaceResult(fileName,repeaters,locations,previous,new):
+	def update(stats):
+		if previous:
+			updateStats(stats,*previous,weight=-1)
+		if new:
+			updateStats(stats,*new)
+		return stats
+	return updateJSON(fileName,update,emptyStats(repeaters,locations))
+
+def rate(num,den):
+	return round(num/den,3) if den else None
+
+# derived rates for the training officers; the work is fixed by the number of
+#  repeaters and locations, not by the number of submissions
+#  topConfusions: how many of the most frequent wrong pairings to list
+def statsReport(stats,topConfusions=10):
+	repeaters=stats['repeaters']
+	partOne=stats['partOne']
+	confusions=[]
+	for (r,row) in enumerate(partOne['confusion']):
+		for (g,count) in enumerate(row):
+			if g!=r and count>0:
+				confusions.append({'repeater':repeaters[r],'answeredAs':repeaters[g],'count':count})
+	confusions.sort(key=lambda c:c['count'],reverse=True)
+	return {
+		'submissions':stats['submissions'],
+		'partOneMissRate':{repeaters[r]:rate(partOne['misses'][r],partOne['attempts'][r]) for r in range(len(repeaters))},
+		'partOneConfusions':confusions[:topConfusions],
+		'partTwoSelectionRate':{
+			location:{c:rate(s[c]['selected'],s[c]['offered']) for c in categories}
+			for (location,s) in stats['partTwo'].items()
+		}
+	}
+
+# plain text version of statsReport, for the command line or a log
+def statsReportText(report):
+	lines=['Repeater test item statistics - '+str(report['submissions'])+' graded submissions','','Part One miss rate by repeater:']
+	for (r,missRate) in sorted(report['partOneMissRate'].items(),key=lambda x:-(x[1] or 0)):
+		lines.append('  '+r.ljust(14)+(str(round(missRate*100))+'%' if missRate is not None else '-'))
+	lines+=['','Most common confusions (repeater : answered as : count):']
+	for c in report['partOneConfusions']:
+		lines.append('  '+c['repeater'].ljust(14)+c['answeredAs'].ljust(14)+str(c['count']))
+	lines+=['','Part Two selection rate by location (required / optional / unlikely):']
+	for (location,rates) in report['partTwoSelectionRate'].items():
+		lines.append('  '+location.ljust(42)+' / '.join(str(round(rates[c]*100))+'%' if rates[c] is not None else '-' for c in categories))
+	return '\n'.join(lines)
@@ -0,0 +1,109 @@
+# keyIndex.py - find the answer keys that best match a part one response (map ID typos)
+
+# members type their map ID into the form by hand; with a typo, the response is graded
+#  against someone else's key, and part one comes out near zero (e.g. 1 of 24 in
+#  repeaterTest_graded_2111.txt), even though the answers match their own map well
+#
+# KeyIndex is an inverted index over all of the part one keys of a test: for each row
+#  (repeater) and letter, the positions of the keys that have that letter in that row;
+#  counting the matches of a response against every key is then one pass over 24
+#  posting lists of about (number of keys)/24 entries each, instead of a comparison with
+#  every key; a few thousand keys take well under a millisecond per lookup
+#
+# checkMapID decides what to do with a submission, given the best-matching keys, the
+#  claimed mapID's own matches, and the member's assigned mapID (from testDict):
+#   grade - the claimed mapID is fine (or there isn't enough evidence to say otherwise)
+#   reroute - the claimed mapID matches far worse than the best key (margin rows or
+#     more), the best key matches at least minMatches rows (a response that matches no
+#     key well is just a poor response), and the member's assigned mapID is one of the
+#     best matches: grade against the assigned mapID instead
+#   flag - the claimed mapID matches far worse than the best key but the assigned one
+#     isn't among the best, or the claimed mapID isn't the assigned one: grade as
+#     claimed, and record the check in testDict for the operator
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import json
+import heapq
+from array import array
+
+minMatches=8
+margin=6
+
+class KeyIndex():
+	# partOneKeys: solutionDicts['partOne'] (mapID : {repeater : letter})
+	def __init__(self,partOneKeys,repeaters,letters):
+		self.mapIDs=sorted(partOneKeys.keys(),key=int)
+		self.repeaters=repeaters
+		self.letterIndex={letter:n for (n,letter) in enumerate(letters)}
+		self.postings=[[array('I') for letter in letters] for repeater in repeaters]
+		for (i,mapID) in enumerate(self.mapIDs):
+			key=partOneKeys[mapID]
+			for (r,repeater) in enumerate(repeaters):
+				self.postings[r][self.letterIndex[key[repeater]]].append(i)
+		self.keys=partOneKeys
+
+	# letterList: parsePartOne output (the letter, or None, for each repeater row)
+	#  returns the number of matching rows for every key, in the order of self.mapIDs
+	def scores(self,letterList):
+		counts=[0]*len(self.mapIDs)
+		for (r,letter) in enumerate(letterList[:len(self.repeaters)]):
+			l=self.letterIndex.get(letter,None)
+			if l is None:
+				continue
+			for i in self.postings[r][l]:
+				counts[i]+=1
+		return counts
+
+	# the number of matching rows for one key, or None if there is no such key
+	def score(self,mapID,letterList):
+		key=self.keys.get(str(mapID),None)
+		if key is None:
+			return None
+		return sum(1 for (r,letter) in zip(self.repeaters,letterList) if letter and key[r]==letter)
+
+	# [(mapID, matching rows), ...] for the top best keys
+	def best(self,letterList,top=3):
+		counts=self.scores(letterList)
+		return [(self.mapIDs[i],counts[i]) for i in heapq.nlargest(top,range(len(counts)),key=counts.__getitem__)]
+
+# key indexes, by absolute file name: (mtime, KeyIndex); a changed file is re-indexed
+indexCache={}
+
+def loadKeyIndex(fileName,repeaters,letters):
+	fileName=os.path.abspath(fileName)
+	mtime=os.stat(fileName).st_mtime_ns
+	cached=indexCache.get(fileName,None)
+	if cached and cached[0]==mtime:
+		return cached[1]
+	with open(fileName,'r') as f:
+		index=KeyIndex(json.load(f),repeaters,letters)
+	indexCache[fileName]=(mtime,index)
+	return index
+
+# letterList: the response's parsePartOne output; indexes: the KeyIndex of each test
+#  whose keys the mapID could belong to; assigned: the member's mapID in testDict, or None
+#  returns a dict with 'action' ('grade', 'reroute' or 'flag'), 'mapID' (the one to
+#  grade against), 'reason', and the scores it was based on
+def checkMapID(claimed,letterList,indexes,assigned=None):
+	claimed=str(claimed)
+	assigned=str(assigned) if assigned is not None else None
+	best=[]
+	(claimedScore,assignedScore)=(None,None)
+	for index in indexes:
+		best+=index.best(letterList)
+		claimedScore=claimedScore if claimedScore is not None else index.score(claimed,letterList)
+		if assigned is not None and assignedScore is None:
+			assignedScore=index.score(assigned,letterList)
+	best=sorted(best,key=lambda b:-b[1])[:3]
+	bestScore=best[0][1] if best else 0
+	check={'claimed':claimed,'claimedScore':claimedScore,'assigned':assigned,'assignedScore':assignedScore,'best':best,'action':'grade','mapID':claimed,'reason':''}
+	farBelow=bestScore>=minMatches and (claimedScore is None or bestScore-claimedScore>=margin)
+	if farBelow and assignedScore is not None and bestScore-assignedScore<margin:
+		check.update(action='reroute',mapID=assigned,reason='map ID '+claimed+' matches '+str(claimedScore)+' rows; the assigned map ID '+assigned+' matches '+str(assignedScore))
+	elif farBelow:
+		check.update(action='flag',reason='map ID '+claimed+' matches '+str(claimedScore)+' rows; map ID '+str(best[0][0])+' matches '+str(bestScore))
+	elif assigned is not None and assigned!=claimed:
+		check.update(action='flag',reason='map ID '+claimed+' is not the assigned map ID '+assigned)
+	return check
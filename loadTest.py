@@ -0,0 +1,781 @@
+# loadTest.py - replay a realistic traffic mix against signin_api.app, concurrently
+
+# the sign-in database (signin_db), the D4H push (signin_push.sdbPush) and SendGrid are
+#  replaced by in-memory stand-ins, so this can run anywhere; each stand-in can be given
+#  a per-call latency to approximate the real thing (sqlite writes are serialized)
+#
+# traffic (scenario: request, default weight):
+#   poll - GET /api/v1/events?lastEditSince=... (every sign-in tablet polls), 50
+#   event - GET /api/v1/events/<id>, 10
+#   roster - GET /api/v1/roster, 5
+#   put - a burst of PUT /api/v1/events/<id> add-or-updates (a group signing in), 25
+#   new - POST /api/v1/events/new, 2
+#   finalize - POST /api/v1/finalize/<id>, 1
+#   webhook - POST /api/v1/jotform_webhook (a repeater test submission), 2
+#   snapshot - GET /api/v1/snapshot (a kiosk starting up), 0
+#  for the last --spike-fraction of the run, the webhook weight is multiplied by
+#  --spike-factor, like the rush of submissions at the test deadline
+#
+# modes:
+#   inprocess - flask test client, one per worker thread (default)
+#   serve - start a threaded werkzeug server on localhost and send real http requests
+#   serve-async - serve the ASGI app (asyncServe.py) under uvicorn on localhost instead,
+#     with a pool of --threads threads; SendGrid is a local http stand-in that takes --mail-latency to
+#     answer, since the async mailer posts to it directly
+#   url - send http requests to an already-running server at --url; the stand-ins only
+#     apply to a server started by this script, so use this against a test server
+#
+# --db sqlite: use a sqlite file for the sign-in database calls instead of dicts, with a
+#  connection per call like signin_db; signin_api pools the connections (see dbPool.py),
+#  and --no-pool turns that off, to compare the two
+#
+# --flood THREADS: while the mix runs, THREADS more threads poll /api/v1/events as fast
+#  as they can with one extra client key, like a misbehaving kiosk; each regular worker
+#  has its own key (a well-behaved kiosk), and with --pace, waits between requests; the
+#  check passes if the flood was shed (429) and no regular request was; the rate limits
+#  are from --rate-limits (default with --flood: rateLimits.json; otherwise no limits)
+#
+# --streams N: (serve modes) also keep N /api/v1/events/stream connections open for the
+#  whole run, like kiosks waiting for changes; the report gives the events they
+#  received and the most threads the process had at once
+#
+# --stress-webhook ROUNDS: instead of the mix, every member submits ROUNDS times to the
+#  webhook, all at once; afterwards testDict (testDict.sqlite) must hold one of each member's grades,
+#  summary.txt must have counted every submission, and itemStats.json must hold exactly
+#  the counts of each member's latest submission (recomputed from testDict)
+#
+# the request schedule comes from --seed, so runs are reproducible; the report gives
+#  throughput and p50/p95/p99 latency for each route, and is written as json to --out
+#
+# examples:
+#   python loadTest.py --requests 5000 --concurrency 16
+#   python loadTest.py --mode serve --concurrency 32 --db-latency 0.005 --mix poll=80,put=20
+#   python loadTest.py --mode serve --processes 4 --concurrency 32 --stress-webhook 3
+#   python loadTest.py --db sqlite --mix poll=80,event=15,roster=5 --no-pool
+#   python loadTest.py --mode serve-async --threads 8 --streams 200 --mail-latency 0.3
+#   python loadTest.py --flood 4 --concurrency 4 --pace 0.6 --requests 200 --mix poll=80,event=20
+
+import os
+import sys
+import json
+import time
+import types
+import queue
+import random
+import shutil
+import logging
+import sqlite3
+import argparse
+import tempfile
+import threading
+import asyncio
+import urllib.error
+import urllib.parse
+import urllib.request
+import benchmark
+import itemStats
+import repeaterTest as rt
+from stateStore import loadMembers
+
+apiKey='loadtest'
+floodKey='loadtest-flood'
+
+defaultMix={'poll':50,'event':10,'roster':5,'put':25,'new':2,'finalize':1,'webhook':2,'snapshot':0}
+
+#########################################################
+# in-memory stand-ins
+#########################################################
+
+# the subset of signin_db that signin_api uses, kept in dicts
+class MemorySigninDB():
+	def __init__(self,latency=0,events=20,roster=500):
+		self.latency=latency
+		self.lock=threading.Lock() # sqlite serializes writes
+		self.events={}
+		self.records={} # key = eventID, val = dict: key = (ID,Agency,Name,InEpoch), val = record
+		self.roster=[{'ID':str(100+i),'Name':'Member '+str(100+i),'Agency':'NCSSAR'} for i in range(roster)]
+		for n in range(events):
+			self.sdbNewEvent({'EventName':'Event '+str(n+1),'EventType':'Search','EventLocation':'Nevada County'})
+
+	def wait(self):
+		if self.latency:
+			time.sleep(self.latency)
+
+	def sdbNewEvent(self,d):
+		with self.lock:
+			self.wait()
+			eventID=len(self.events)+1
+			event=dict(d,EventID=eventID,LastEditEpoch=time.time(),EventStartEpoch=time.time(),Finalized=0)
+			self.events[eventID]=event
+			self.records[eventID]={}
+		return {'validate':event,'tableName':'E'+str(eventID).zfill(4)}
+
+	def sdbGetEvents(self,lastEditSince=0,eventStartSince=0,nonFinalizedOnly=False):
+		self.wait()
+		return [e for e in list(self.events.values())
+			if e['LastEditEpoch']>float(lastEditSince) and e['EventStartEpoch']>float(eventStartSince) and not (nonFinalizedOnly and e['Finalized'])]
+
+	# like signin_db: the event's records
+	def sdbGetEvent(self,eventID):
+		self.wait()
+		return list(self.records.get(eventID,{}).values())
+
+	def sdbGetRoster(self):
+		self.wait()
+		return self.roster
+
+	def getEventHTML(self,eventID):
+		self.wait()
+		rows=''.join('<tr><td>'+str(r.get('ID'))+'</td><td>'+str(r.get('Name'))+'</td></tr>' for r in list(self.records.get(eventID,{}).values()))
+		return '<html><body><table>'+rows+'</table></body></html>'
+
+	def sdbAddOrUpdate(self,eventID,d):
+		with self.lock:
+			self.wait()
+			records=self.records.setdefault(eventID,{})
+			key=(d.get('ID'),d.get('Agency'),d.get('Name'),round(float(d.get('InEpoch',0)),2))
+			records[key]=dict(records.get(key,{}),**d)
+			if eventID in self.events:
+				self.events[eventID]['LastEditEpoch']=time.time()
+			return {'validate':records[key]}
+
+	def sdbPush(self,eventID):
+		with self.lock:
+			self.wait()
+			if eventID not in self.events:
+				return {'statusCode':404,'message':'event '+str(eventID)+' not found'}
+			self.events[eventID]['Finalized']=1
+			return {'statusCode':200,'message':'event '+str(eventID)+' finalized; '+str(len(self.records[eventID]))+' records'}
+
+	# a module object that signin_api can 'from signin_db import *'
+	def modules(self):
+		signin_db=types.ModuleType('signin_db')
+		for name in ['sdbNewEvent','sdbGetEvents','sdbGetEvent','sdbGetRoster','getEventHTML','sdbAddOrUpdate']:
+			setattr(signin_db,name,getattr(self,name))
+		signin_push=types.ModuleType('signin_push')
+		signin_push.sdbPush=self.sdbPush
+		return {'signin_db':signin_db,'signin_push':signin_push}
+
+# the same calls on a sqlite file, opening a connection for each call the way signin_db
+#  does, so that the connection pool in signin_api (see dbPool.py) can be measured; the
+#  connections come from the generated module's sqlite3 global, which installPool replaces
+class SQLiteSigninDB(MemorySigninDB):
+	def __init__(self,fileName,latency=0,events=20,roster=500):
+		self.fileName=fileName
+		self.module=types.ModuleType('signin_db')
+		self.module.sqlite3=sqlite3
+		conn=sqlite3.connect(fileName)
+		conn.executescript('''
+			CREATE TABLE IF NOT EXISTS Events (EventID INTEGER PRIMARY KEY, EventName TEXT, EventType TEXT, EventLocation TEXT,
+				LastEditEpoch REAL, EventStartEpoch REAL, Finalized INTEGER);
+			CREATE TABLE IF NOT EXISTS Records (EventID INTEGER, ID TEXT, Agency TEXT, Name TEXT, InEpoch REAL, Data TEXT,
+				PRIMARY KEY (EventID, ID, Agency, Name, InEpoch));
+			CREATE TABLE IF NOT EXISTS Roster (ID TEXT PRIMARY KEY, Name TEXT, Agency TEXT);
+			CREATE INDEX IF NOT EXISTS EventsLastEdit ON Events (LastEditEpoch);''')
+		conn.close()
+		MemorySigninDB.__init__(self,latency,events,roster)
+		conn=sqlite3.connect(fileName)
+		conn.executemany('INSERT OR REPLACE INTO Roster VALUES (:ID,:Name,:Agency)',self.roster)
+		conn.commit()
+		conn.close()
+
+	def connect(self):
+		conn=self.module.sqlite3.connect(self.fileName)
+		conn.row_factory=sqlite3.Row
+		return conn
+
+	def sdbNewEvent(self,d):
+		conn=self.connect()
+		now=time.time()
+		cur=conn.execute('INSERT INTO Events (EventName,EventType,EventLocation,LastEditEpoch,EventStartEpoch,Finalized) VALUES (?,?,?,?,?,0)',
+			(d.get('EventName'),d.get('EventType'),d.get('EventLocation'),now,now))
+		eventID=cur.lastrowid
+		conn.commit()
+		event=dict(conn.execute('SELECT * FROM Events WHERE EventID=?',(eventID,)).fetchone())
+		conn.close()
+		self.events[eventID]=event
+		return {'validate':event,'tableName':'E'+str(eventID).zfill(4)}
+
+	def sdbGetEvents(self,lastEditSince=0,eventStartSince=0,nonFinalizedOnly=False):
+		conn=self.connect()
+		rows=conn.execute('SELECT * FROM Events WHERE LastEditEpoch>? AND EventStartEpoch>?'+(' AND Finalized=0' if nonFinalizedOnly else ''),
+			(float(lastEditSince),float(eventStartSince))).fetchall()
+		conn.close()
+		return [dict(r) for r in rows]
+
+	def sdbGetEvent(self,eventID):
+		conn=self.connect()
+		rows=conn.execute('SELECT Data FROM Records WHERE EventID=?',(eventID,)).fetchall()
+		conn.close()
+		return [json.loads(r['Data']) for r in rows]
+
+	def sdbGetRoster(self):
+		conn=self.connect()
+		rows=conn.execute('SELECT * FROM Roster').fetchall()
+		conn.close()
+		return [dict(r) for r in rows]
+
+	def getEventHTML(self,eventID):
+		conn=self.connect()
+		rows=conn.execute('SELECT ID,Name FROM Records WHERE EventID=?',(eventID,)).fetchall()
+		conn.close()
+		return '<html><body><table>'+''.join('<tr><td>'+str(r['ID'])+'</td><td>'+str(r['Name'])+'</td></tr>' for r in rows)+'</table></body></html>'
+
+	def sdbAddOrUpdate(self,eventID,d):
+		conn=self.connect()
+		conn.execute('INSERT OR REPLACE INTO Records VALUES (?,?,?,?,?,?)',
+			(eventID,d.get('ID'),d.get('Agency'),d.get('Name'),round(float(d.get('InEpoch',0)),2),json.dumps(d)))
+		conn.execute('UPDATE Events SET LastEditEpoch=? WHERE EventID=?',(time.time(),eventID))
+		conn.commit()
+		conn.close()
+		return {'validate':d}
+
+	def sdbPush(self,eventID):
+		conn=self.connect()
+		cur=conn.execute('UPDATE Events SET Finalized=1 WHERE EventID=?',(eventID,))
+		conn.commit()
+		conn.close()
+		if not cur.rowcount:
+			return {'statusCode':404,'message':'event '+str(eventID)+' not found'}
+		return {'statusCode':200,'message':'event '+str(eventID)+' finalized'}
+
+	def modules(self):
+		modules=MemorySigninDB.modules(self)
+		for name in ['sdbNewEvent','sdbGetEvents','sdbGetEvent','sdbGetRoster','getEventHTML','sdbAddOrUpdate']:
+			setattr(self.module,name,getattr(self,name))
+		modules['signin_db']=self.module
+		return modules
+
+class MemorySendGrid():
+	def __init__(self,latency=0):
+		self.latency=latency
+		self.lock=threading.Lock()
+		self.sent=[]
+
+	# called like SendGridAPIClient(apiKey)
+	def __call__(self,apiKey=None):
+		return self
+
+	def send(self,msg):
+		if self.latency:
+			time.sleep(self.latency)
+		with self.lock:
+			self.sent.append(msg)
+		return types.SimpleNamespace(status_code=202,body='',headers={})
+
+def workerKey(n):
+	return 'loadtest-kiosk'+str(n+1)
+
+# import signin_api with the stand-ins in place; returns the module
+#  workers: the number of regular client keys (see workerKey), besides floodKey
+#  rateLimits: the rate limits file, or None for no limits
+def loadSigninAPI(db,mailer,rtDir,workers=0,rateLimits=None):
+	sys.modules.update(db.modules())
+	import signin_api
+	from rateLimit import RateLimiter
+	signin_api.SIGNIN_API_KEY=apiKey
+	signin_api.apiClients=dict({workerKey(n):'kiosk'+str(n+1) for n in range(workers)},**{floodKey:'flood'})
+	signin_api.rateLimiter=RateLimiter(rateLimits) if rateLimits else RateLimiter(limits={'routes':{'default':None}})
+	signin_api.SendGridAPIClient=mailer
+	signin_api.rtPath=rtDir
+	return signin_api
+
+# a small cohort (members, keys, testDict) in rtDir, for the webhook; returns the submissions
+def setupCohort(rtDir,members,seed):
+	rng=random.Random(seed)
+	rtDirAbs=os.path.abspath(rtDir)
+	with open(os.path.join(rtDirAbs,'members.json'),'w') as f:
+		json.dump(benchmark.fakeMembers(members),f)
+	# the cohort's own test spec, with room for every member's mapID (see benchmark.py)
+	benchmark.useCohortSpec(rtDirAbs,members)
+	rt.testDict=rt.getEmailsFromMembersJson(os.path.join(rtDirAbs,'members.json'))
+	rt.assignTests(rt.firstMapID)
+	mapIDs=[d['mapID'] for d in rt.testDict.values()]
+	partTwoFile=os.path.join(os.path.dirname(os.path.abspath(rt.__file__)),rt.partTwoFile)
+	keyFile=os.path.join(rtDirAbs,rt.test.partOneKey)
+	rt.buildSolutionDict(mapIDs,keyFile,12,False,seed)
+	rt.readSolutionDicts(keyFile,partTwoFile)
+	shutil.copy(partTwoFile,os.path.join(rtDirAbs,rt.test.partTwoKey))
+	rt.saveTestDict(os.path.join(rtDirAbs,'testDict.json'))
+	return [benchmark.fakeSubmission(rng,sarID,d['mapID'],rt.solutionDicts['partOne'][str(d['mapID'])],rt.solutionDicts['partTwo'],oldFormat=False)
+		for (sarID,d) in rt.testDict.items()]
+
+#########################################################
+# schedule
+#########################################################
+
+def parseMix(s):
+	mix=dict(defaultMix)
+	if s:
+		mix={k:0 for k in mix}
+		for item in s.split(','):
+			(k,sep,v)=item.partition('=')
+			if k not in defaultMix:
+				raise ValueError('unknown scenario: '+k)
+			mix[k]=float(v)
+	return mix
+
+# request = (route label, method, path, json body or None, form data or None)
+def scenarioRequests(rng,scenario,db,submissions,putBurst):
+	eventIDs=list(db.events.keys())
+	if scenario=='poll':
+		since=time.time()-rng.choice([30,300,3600,86400])
+		return [('GET /api/v1/events','GET','/api/v1/events?lastEditSince='+str(since)+'&nonFinalizedOnly=true',None,None)]
+	if scenario=='event':
+		return [('GET /api/v1/events/<id>','GET','/api/v1/events/'+str(rng.choice(eventIDs)),None,None)]
+	if scenario=='roster':
+		return [('GET /api/v1/roster','GET','/api/v1/roster',None,None)]
+	if scenario=='snapshot':
+		return [('GET /api/v1/snapshot','GET','/api/v1/snapshot',None,None)]
+	if scenario=='put':
+		eventID=rng.choice(eventIDs)
+		requests=[]
+		for n in range(rng.randint(1,putBurst)):
+			member=rng.choice(db.roster)
+			record=dict(member,InEpoch=round(time.time()-rng.randint(0,36000),2),Status='SignedIn',CellNum='530-555-'+str(rng.randint(1000,9999)))
+			requests.append(('PUT /api/v1/events/<id>','PUT','/api/v1/events/'+str(eventID),record,None))
+		return requests
+	if scenario=='new':
+		return [('POST /api/v1/events/new','POST','/api/v1/events/new',{'EventName':'Training '+str(rng.randint(1,999)),'EventType':'Training','EventLocation':'Grass Valley'},None)]
+	if scenario=='finalize':
+		return [('POST /api/v1/finalize/<id>','POST','/api/v1/finalize/'+str(rng.choice(eventIDs)),None,None)]
+	if scenario=='webhook':
+		return [('POST /api/v1/jotform_webhook','POST','/api/v1/jotform_webhook',None,benchmark.fakeWebhookForm(rng.choice(submissions)))]
+
+def buildSchedule(n,mix,db,submissions,seed=0,spikeFraction=0.2,spikeFactor=10,putBurst=8):
+	rng=random.Random(seed)
+	schedule=[]
+	while len(schedule)<n:
+		weights=dict(mix)
+		if len(schedule)>=n*(1-spikeFraction):
+			weights['webhook']*=spikeFactor
+		scenario=rng.choices(list(weights.keys()),list(weights.values()))[0]
+		schedule+=scenarioRequests(rng,scenario,db,submissions,putBurst)
+	return schedule[:n]
+
+#########################################################
+# clients
+#########################################################
+
+def clientHeaders(key):
+	return {'Authorization':'Bearer '+key,'X-Forwarded-Proto':'https'}
+
+class TestClient():
+	def __init__(self,app,key=apiKey):
+		self.client=app.test_client()
+		self.headers=clientHeaders(key)
+
+	# returns the status code
+	def request(self,method,path,jsonBody,form):
+		r=self.client.open(path,method=method,json=jsonBody,data=form,headers=self.headers,base_url='https://localhost')
+		return r.status_code
+
+class HTTPClient():
+	def __init__(self,url,key=apiKey):
+		self.url=url.rstrip('/')
+		self.headers=clientHeaders(key)
+
+	def request(self,method,path,jsonBody,form):
+		h=dict(self.headers)
+		data=None
+		if jsonBody is not None:
+			data=json.dumps(jsonBody).encode()
+			h['Content-Type']='application/json'
+		elif form is not None:
+			data=urllib.parse.urlencode(form).encode()
+			h['Content-Type']='application/x-www-form-urlencoded'
+		req=urllib.request.Request(self.url+path,data=data,headers=h,method=method)
+		try:
+			with urllib.request.urlopen(req,timeout=60) as r:
+				r.read()
+				return r.status
+		except urllib.error.HTTPError as e:
+			return e.code
+
+# processes>1: fork a process per request instead of a thread, like multiple web workers
+def startServer(app,port=0,processes=1):
+	from werkzeug.serving import make_server
+	server=make_server('127.0.0.1',port,app,threaded=processes<=1,processes=processes)
+	threading.Thread(target=server.serve_forever,daemon=True).start()
+	return server
+
+# the ASGI app under uvicorn (with asyncServe's serverLimits), on its own thread;
+#  returns the uvicorn server, and its port
+def startAsyncServer(application):
+	import uvicorn
+	import asyncServe
+	server=uvicorn.Server(uvicorn.Config(application,host='127.0.0.1',port=0,log_level='warning',**asyncServe.serverLimits))
+	threading.Thread(target=server.run,daemon=True).start()
+	while not server.started:
+		time.sleep(0.01)
+	return (server,server.servers[0].sockets[0].getsockname()[1])
+
+# a SendGrid stand-in for the async mailer, which posts over http: answers 202 after
+#  latency seconds; server.sent counts the emails
+def startMailServer(latency):
+	from http.server import ThreadingHTTPServer,BaseHTTPRequestHandler
+	class Handler(BaseHTTPRequestHandler):
+		def do_POST(self):
+			self.rfile.read(int(self.headers.get('Content-Length',0)))
+			if latency:
+				time.sleep(latency)
+			with self.server.lock:
+				self.server.sent+=1
+			self.send_response(202)
+			self.send_header('Content-Length','0')
+			self.end_headers()
+		def log_message(self,*args):
+			pass
+	server=ThreadingHTTPServer(('127.0.0.1',0),Handler)
+	server.daemon_threads=True
+	server.lock=threading.Lock()
+	server.sent=0
+	threading.Thread(target=server.serve_forever,daemon=True).start()
+	return server
+
+# keep n event streams open (from one event loop thread) until stop is set; returns the
+#  thread and a dict that gets the counts
+def runStreams(url,n,stop):
+	u=urllib.parse.urlsplit(url)
+	counts={'opened':0,'failed':0,'events':0,'keepalives':0}
+	async def stream(i):
+		try:
+			(reader,writer)=await asyncio.open_connection(u.hostname,u.port)
+		except OSError:
+			counts['failed']+=1
+			return
+		try:
+			writer.write(('GET /api/v1/events/stream?lastEditSince='+str(time.time())+' HTTP/1.1\r\nHost: '+u.netloc+'\r\n'
+				+''.join(k+': '+v+'\r\n' for (k,v) in clientHeaders(apiKey).items())+'\r\n').encode())
+			status=await reader.readline()
+			if b' 200 ' not in status:
+				counts['failed']+=1
+				return
+			counts['opened']+=1
+			while True:
+				line=await reader.readline()
+				if not line:
+					break
+				if line.startswith(b'event: events'):
+					counts['events']+=1
+				elif line.startswith(b': keepalive'):
+					counts['keepalives']+=1
+		except (OSError,asyncio.CancelledError):
+			pass
+		finally:
+			writer.close()
+	async def main():
+		tasks=[asyncio.get_running_loop().create_task(stream(i)) for i in range(n)]
+		while not stop.is_set():
+			await asyncio.sleep(0.1)
+		for t in tasks:
+			t.cancel()
+		await asyncio.gather(*tasks,return_exceptions=True)
+	thread=threading.Thread(target=asyncio.run,args=(main(),))
+	thread.start()
+	return (thread,counts)
+
+# the most threads this process had at once, sampled until stop is set
+def sampleThreads(stop,out):
+	while not stop.is_set():
+		out['maxThreads']=max(out.get('maxThreads',0),threading.active_count())
+		time.sleep(0.05)
+
+#########################################################
+# webhook stress check
+#########################################################
+
+# every member submits rounds times, all shuffled together, so that submissions for
+#  different members (and resubmissions by the same member) overlap; returns the schedule
+#  and the grades each member's final testDict entry may hold (any one of their submissions)
+def buildWebhookStress(submissions,rounds,seed=0):
+	rng=random.Random(seed)
+	schedule=[]
+	expected={}
+	for r in range(rounds):
+		for s in submissions:
+			if r>0:
+				key=rt.solutionDicts['partOne'][s['mapID']]
+				s=benchmark.fakeSubmission(rng,s['SARNumber'],s['mapID'],key,rt.solutionDicts['partTwo'],oldFormat=False)
+			# the expected grade, from the command-line grader
+			grade=rt.gradeResponse(s['mapID'],s,notify=False)
+			expected.setdefault(s['SARNumber'],set()).add(grade)
+			schedule.append(('POST /api/v1/jotform_webhook','POST','/api/v1/jotform_webhook',None,benchmark.fakeWebhookForm(s)))
+	rng.shuffle(schedule)
+	return (schedule,expected)
+
+# a repeater's selection count that went back to zero is the same as no count
+def withoutZeros(stats):
+	stats=json.loads(json.dumps(stats))
+	for s in stats['partTwo'].values():
+		s['selected']={r:n for (r,n) in s['selected'].items() if n}
+	return stats
+
+# check the state files after the stress run; returns a dict with 'passed' and the details
+def checkWebhookStress(rtDir,expected,posted):
+	testDict=loadMembers(os.path.join(rtDir,'testDict.json'))
+	with open(os.path.join(rtDir,'itemStats.json'),'r') as f:
+		stats=json.load(f)
+	lost=[sarID for (sarID,grades) in expected.items() if testDict.get(sarID,{}).get('grade',None) not in grades]
+	with open(os.path.join(rtDir,'summary.txt'),'r') as f:
+		summaries=len([line for line in f if line.startswith('SAR')])
+	# the item statistics count each member's latest submission (see itemStats.py)
+	latest=itemStats.emptyStats(rt.repeaters,rt.locations)
+	for d in testDict.values():
+		if d.get('guesses',None):
+			itemStats.updateStats(latest,*itemStats.guessesResult(d['guesses'],rt.solutionDicts['partOne'][str(d['guesses']['mapID'])],rt.solutionDicts['partTwo'],rt.repeaters,rt.locations))
+	statsMatch=withoutZeros(stats)==withoutZeros(latest)
+	return {
+		'passed':not lost and statsMatch and summaries==posted,
+		'members':len(expected),
+		'posted':posted,
+		'lostOrWrongGrades':len(lost),
+		'lostSamples':lost[:10],
+		'statsSubmissions':stats['submissions'],
+		'statsMatchLatest':statsMatch,
+		'summaryEntries':summaries
+	}
+
+#########################################################
+# run and report
+#########################################################
+
+def percentile(sortedValues,q):
+	if not sortedValues:
+		return None
+	return sortedValues[min(len(sortedValues)-1,int(q*len(sortedValues)))]
+
+def timedRequest(client,route,method,path,jsonBody,form):
+	t0=time.perf_counter()
+	try:
+		status=client.request(method,path,jsonBody,form)
+	except Exception as e:
+		status='exception: '+type(e).__name__+': '+str(e)
+	return (route,status,time.perf_counter()-t0,t0)
+
+# run the schedule with concurrency worker threads; makeClient(n) is called once per worker
+#  pace: seconds each worker waits between its requests
+#  returns a list of (route, status or 'exception', seconds, start) tuples
+def runSchedule(schedule,makeClient,concurrency,pace=0):
+	q=queue.Queue()
+	for request in schedule:
+		q.put(request)
+	results=[]
+	resultsLock=threading.Lock()
+	def worker(n):
+		client=makeClient(n)
+		local=[]
+		while True:
+			try:
+				request=q.get_nowait()
+			except queue.Empty:
+				break
+			local.append(timedRequest(client,*request))
+			if pace:
+				time.sleep(pace)
+		with resultsLock:
+			results.extend(local)
+	threads=[threading.Thread(target=worker,args=(n,)) for n in range(concurrency)]
+	for t in threads:
+		t.start()
+	for t in threads:
+		t.join()
+	return results
+
+# poll as fast as possible from threads threads, with client (one client for all of
+#  them), until stop is set; returns results like runSchedule
+def runFlood(client,threads,stop):
+	results=[]
+	resultsLock=threading.Lock()
+	def flooder():
+		local=[]
+		while not stop.is_set():
+			local.append(timedRequest(client,'flood GET /api/v1/events','GET','/api/v1/events?lastEditSince=0',None,None))
+		with resultsLock:
+			results.extend(local)
+	floodThreads=[threading.Thread(target=flooder) for n in range(threads)]
+	for t in floodThreads:
+		t.start()
+	return (floodThreads,results)
+
+# the flood must have been shed, and nothing else
+def checkFairness(r):
+	flood=r['routes'].get('flood GET /api/v1/events',{'requests':0,'rejected':0})
+	regularRejected=sum(s['rejected'] for (route,s) in r['routes'].items() if not route.startswith('flood'))
+	return {
+		'passed':flood['rejected']>0 and regularRejected==0,
+		'floodRequests':flood['requests'],
+		'floodRejected':flood['rejected'],
+		'regularRejected':regularRejected
+	}
+
+def report(results,wallSeconds):
+	routes={}
+	for (route,status,seconds,start) in results:
+		routes.setdefault(route,[]).append((status,seconds))
+	out={'requests':len(results),'seconds':round(wallSeconds,3),'throughput':round(len(results)/wallSeconds,1),'routes':{}}
+	for (route,rs) in sorted(routes.items()):
+		latencies=sorted(s for (status,s) in rs)
+		errors=[status for (status,s) in rs if not (isinstance(status,int) and status<400)]
+		out['routes'][route]={
+			'requests':len(rs),
+			'throughput':round(len(rs)/wallSeconds,1),
+			'errors':len(errors),
+			'rejected':len([status for (status,s) in rs if status==429]),
+			'errorSamples':sorted(set(str(e) for e in errors))[:5],
+			'p50ms':round(percentile(latencies,0.5)*1000,2),
+			'p95ms':round(percentile(latencies,0.95)*1000,2),
+			'p99ms':round(percentile(latencies,0.99)*1000,2),
+			'maxms':round(latencies[-1]*1000,2)
+		}
+	return out
+
+def reportText(r):
+	lines=[str(r['requests'])+' requests in '+str(r['seconds'])+' s: '+str(r['throughput'])+' requests/s','',
+		'route'.ljust(32)+'requests'.rjust(9)+'req/s'.rjust(9)+'errors'.rjust(8)+'429s'.rjust(8)+'p50 ms'.rjust(10)+'p95 ms'.rjust(10)+'p99 ms'.rjust(10)+'max ms'.rjust(10)]
+	for (route,s) in r['routes'].items():
+		lines.append(route.ljust(32)+str(s['requests']).rjust(9)+str(s['throughput']).rjust(9)+str(s['errors']).rjust(8)+str(s['rejected']).rjust(8)
+			+''.join(str(s[k]).rjust(10) for k in ['p50ms','p95ms','p99ms','maxms']))
+		for e in s['errorSamples']:
+			if e!='429':
+				lines.append('    '+e)
+	return '\n'.join(lines)
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='concurrent load test of the signin_api endpoints, with in-memory stand-ins')
+	parser.add_argument('--mode',choices=['inprocess','serve','serve-async','url'],default='inprocess')
+	parser.add_argument('--url',default='http://127.0.0.1:5000',help='server to test in url mode')
+	parser.add_argument('--requests',type=int,default=2000)
+	parser.add_argument('--concurrency',type=int,default=8)
+	parser.add_argument('--mix',default=None,help='scenario weights, e.g. poll=50,put=25,webhook=2 (default: '+','.join(k+'='+str(v) for (k,v) in defaultMix.items())+')')
+	parser.add_argument('--spike-fraction',type=float,default=0.2,help='fraction of the run at the end with a webhook spike')
+	parser.add_argument('--spike-factor',type=float,default=10,help='webhook weight multiplier during the spike')
+	parser.add_argument('--put-burst',type=int,default=8,help='maximum add-or-updates per put burst')
+	parser.add_argument('--members',type=int,default=200,help='cohort size for webhook submissions')
+	parser.add_argument('--db-latency',type=float,default=0,help='seconds per stand-in database call')
+	parser.add_argument('--db',choices=['memory','sqlite'],default='memory',help='sign-in database stand-in')
+	parser.add_argument('--no-pool',action='store_true',help="with --db sqlite: don't pool the database connections")
+	parser.add_argument('--mail-latency',type=float,default=0,help='seconds per stand-in SendGrid call')
+	parser.add_argument('--processes',type=int,default=1,help='serve mode: handle each request in a forked process')
+	parser.add_argument('--threads',type=int,default=8,help='serve-async mode: thread pool size')
+	parser.add_argument('--streams',type=int,default=0,help='serve modes: event streams to keep open during the run')
+	parser.add_argument('--flood',type=int,default=0,metavar='THREADS',help='also flood /api/v1/events from THREADS threads with one client key')
+	parser.add_argument('--pace',type=float,default=0,help='seconds each regular worker waits between requests')
+	parser.add_argument('--rate-limits',default=None,help="rate limits file, or 'off' (default: rateLimits.json with --flood, otherwise off)")
+	parser.add_argument('--stress-webhook',type=int,default=0,metavar='ROUNDS',
+		help='instead of the traffic mix, post ROUNDS submissions per member to the webhook concurrently and check that no update was lost')
+	parser.add_argument('--seed',type=int,default=0)
+	parser.add_argument('--out',default='loadTest_'+time.strftime('%Y%m%d%H%M%S')+'.json')
+	args=parser.parse_args(argv)
+	if args.streams and args.mode=='inprocess':
+		parser.error('--streams needs a server: use --mode serve or serve-async')
+	logging.basicConfig(format='%(message)s',level=logging.INFO,stream=sys.stdout)
+	# signin_api and the grading code log at .info; only this script's lines are wanted
+	logging.getLogger().handlers[0].addFilter(lambda record:record.pathname==os.path.abspath(__file__))
+	mailer=MemorySendGrid(args.mail_latency)
+	rtDir=tempfile.mkdtemp(prefix='repeaterTestLoad')
+	db=SQLiteSigninDB(os.path.join(rtDir,'signin.db'),args.db_latency) if args.db=='sqlite' else MemorySigninDB(args.db_latency)
+	here=os.getcwd()
+	os.chdir(rtDir) # gradeResponse writes summary.txt in the current directory
+	server=None
+	asyncServer=None
+	mailServer=None
+	try:
+		submissions=setupCohort(rtDir,args.members,args.seed)
+		rateLimits=args.rate_limits or (os.path.join(os.path.dirname(os.path.abspath(__file__)),'rateLimits.json') if args.flood else 'off')
+		signin_api=loadSigninAPI(db,mailer,rtDir,args.concurrency,None if rateLimits=='off' else os.path.abspath(os.path.join(here,rateLimits)))
+		if args.db=='sqlite' and args.no_pool:
+			db.module.sqlite3=sqlite3
+		if args.stress_webhook:
+			# the command-line grader's own stats and summary go elsewhere, so they don't count
+			rt.itemStatsFile=os.path.join(tempfile.mkdtemp(dir=rtDir),'itemStats.json')
+			os.chdir(os.path.dirname(rt.itemStatsFile))
+			(schedule,expected)=buildWebhookStress(submissions,args.stress_webhook,args.seed)
+		else:
+			schedule=buildSchedule(args.requests,parseMix(args.mix),db,submissions,args.seed,args.spike_fraction,args.spike_factor,args.put_burst)
+		if args.mode=='inprocess':
+			makeClient=lambda n:TestClient(signin_api.app,workerKey(n))
+			floodClient=TestClient(signin_api.app,floodKey)
+		elif args.mode=='serve':
+			server=startServer(signin_api.app,processes=args.processes)
+			url='http://127.0.0.1:'+str(server.server_port)
+			logging.info('serving on '+url)
+			makeClient=lambda n:HTTPClient(url,workerKey(n))
+			floodClient=HTTPClient(url,floodKey)
+		elif args.mode=='serve-async':
+			import asyncServe
+			mailServer=startMailServer(args.mail_latency)
+			application=asyncServe.AsyncSigninAPI(args.threads,'http://127.0.0.1:'+str(mailServer.server_port)+'/v3/mail/send')
+			asyncServer=startAsyncServer(application)
+			url='http://127.0.0.1:'+str(asyncServer[1])
+			logging.info('serving (async) on '+url)
+			makeClient=lambda n:HTTPClient(url,workerKey(n))
+			floodClient=HTTPClient(url,floodKey)
+		else:
+			# the test server's own key; it doesn't know the per-worker keys
+			makeClient=lambda n:HTTPClient(args.url)
+			floodClient=HTTPClient(args.url)
+		logging.info(str(len(schedule))+' requests, '+str(args.concurrency)+' workers, mode '+args.mode)
+		stop=threading.Event()
+		threadCount={}
+		threading.Thread(target=sampleThreads,args=(stop,threadCount),daemon=True).start()
+		if args.streams:
+			(streamThread,streams)=runStreams(args.url if args.mode=='url' else url,args.streams,stop)
+			time.sleep(1) # let them connect
+		t0=time.perf_counter()
+		(floodThreads,floodResults)=runFlood(floodClient,args.flood,stop)
+		results=runSchedule(schedule,makeClient,args.concurrency,args.pace)
+		seconds=time.perf_counter()-t0
+		if args.streams:
+			time.sleep(signin_api.streamInterval+1) # the last changes
+		stop.set()
+		for t in floodThreads:
+			t.join()
+		r=report(results+floodResults,seconds)
+		r['maxThreads']=threadCount.get('maxThreads',0)
+		if args.streams:
+			streamThread.join()
+			r['streams']=streams
+		if asyncServer:
+			# the emails still on their way
+			end=time.time()+30
+			while application.stats['emailsQueued']>application.stats['emailsSent']+application.stats['emailsFailed'] and time.time()<end:
+				time.sleep(0.1)
+			r['async']=dict(application.stats)
+		if args.flood:
+			r['fairness']=checkFairness(r)
+			r['rateLimits']=signin_api.rateLimiter.report()
+		if args.stress_webhook and args.mode!='url':
+			r['stress']=checkWebhookStress(rtDir,expected,len(schedule))
+	finally:
+		if server:
+			server.shutdown()
+		if asyncServer:
+			asyncServer[0].should_exit=True
+		if mailServer:
+			mailServer.shutdown()
+		os.chdir(here)
+		shutil.rmtree(rtDir,ignore_errors=True)
+	r['config']=vars(args)
+	r['emailsSent']=mailServer.sent if mailServer else len(mailer.sent)
+	if args.db=='sqlite' and not args.no_pool:
+		r['dbPool']=dict(signin_api.dbPool.stats,installed=signin_api.dbPoolInstalled)
+	logging.info(reportText(r))
+	logging.info('\nmost threads at once: '+str(r['maxThreads'])+'; emails sent: '+str(r['emailsSent']))
+	if 'dbPool' in r:
+		logging.info('database pool: '+json.dumps(r['dbPool'])+('' if r['dbPool']['installed'] else ' (NOT installed: the unpooled connections were measured)'))
+	if 'streams' in r:
+		logging.info('event streams: '+json.dumps(r['streams']))
+	if 'fairness' in r:
+		logging.info('\nfairness check '+('PASSED' if r['fairness']['passed'] else 'FAILED')+': '+json.dumps(r['fairness']))
+	if 'stress' in r:
+		logging.info('\nwebhook stress check '+('PASSED' if r['stress']['passed'] else 'FAILED')+': '+json.dumps(r['stress']))
+	with open(args.out,'w') as f:
+		json.dump(r,f,indent=3)
+	logging.info('results written to '+args.out)
+	if ('stress' in r and not r['stress']['passed']) or ('fairness' in r and not r['fairness']['passed']):
+		return 1
+	return 0
+
+if __name__=='__main__':
+	sys.exit(main())
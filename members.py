@@ -0,0 +1,173 @@
+# members.py - streaming import of D4H member exports, and a cached member index
+
+# a D4H members export (https://api.d4h.org/v2/team/members) looks like:
+#   {"statusCode":200,"data":[{"id":123,"ref":"15","name":"...","email":"...",...},...]}
+#  for a multi-team roster this can be large, so the members in the 'data' list are
+#  decoded one at a time as the file is read, instead of loading the whole document
+#
+# the member index (memberIndex.json) keeps just the fields the repeater test needs, keyed
+#  by ref, along with the latest modification time seen; a refresh only asks the source
+#  for members modified since then, so a full reload is only needed the first time
+#  a source is any object with a membersModifiedSince(since) method that yields member
+#  dicts; D4HExportSource is a local stand-in for the D4H API that reads an export file
+#
+# this module only uses the standard library
+
+import json
+import logging
+from stateStore import loadJSON,saveJSON
+
+chunkSize=1<<16
+
+# the fields kept for each member, in the index and in testDict
+memberFields=['id','ref','name','email']
+
+class StreamReader():
+	def __init__(self,f):
+		self.f=f
+		self.buf=''
+		self.pos=0
+		self.eof=False
+
+	def more(self):
+		if self.eof:
+			return False
+		chunk=self.f.read(chunkSize)
+		if not chunk:
+			self.eof=True
+			return False
+		# drop what has already been consumed, so memory use stays at about one chunk
+		self.buf=self.buf[self.pos:]+chunk
+		self.pos=0
+		return True
+
+	# the next non-whitespace character, without consuming it ('' at the end of the file)
+	def peek(self):
+		while True:
+			while self.pos<len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+				self.pos+=1
+			if self.pos<len(self.buf) or not self.more():
+				return self.buf[self.pos:self.pos+1]
+
+	def expect(self,c):
+		if self.peek()!=c:
+			raise ValueError('members json: expected '+repr(c)+' but found '+repr(self.peek())+' near '+repr(self.buf[self.pos:self.pos+40]))
+		self.pos+=1
+
+	# decode the next json value; if it runs past the end of the buffer, read more and retry
+	def value(self,decoder=json.JSONDecoder()):
+		self.peek()
+		while True:
+			try:
+				(v,end)=decoder.raw_decode(self.buf,self.pos)
+			except json.JSONDecodeError:
+				if self.more():
+					continue
+				raise
+			# a number at the very end of the buffer may continue in the next chunk
+			if end==len(self.buf) and not self.eof and self.more():
+				continue
+			self.pos=end
+			return v
+
+# yields the member dicts in the export's 'data' list, one at a time
+def iterMembers(fileName,key='data'):
+	with open(fileName,'r') as f:
+		r=StreamReader(f)
+		r.expect('{')
+		while r.peek()!='}':
+			k=r.value()
+			r.expect(':')
+			if k==key:
+				r.expect('[')
+				while r.peek()!=']':
+					yield r.value()
+					if r.peek()==',':
+						r.expect(',')
+				return
+			r.value() # some other top-level entry (statusCode, meta, ...)
+			if r.peek()==',':
+				r.expect(',')
+	logging.info('ERROR: '+fileName+' has no '+key+' list')
+
+# build testDict entries directly from the export
+#  subset: optional collection of SAR numbers (refs) to include; others are skipped
+def readMembersJson(fileName,subset=None):
+	subset=set(str(s) for s in subset) if subset else None
+	rval={}
+	for member in iterMembers(fileName):
+		ref=str(member['ref'])
+		if subset is None or ref in subset:
+			rval[ref]={'email':member['email'],'name':member['name']}
+	if subset:
+		missing=subset-set(rval.keys())
+		if missing:
+			logging.info('WARNING: '+str(len(missing))+' of the '+str(len(subset))+' requested SAR numbers are not in '+fileName+': '+str(sorted(missing)))
+	return rval
+
+# D4H member ids, by SAR number (ref), from the export (for the qualification push, see d4hPush.py)
+def readMemberIDs(fileName):
+	return {str(member['ref']):member['id'] for member in iterMembers(fileName) if member.get('id',None) is not None}
+
+# local stand-in for the D4H members API, backed by an export file; members without the
+#  modification field are always returned
+class D4HExportSource():
+	def __init__(self,fileName,modifiedField='updated_at'):
+		self.fileName=fileName
+		self.modifiedField=modifiedField
+
+	def membersModifiedSince(self,since=None):
+		for member in iterMembers(self.fileName):
+			modified=member.get(self.modifiedField,None)
+			if since is None or modified is None or modified>since:
+				yield member
+
+# index:
+#   asOf - latest modification time seen (ISO 8601 strings compare in time order)
+#   members - key = ref, val = dict of memberFields
+class MemberIndex():
+	def __init__(self,fileName='memberIndex.json',modifiedField='updated_at'):
+		self.fileName=fileName
+		self.modifiedField=modifiedField
+		index=loadJSON(fileName,None) or {'asOf':None,'members':{}}
+		self.asOf=index['asOf']
+		self.members=index['members']
+
+	def save(self):
+		saveJSON({'asOf':self.asOf,'members':self.members},self.fileName)
+
+	# apply members modified since the last refresh; returns the number of refs added or changed
+	#  members marked as deleted (or with status 'Retired') are dropped from the index
+	def refresh(self,source):
+		changed=0
+		for member in source.membersModifiedSince(self.asOf):
+			ref=str(member['ref'])
+			modified=member.get(self.modifiedField,None)
+			if modified and (self.asOf is None or modified>self.asOf):
+				self.asOf=modified
+			status=member.get('status',None)
+			if member.get('deleted',False) or (status.get('value') if isinstance(status,dict) else status)=='Retired':
+				if self.members.pop(ref,None) is not None:
+					changed+=1
+				continue
+			entry={k:member.get(k,None) for k in memberFields}
+			entry['ref']=ref
+			if self.members.get(ref,None)!=entry:
+				self.members[ref]=entry
+				changed+=1
+		logging.info('member index '+self.fileName+': '+str(changed)+' members added or changed; '+str(len(self.members))+' members as of '+str(self.asOf))
+		self.save()
+		return changed
+
+	# testDict entries for the indexed members (all, or just those in subset)
+	def testDictEntries(self,subset=None):
+		subset=set(str(s) for s in subset) if subset else None
+		refs=[ref for ref in self.members.keys() if subset is None or ref in subset]
+		if subset and len(refs)<len(subset):
+			missing=sorted(subset-set(refs))
+			logging.info('WARNING: '+str(len(missing))+' of the '+str(len(subset))+' requested SAR numbers are not in the member index: '+str(missing))
+		return {ref:{'email':self.members[ref]['email'],'name':self.members[ref]['name']} for ref in refs}
+
+	# D4H member ids, by SAR number (ref)
+	def memberIDs(self):
+		return {ref:m['id'] for (ref,m) in self.members.items() if m.get('id',None) is not None}
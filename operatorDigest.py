@@ -0,0 +1,138 @@
+# operatorDigest.py - one periodic digest of graded results for the operator
+
+# the webhook used to send every graded results email to the member and to the operator;
+#  at a cohort deadline that doubled the mail volume and filled the operator's inbox;
+#  now the member's email is sent right away, to the member only, and the SAR number is
+#  queued here; the operator gets one digest of everything queued, at most every
+#  digestInterval seconds:
+#   - queueResult appends 'queued epoch<tab>SAR number' to operatorOutbox.tsv (in rtPath),
+#     plus '<tab>problem' for a submission that could not be graded (e.g. a mapID outside
+#     every test's range), so that the operator hears about it even though there's no grade
+#   - sendDigest builds the digest from the members' stored results in testDict.json
+#     (grade percentages, mapID, test, graded time, whether the member's email went out,
+#     and whether the mapID was rerouted or flagged - see keyIndex.py),
+#     not from the rendered reports, sends it, and only then removes those lines from the
+#     outbox; if the send fails, they stay for the next digest
+# signin_api sends the digest from the webhook when the oldest queued result is
+#  digestInterval seconds old; 'repeaterTest.py digest' sends it from a scheduled task or
+#  by hand (e.g. at the end of the deadline day, for the last few results)
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import re
+import time
+import html
+import tempfile
+from stateStore import lockedFile,loadMembers,appendText
+
+operatorEmail='caver456@gmail.com'
+outboxName='operatorOutbox.tsv'
+digestInterval=900
+
+def queueResult(directory,sarID,now=None,problem=None):
+	line=str(round(time.time() if now is None else now,3))+'\t'+str(sarID)
+	if problem:
+		line+='\t'+' '.join(str(problem).split())
+	appendText(os.path.join(directory,outboxName),line+'\n')
+
+# [(queued epoch, SAR number, problem or ''), ...], oldest first
+def pending(directory):
+	fileName=os.path.join(directory,outboxName)
+	if not os.path.isfile(fileName):
+		return []
+	items=[]
+	with open(fileName,'r') as f:
+		for line in f:
+			(queued,sep,rest)=line.rstrip('\n').partition('\t')
+			if sep:
+				(sarID,sep,problem)=rest.partition('\t')
+				items.append((float(queued),sarID,problem))
+	return items
+
+# True if the oldest queued result has waited interval seconds; only reads the first line
+def digestDue(directory,interval=digestInterval,now=None):
+	fileName=os.path.join(directory,outboxName)
+	if not os.path.isfile(fileName):
+		return False
+	with open(fileName,'r') as f:
+		(queued,sep,sarID)=f.readline().partition('\t')
+	return bool(sep) and (time.time() if now is None else now)-float(queued)>=interval
+
+# drop the first n lines of the outbox (the ones that were just sent)
+def removeSent(directory,n):
+	fileName=os.path.join(directory,outboxName)
+	with lockedFile(fileName):
+		with open(fileName,'r') as f:
+			lines=f.readlines()
+		(fd,tmpName)=tempfile.mkstemp(dir=directory,prefix='.'+outboxName+'.')
+		with os.fdopen(fd,'w') as f:
+			f.writelines(lines[n:])
+		os.replace(tmpName,fileName)
+
+# the grade percentages, from the stored pct, or from the grade text of older entries
+def gradePct(member):
+	if 'pct' in member:
+		return (member['pct'].get('partOne',None),member['pct'].get('partTwo',None))
+	m=re.match(r'Part One: ([\d.]+)%\s+Part Two: ([\d.]+)%',member.get('grade',''))
+	return (m.group(1),m.group(2)) if m else (None,None)
+
+# one row per SAR number (the latest stored result, even if it was queued more than once),
+#  with any problems queued for it
+def digestRows(items,testDict):
+	rows=[]
+	bySAR={}
+	for (queued,sarID,problem) in items:
+		if sarID in bySAR:
+			if problem and problem not in bySAR[sarID]['problem']:
+				bySAR[sarID]['problem']='; '.join(p for p in [bySAR[sarID]['problem'],problem] if p)
+			continue
+		member=testDict.get(sarID,{})
+		(partOne,partTwo)=gradePct(member)
+		rows.append({
+			'sarID':sarID,
+			'name':member.get('name',''),
+			'mapID':member.get('guesses',{}).get('mapID',member.get('mapID','')),
+			'partOne':partOne,
+			'partTwo':partTwo,
+			'test':member.get('test',''),
+			'graded':member.get('graded','(not graded)' if sarID in testDict else '(not in testDict)'),
+			'emailed':'yes' if member.get('gradedEmailSent') else 'NO',
+			'mapCheck':(member.get('mapIDCheck') or {}).get('action',''),
+			'problem':problem
+		})
+		bySAR[sarID]=rows[-1]
+	return rows
+
+columns=[('sarID','SAR'),('name','Name'),('mapID','Map'),('partOne','Part 1 %'),('partTwo','Part 2 %'),('graded','Graded'),('emailed','Emailed'),('mapCheck','Map check'),('problem','Problem')]
+
+def renderDigest(rows):
+	subject='Repeater Test digest: '+str(len(rows))+' graded result'+('' if len(rows)==1 else 's')
+	cells=[[('' if r[k] is None else str(r[k])) for (k,title) in columns] for r in rows]
+	widths=[max([len(title)]+[len(c[i]) for c in cells]) for (i,(k,title)) in enumerate(columns)]
+	text='\n'.join([subject,'']+['  '.join(v.ljust(w) for (v,w) in zip(line,widths)).rstrip() for line in [[title for (k,title) in columns]]+cells])
+	tests=sorted(set(r['test'] for r in rows if r['test']))
+	if tests:
+		text+='\n\ntest: '+', '.join(tests)
+	td='<td style="padding:1px 6px">'
+	htmlContent=('<p>'+html.escape(subject)+'</p><table style="border-collapse:collapse;font-family:monospace">'
+		+'<tr>'+''.join('<th style="padding:1px 6px;text-align:left">'+title+'</th>' for (k,title) in columns)+'</tr>'
+		+''.join('<tr>'+''.join(td+html.escape(v)+'</td>' for v in line)+'</tr>' for line in cells)+'</table>'
+		+('<p>test: '+html.escape(', '.join(tests))+'</p>' if tests else ''))
+	return (subject,text,htmlContent)
+
+# send the digest of everything queued, if the oldest result has waited interval seconds
+#  (or force); send is sendEmail (keyword arguments; returns True if sent)
+#  returns the number of queued results sent
+def sendDigest(directory,send,interval=digestInterval,force=False,now=None):
+	# one sender at a time; the webhook keeps queueing meanwhile
+	with lockedFile(os.path.join(directory,outboxName+'.send')):
+		items=pending(directory)
+		if not items or not (force or digestDue(directory,interval,now)):
+			return 0
+		testDict=loadMembers(os.path.join(directory,'testDict.json'))
+		(subject,text,htmlContent)=renderDigest(digestRows(items,testDict))
+		if not send(from_email=operatorEmail,to_emails=operatorEmail,subject=subject,html_content=htmlContent,plain_text_content=text):
+			return 0
+		removeSent(directory,len(items))
+		return len(items)
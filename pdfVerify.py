@@ -0,0 +1,62 @@
+# pdfVerify.py - check that a generated map PDF shows the letters from its answer key
+
+# makePDF fills each form field from the key (field name = repeater name without spaces,
+#  plus MAPID), and any field it doesn't recognize gets 'N/A'; so, for each PDF this
+#  re-reads every field annotation and checks that:
+#   - the field is one that the key fills in (not an 'N/A' fallback)
+#   - its /V value is the letter (or map ID) from the key
+#   - its appearance stream (/AP /N) draws that same text, since that is what viewers show
+#   - every field the key fills in exists in the PDF
+#
+# only the field annotations are read; the map image is never decoded, so one check
+#  takes a few milliseconds
+
+import re
+from pypdf import PdfReader
+
+tjPattern=re.compile(rb'\(((?:[^()\\]|\\.)*)\)\s*Tj')
+
+def expectedFields(mapID,key):
+	fields={k.replace(' ',''):v for k,v in key.items()}
+	fields['MAPID']=str(mapID)
+	return fields
+
+# the strings drawn by Tj operators in an appearance stream
+def shownText(stream):
+	return [re.sub(rb'\\(.)',rb'\1',m).decode('latin-1') for m in tjPattern.findall(stream)]
+
+# returns a list of problems (empty if the PDF is correct)
+def verifyPDF(fileName,mapID,key):
+	try:
+		reader=PdfReader(fileName)
+		annotations=reader.pages[0].get('/Annots',None)
+	except Exception as e:
+		return ['could not read '+str(fileName)+': '+str(e)]
+	if not annotations:
+		return ['no form fields in '+str(fileName)]
+	expected=expectedFields(mapID,key)
+	problems=[]
+	seen=set()
+	for annotation in annotations.get_object():
+		annotation=annotation.get_object()
+		field=annotation.get('/T',None)
+		if field is None:
+			continue
+		field=str(field)
+		seen.add(field)
+		value=annotation.get('/V',None)
+		want=expected.get(field,None)
+		if want is None:
+			problems.append(field+': not filled in from the key (shows '+repr(str(value))+')')
+			continue
+		if value is None or str(value)!=want:
+			problems.append(field+': value '+repr(None if value is None else str(value))+', expected '+repr(want))
+		ap=annotation.get('/AP',None)
+		normal=ap.get('/N',None) if ap else None
+		shown=shownText(normal.get_object().get_data()) if normal is not None else []
+		if shown!=[want]:
+			problems.append(field+': appearance shows '+repr(shown)+', expected '+repr(want))
+	for field in expected:
+		if field not in seen:
+			problems.append(field+': no such field in the PDF')
+	return problems
@@ -0,0 +1,136 @@
+# previews.py - lightweight per-map previews, for members reading the test on a phone
+
+# some phone PDF readers don't show the filled-in form fields, and the map PDF is over
+#  500KB; a preview is the map image from the template (written once, shared by every
+#  map and cached by the browser) with only the 24 letter labels and the MAPID drawn
+#  over it:
+#   svg - a vector overlay (a couple of KB per map) that references the shared base image
+#   webp, png - a flattened raster of the base image with the labels drawn in (requires Pillow)
+#
+# the labels are placed exactly where makePDF draws them: same field rectangles, font
+#  sizes and text offsets, read from the template's form fields
+#
+# the template page's own vector text (title, legend) is not part of the map image, so it
+#  is not in the preview; the PDF is still the reference copy
+
+import io
+import os
+import re
+import html
+import hashlib
+from pypdf import PdfReader
+
+try:
+	from PIL import Image,ImageDraw,ImageFont
+except ImportError:
+	Image=None
+
+# page size, the map image (with where it is placed on the page) and the form fields
+def readTemplateLayout(templateFile):
+	page=PdfReader(templateFile).pages[0]
+	box=page.mediabox
+	layout={'page':[float(box.width),float(box.height)],'fields':{}}
+	# the image is placed by a 'w 0 0 h x y cm /ImN Do' sequence in the page contents
+	contents=page.get_contents().get_data().decode('latin-1')
+	images={str(k):v.get_object() for (k,v) in page['/Resources']['/XObject'].items() if v.get_object().get('/Subtype')=='/Image'}
+	for m in re.finditer(r'([-\d.]+) 0 0 ([-\d.]+) ([-\d.]+) ([-\d.]+) cm\s*(/\w+) Do',contents):
+		if m.group(5) in images:
+			image=images[m.group(5)]
+			layout['image']={
+				'rect':[float(m.group(3)),float(m.group(4)),float(m.group(1)),float(m.group(2))],
+				'width':int(image['/Width']),
+				'height':int(image['/Height']),
+				'filter':str(image.get('/Filter')),
+				'data':image._data # still encoded: the JPEG file itself, for DCTDecode
+			}
+			break
+	for annotation in page['/Annots']:
+		annotation=annotation.get_object()
+		field=annotation.get('/T',None)
+		if field is None:
+			continue
+		font=str(annotation['/DA']).split()
+		fontName=[f for f in font if f.startswith('/')][0]
+		layout['fields'][str(field)]={
+			'rect':[float(x) for x in annotation['/Rect']],
+			'font':fontName,
+			'bold':fontName.endswith('Bo'),
+			'size':float(font[font.index(fontName)+1])
+		}
+	return layout
+
+# (text, x, y, size, bold) for each label, in PDF page coordinates (y up), at the same
+#  position as makePDF's appearance stream: 2 points in from the left of the field and
+#  h/2-fontSize/3 up from the bottom, inside a 1 point border
+def labels(layout,mapID,key):
+	data={k.replace(' ',''):v for k,v in key.items()}
+	data['MAPID']=str(mapID)
+	out=[]
+	for (field,f) in layout['fields'].items():
+		(x0,y0,x1,y1)=f['rect']
+		h=round(y1-y0-2,2)
+		out.append((data.get(field,'N/A'),x0+1+2,y0+1+h/2-f['size']/3,f['size'],f['bold']))
+	return out
+
+# write the shared base image once; returns its file name, which includes a hash of its
+#  contents so that it can be cached forever
+#  maxWidth: downscale (requires Pillow); otherwise a JPEG map image is written as-is
+def writeBaseImage(layout,outDir,maxWidth=None,quality=70):
+	image=layout['image']
+	if not maxWidth and image['filter']=='/DCTDecode':
+		data=bytes(image['data'])
+	else:
+		if Image is None:
+			raise ImportError('Pillow is needed to resize or convert the base image')
+		im=baseRaster(layout,maxWidth)
+		buf=io.BytesIO()
+		im.save(buf,'JPEG',quality=quality,optimize=True,progressive=True)
+		data=buf.getvalue()
+	fileName='base_'+hashlib.sha1(data).hexdigest()[:10]+'.jpg'
+	with open(os.path.join(outDir,fileName),'wb') as f:
+		f.write(data)
+	return fileName
+
+def svgPreview(layout,baseName,mapID,key):
+	(pw,ph)=layout['page']
+	(ix,iy,iw,ih)=layout['image']['rect']
+	parts=['<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" viewBox="0 0 '+str(pw)+' '+str(ph)+'">',
+		'<image x="'+str(ix)+'" y="'+str(round(ph-iy-ih,3))+'" width="'+str(iw)+'" height="'+str(ih)+'" preserveAspectRatio="none" xlink:href="'+baseName+'"/>',
+		'<g font-family="Helvetica,Arial,sans-serif">']
+	for (text,x,y,size,bold) in labels(layout,mapID,key):
+		parts.append('<text x="'+str(round(x,2))+'" y="'+str(round(ph-y,2))+'" font-size="'+str(round(size,2))+'"'+(' font-weight="bold"' if bold else '')+'>'+html.escape(text)+'</text>')
+	parts.append('</g></svg>')
+	return '\n'.join(parts)
+
+# the decoded map image, optionally downscaled (requires Pillow)
+def baseRaster(layout,maxWidth=None):
+	im=Image.open(io.BytesIO(bytes(layout['image']['data']))).convert('RGB')
+	if maxWidth and im.width>maxWidth:
+		im=im.resize((maxWidth,round(im.height*maxWidth/im.width)),Image.LANCZOS)
+	return im
+
+def labelFont(size,bold):
+	for name in (['DejaVuSans-Bold.ttf','Arial Bold.ttf','arialbd.ttf'] if bold else ['DejaVuSans.ttf','Arial.ttf','arial.ttf']):
+		try:
+			return ImageFont.truetype(name,size)
+		except OSError:
+			pass
+	return ImageFont.load_default(size)
+
+# the base raster with the labels drawn in; returns the encoded image bytes
+#  fmt: 'webp' or 'png'
+def rasterPreview(layout,base,mapID,key,fmt='webp',quality=60):
+	(ix,iy,iw,ih)=layout['image']['rect']
+	scale=base.width/iw
+	im=base.copy()
+	draw=ImageDraw.Draw(im)
+	for (text,x,y,size,bold) in labels(layout,mapID,key):
+		font=labelFont(max(1,round(size*scale)),bold)
+		# PDF y is the text baseline, measured up from the bottom of the page
+		draw.text(((x-ix)*scale,(iy+ih-y)*scale),text,fill=(0,0,0),font=font,anchor='ls')
+	buf=io.BytesIO()
+	if fmt=='webp':
+		im.save(buf,'WEBP',quality=quality,method=4)
+	else:
+		im.save(buf,'PNG',optimize=True)
+	return buf.getvalue()
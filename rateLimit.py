@@ -0,0 +1,146 @@
+# rateLimit.py - per-client token-bucket rate limits for the signin_api routes
+
+# one kiosk polling /api/v1/events in a tight loop, or a burst of jotform retries, would
+#  otherwise take the whole (small, single) host away from everyone else; so each client
+#  gets a token bucket per route, and a request that finds its bucket empty is answered
+#  429 with Retry-After before it touches the database or the grader
+#
+# a bucket holds up to 'burst' tokens and refills at 'rate' tokens per second; each
+#  request takes one token
+#
+# limits come from a json file (rateLimits.json in rtPath), re-read when it changes:
+#   {
+#      "routes":{ # key = flask endpoint (view function name), or "default"
+#         "default":{"rate":5,"burst":20},
+#         "api_getEvents":{"rate":2,"burst":10},
+#         ...
+#      },
+#      "clients":{ # optional, same form as "routes"; a client's own entries come first
+#         "shared":{"default":{"rate":50,"burst":200}},
+#         ...
+#      }
+#   }
+#  a limit of null means no limit; a route with no entry uses "default"
+#
+# client names come from signin_api: the name of the client's api key, or for the
+#  webhook, the SAR number of the submission (so one member's retries don't hold up
+#  anyone else's submission)
+#
+# the buckets are per process: with several web workers, each worker applies the
+#  limits on its own
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import json
+import math
+import time
+import logging
+import threading
+
+defaultLimits={'routes':{'default':{'rate':5,'burst':20}},'clients':{}}
+
+# (rate, burst) or None for no limit; raises ValueError if the limit is not usable
+def compileLimit(name,limit):
+	if limit is None:
+		return None
+	rate=float(limit['rate'])
+	burst=float(limit['burst'])
+	if rate<=0 or burst<1:
+		raise ValueError('rate limit '+name+': rate must be > 0 and burst >= 1')
+	return (rate,burst)
+
+# returns (routes, clients): dicts of compiled limits
+def compileLimits(d):
+	routes={k:compileLimit(k,v) for (k,v) in d.get('routes',{}).items()}
+	routes.setdefault('default',compileLimit('default',defaultLimits['routes']['default']))
+	clients={c:{k:compileLimit(c+'/'+k,v) for (k,v) in limits.items()} for (c,limits) in d.get('clients',{}).items()}
+	return (routes,clients)
+
+# fileName: the limits file; or limits: a dict in the same form, used as is
+class RateLimiter():
+	def __init__(self,fileName=None,limits=defaultLimits,maxBuckets=10000):
+		self.fileName=fileName
+		self.maxBuckets=maxBuckets
+		self.lock=threading.Lock()
+		(self.routes,self.clients)=compileLimits(limits)
+		self.mtime=None
+		self.checked=None
+		self.buckets={} # key = (client, endpoint), val = [tokens, last time, rate, burst]
+		self.allowed={} # key = endpoint, val = count
+		self.rejected={} # key = endpoint, val = count
+		self.rejectedByClient={} # key = client, val = count
+		self.reload()
+
+	# re-read the limits file if it changed (checked at most once a second); a bad file
+	#  is logged and the previous limits stay in effect
+	def reload(self):
+		if not self.fileName:
+			return
+		now=time.monotonic()
+		if self.checked is not None and now-self.checked<1:
+			return
+		self.checked=now
+		try:
+			mtime=os.stat(self.fileName).st_mtime_ns
+		except OSError:
+			return
+		if mtime==self.mtime:
+			return
+		self.mtime=mtime
+		try:
+			with open(self.fileName,'r') as f:
+				(routes,clients)=compileLimits(json.load(f))
+		except (ValueError,KeyError,TypeError) as e:
+			logging.info('ERROR: rate limits not loaded from '+self.fileName+': '+str(e))
+			return
+		with self.lock:
+			(self.routes,self.clients)=(routes,clients)
+			self.buckets={}
+
+	def limitFor(self,client,endpoint):
+		for limits in [self.clients.get(client,{}),self.routes]:
+			for key in [endpoint,'default']:
+				if key in limits:
+					return limits[key]
+
+	# take a token for this client and endpoint; returns (allowed, seconds until a
+	#  token is available, rounded up)
+	def take(self,client,endpoint):
+		self.reload()
+		limit=self.limitFor(client,endpoint)
+		now=time.monotonic()
+		with self.lock:
+			if limit is None:
+				self.allowed[endpoint]=self.allowed.get(endpoint,0)+1
+				return (True,0)
+			(rate,burst)=limit
+			key=(client,endpoint)
+			bucket=self.buckets.get(key,None)
+			if bucket is None:
+				if len(self.buckets)>=self.maxBuckets:
+					self.prune(now)
+				bucket=self.buckets[key]=[burst,now,rate,burst]
+			tokens=min(burst,bucket[0]+(now-bucket[1])*rate)
+			bucket[1]=now
+			if tokens>=1:
+				bucket[0]=tokens-1
+				self.allowed[endpoint]=self.allowed.get(endpoint,0)+1
+				return (True,0)
+			bucket[0]=tokens
+			self.rejected[endpoint]=self.rejected.get(endpoint,0)+1
+			self.rejectedByClient[client]=self.rejectedByClient.get(client,0)+1
+			return (False,max(1,math.ceil((1-tokens)/rate)))
+
+	# drop the buckets that have refilled (a new bucket starts full anyway)
+	def prune(self,now):
+		self.buckets={k:b for (k,b) in self.buckets.items() if b[0]+(now-b[1])*b[2]<b[3]}
+
+	def report(self):
+		with self.lock:
+			return {
+				'allowed':dict(self.allowed),
+				'rejected':dict(self.rejected),
+				'rejectedByClient':dict(self.rejectedByClient),
+				'buckets':len(self.buckets)
+			}
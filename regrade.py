@@ -0,0 +1,41 @@
+# regrade.py - find the graded submissions affected by a change to the answer keys
+
+# gradeResponse keeps each member's answers ('guesses') and per-location part two scores
+#  ('scores') in testDict; when a key file is corrected, only these need to be regraded:
+#   - submissions for a mapID whose partOne key changed
+#   - submissions whose score at a changed partTwo location is different under the new key
+#  everything else keeps its grade, and nobody else gets another email
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+from responses import parsePartTwo
+from scoring import scorePartTwoLocation,partTwoWeights
+
+# keys (mapIDs or locations) whose entries differ between two solution dicts
+def diffKeys(old,new):
+	return sorted(k for k in set(old.keys())|set(new.keys()) if old.get(k)!=new.get(k))
+
+# returns the list of SAR numbers whose grade may change
+#  weights: the test's part two scoring weights (spec.weights), which the stored scores used
+def findAffected(testDict,changedMapIDs,changedLocations,newPartTwo,locations,weights=partTwoWeights):
+	changedMapIDs=set(str(m) for m in changedMapIDs)
+	changedLocations=set(changedLocations)
+	affected=[]
+	for (sarID,d) in testDict.items():
+		guesses=d.get('guesses',None)
+		if not guesses:
+			continue
+		if str(guesses['mapID']) in changedMapIDs:
+			affected.append(sarID)
+			continue
+		if not changedLocations:
+			continue
+		storedScores=d.get('scores',{}).get('partTwo',{})
+		selections=parsePartTwo(guesses['partTwo'])
+		for (n,location) in enumerate(locations[:len(selections)]):
+			if location not in changedLocations:
+				continue
+			if location not in newPartTwo or scorePartTwoLocation(newPartTwo[location],selections[n],weights)['points']!=storedScores.get(location):
+				affected.append(sarID)
+				break
+	return affected
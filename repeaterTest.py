@@ -21,80 +21,92 @@
 #      key: email (from D4H)
 #      key: mapID - integer assigned by assignTests
 #      key: assignmentSent - timestamp that assignment email was sent to the member
+#      key: reminderSent, remindersSent - timestamp and count of reminder emails (follow-up)
 #      key: guessesReceived - timestamp that webhook handler was run
 #      key: guesses - json of member guesses from webhook handler
 #      key: gradeMessage - full text generated by gradeResponse
 #      key: gradeSent - timestamp that graded email was sent to the member
+#      key: test - name and version of the test spec the grade was based on (see testSpec.py)
+#      key: pct - part one and part two percentages (for the operator digest, see operatorDigest.py)
+#      key: d4hQualification - test, time and idempotency key of the qualification pushed to D4H (see d4hPush.py)
 
 # solutionDicts - dict of dicts containing the solutions to part one and part two
 
 # guessesDict - from the webhook handler - compared against that member's solutionsDict by gradeResponse
 
-import random
+# command line usage
+# ------------------
+# importing this module has no side effects; each step of the workflow is a subcommand:
+#   python repeaterTest.py build-keys --first-map-id 2200 --number-of-maps 150
+#   python repeaterTest.py assign --members members.json --subset whoNeedsRepeaterTest.txt --first-map-id 2200
+#   python repeaterTest.py assign --members members.json --member-index memberIndex.json
+#   python repeaterTest.py render --key solutionDict_partOne20240124085012.json --out-dir maps
+#   python repeaterTest.py render --key solutionDict_partOne20240124085012.json --out-dir maps --optimize --quality 60 --size-budget 300
+#   python repeaterTest.py verify --key solutionDict_partOne20240124085012.json --out-dir maps --report verifyReport.json
+#   python repeaterTest.py previews --key solutionDict_partOne20240124085012.json --out-dir previews
+#   python repeaterTest.py send --sar-ids 15 144 54
+#   python repeaterTest.py grade --key solutionDict_partOne20240124085012.json --response response.json
+#   python repeaterTest.py regrade --old-part-two solutionDict_partTwo_old.json --old-key ... --key ... --email
+#   python repeaterTest.py stats
+#   python repeaterTest.py pack --key solutionDict_partOne20240124085012.json --out-keys keys.bin --out-responses responses.bin
+#   python repeaterTest.py grade-archive --keys keys.bin --responses responses.bin --compare
+#   python repeaterTest.py status --list awaitingSubmission
+#   python repeaterTest.py follow-up --once --remind-after 3 --remind-every 2 --max-reminders 2
+#   python repeaterTest.py simulate --samples 1000000 --strategies random:3 informed:0.8,0.3,0.1
+#   python repeaterTest.py collusion --key solutionDict_partOne20240124085012.json --submissions submissions.jsonl
+#   python repeaterTest.py replay --log submissions --since 2024-01-24 --latest --out submissions.jsonl
+#   python repeaterTest.py replay --log submissions --map-ids 2201 2240 --grade
+#   python repeaterTest.py compact-log --log submissions
+#   python repeaterTest.py digest --now
+#   python repeaterTest.py d4h-push --member-index memberIndex.json --qualification-id 123 --dry-run
+# or, to start a whole cohort in one streaming pass (assign, then render each PDF
+#  in a process pool and send each member's email as soon as their PDF is written):
+#   python repeaterTest.py cohort --members members.json --subset whoNeedsRepeaterTest.txt --first-map-id 2200 --key ...
+# the repeaters, locations, scoring weights, mapID range and default solution files come
+#  from the current test in testSpec.json; to work on another test defined there:
+#   python repeaterTest.py --test 2024-01 render --out-dir maps
+
 import json
 import time
-import string
 import os
 import logging
 import sys
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,as_completed
 from pypdf import PdfReader,PdfWriter
 from pypdf.generic import NameObject,NumberObject,TextStringObject,encode_pdfdocencoding
 from pypdf.constants import AnnotationDictionaryAttributes,InteractiveFormDictEntries,PageAttributes,StreamAttributes,FilterTypes,FieldDictionaryAttributes,FieldFlag
 from pypdf.filters import FlateDecode
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
+from answerSets import generateAnswerSets
+from responses import parsePartOne,parsePartTwo
+from collusion import loadSubmissions,findSuspiciousPairs
+from itemStats import replaceResult,guessesResult,loadStats,saveStats,updateStats,statsReport,statsReportText
+from scoreSim import simulate,simulationReportText,defaultWeights
+from scoring import scorePartTwoLocation
+from regrade import diffKeys,findAffected
+from stateStore import lockedFile,loadJSON,saveJSON,loadMembers,saveMembers,updateMember,memberStoreFile
+from members import readMembersJson,readMemberIDs,D4HExportSource,MemberIndex
+from followUp import FollowUpIndex,statuses
+from pdfVerify import verifyPDF
+from codec import writeKeyArchive,writeResponseArchive,KeyArchive,ResponseArchive,gradeArchive
+from previews import readTemplateLayout,writeBaseImage,svgPreview,baseRaster,rasterPreview
+from gradedReport import renderReport,renderText
+from testSpec import loadSpecs
+from submissionLog import SubmissionLog
+from operatorDigest import sendDigest,pending
+from templateOptimize import optimizeTemplate,reportText,quality as templateQuality,maxDPI as templateMaxDPI
+from d4hPush import D4HSession,D4HStandIn,pushQualifications,d4hURL,batchSize,passPct
 
 # logging: log to file and to stdout, for all messages of .info or higher
-logging.basicConfig(filename='repeaterTest_'+time.strftime('%Y%m%d%H%M%S')+'.log',format='%(asctime)s:%(message)s',level=logging.INFO)
-logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
-
-firstMapID=2200
-numberOfMaps=150
-
-mapIDList=list(range(firstMapID,firstMapID+numberOfMaps+1)) # the list ends one element before the second argument
-repeaters=[
-	'ALDER HILL',
-	'ALTA SIERRA',
-	'BABBITT',
-	'BANNER',
-	'BOREAL',
-	'BOWMAN',
-	'CASCADE SHRS',
-	'CHERRY HILL',
-	'DEADMAN FLAT',
-	'DONNER',
-	'EDWARDS XING',
-	'GROUSE RIDGE',
-	'KENTKY RIDGE',
-	'LOP',
-	'LWW',
-	'MT ROSE',
-	'OREGON',
-	'OWL CREEK',
-	'PILOT PEAK',
-	'PURDON',
-	'ROLLINS LK',
-	'SIERRABUTTES',
-	'SIGNAL',
-	'WOLF MTN'
-]
-locations=[
-	# 'Milton Reservoir',
-	# 'Shingle Falls',
-	'Bridgeport covered bridge',
-	# 'Emerald Pools',
-	'Penner Lake',
-	# 'South Yuba Primitive Camp',
-	'Buckeye Rd at Chalk Bluff Rd',
-	# 'Lake Sterling',
-	# 'Dog Bar Rd at South Fork Wolf Creek',
-	'Peter Grubb Hut',
-	'Prosser Boat Ramp',
-	# 'Sagehen CG',
-	# 'Boyington Mill CG',
-	'Pacific Crest Trail at Meadow Lake Road'
-]
-letters=list(string.ascii_uppercase)[0:len(repeaters)]
+#  (called from main, so that importing this module doesn't create a new log file)
+def setupLogging(logDir='.'):
+	logging.basicConfig(filename=os.path.join(logDir,'repeaterTest_'+time.strftime('%Y%m%d%H%M%S')+'.log'),format='%(asctime)s:%(message)s',level=logging.INFO)
+	logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+
 
 # the code below relies on a naming convention of fields in the fillable pdf:
 #  control name = repeater name with spaces removed
@@ -103,22 +115,70 @@ letters=list(string.ascii_uppercase)[0:len(repeaters)]
 
 fillable_pdf='repeater_map_for_test.pdf'
 
+# default file names; each one can be overridden from the command line
+testDictFile='testDict.json'
+testSpecFile=os.path.join(os.path.dirname(os.path.abspath(__file__)),'testSpec.json')
+
+# the test definitions - repeaters, locations, scoring weights, mapID range and solution
+#  files - come from testSpec.json (see testSpec.py); the module globals below belong to
+#  the test that is being worked on (the spec's current test, or --test), while
+#  gradeResponse looks up the test for each submission from its mapID
+testSpecs=loadSpecs(testSpecFile)
+
+def useTest(spec):
+	global test,firstMapID,numberOfMaps,mapIDList,repeaters,locations,letters
+	global partOneFile,partTwoFile,itemStatsFile,fillable_pdf
+	test=spec
+	firstMapID=spec.firstMapID
+	numberOfMaps=spec.lastMapID-spec.firstMapID
+	mapIDList=list(range(spec.firstMapID,spec.lastMapID+1))
+	repeaters=spec.repeaters
+	locations=spec.locations
+	letters=spec.letters
+	partOneFile=spec.partOneKey
+	partTwoFile=spec.partTwoKey
+	itemStatsFile=spec.itemStats
+	fillable_pdf=spec.template or fillable_pdf
+
+useTest(testSpecs.current)
+
+# links used in the assignment email
+mapURLBase='https://caver456.pythonanywhere.com/repeaterTest/'
+previewURLBase='https://caver456.pythonanywhere.com/api/v1/repeaterTest/preview/'
+previewFormat='svg' # the preview format linked from the assignment email (see makePreviews)
+instructionsURL='https://caver456.pythonanywhere.com/repeaterTest/repeaterTestInstructions.pdf'
+jotformURL='https://www.jotform.com/form/233555430790053'
+
 SENDGRID_API_KEY=os.getenv("SENDGRID_API_KEY")
 
+# testDict will either be created from scratch by assignTests, or, loaded from a file
+testDict={}
+solutionDicts={}
+
 # 1. generate the answer sets
 solutionDict={}
 
-def buildSolutionDict():
-	for id in mapIDList:
+# minDistance: every pair of maps must have at least this many letters assigned to different repeaters
+# balanced: spread each repeater evenly over the letters, across all maps
+#  (see answerSets.py)
+def buildSolutionDict(mapIDs=None,fileName=None,minDistance=12,balanced=False,seed=None):
+	if mapIDs is None:
+		mapIDs=mapIDList
+	answerSets=generateAnswerSets(len(mapIDs),len(repeaters),minDistance,balanced,seed)
+	if answerSets is None:
+		logging.info('ERROR: buildSolutionDict could not generate the answer sets; nothing saved')
+		return None
+	for (id,row) in zip(mapIDs,answerSets.tolist()):
 		solutionDict[str(id)]={}
-		repeaterSample=random.sample(repeaters,len(repeaters)) # unique sampling
-		for n in range(len(repeaterSample)):
-			solutionDict[str(id)][repeaterSample[n]]=chr(65+n)
+		for n in range(len(row)):
+			solutionDict[str(id)][repeaters[row[n]]]=chr(65+n)
 	logging.info(json.dumps(solutionDict,indent=3))
-	fileName='solutionDict_partOne'+time.strftime('%Y%m%d%H%M%S')+'.json'
+	if not fileName:
+		fileName='solutionDict_partOne'+time.strftime('%Y%m%d%H%M%S')+'.json'
 	with open(fileName,'w') as ofile:
 		logging.info('Saving solutionDict to '+fileName)
 		json.dump(solutionDict,ofile,indent=3)
+	return fileName
 
 # 2. generate the PDF for each set
 
@@ -127,12 +187,12 @@ def buildSolutionDict():
 # 5. read the results from jotform and check the answers
 #    (to be done on pythonanywhere, triggered by jotform webhook)
 
-def readSolutionDicts():
+def readSolutionDicts(partOneFileName=None,partTwoFileName=None):
 	global solutionDicts
-	with open('./solutionDict_partOne20240124085012.json','r') as f:
+	with open(partOneFileName or partOneFile,'r') as f:
 		# logging.info(' reading partOne soltions...')
 		solutionDicts['partOne']=json.load(f)
-	with open('./solutionDict_partTwo.json','r') as f:
+	with open(partTwoFileName or partTwoFile,'r') as f:
 		# logging.info(' reading partTwo soltions...')
 		solutionDicts['partTwo']=json.load(f)
 		# validate the file, to check for typos or repeated entries
@@ -165,28 +225,29 @@ def strp(theList,spaces=True):
 		s=s.replace(', ',',')
 	return s
 
-def getEmailsFromMembersJson(filename,subset=None):
-	logging.info('only reading member info for these '+str(len(subset))+' members:')
-	logging.info(str(subset))
-	# filename should be a file containing the json response from
-	#  https://api.d4h.org/v2/team/members
-	with open(filename,'r') as f:
-		j=json.load(f)
-		logging.info('D4H members data read from file: '+filename)
-	d=j['data']
-	rval={}
-	for member in d:
-		m=member['ref']
-		e=member['email']
-		n=member['name']
-		if not subset or (subset and m in subset):
-			rval[m]={}
-			rval[m]['email']=e
-			rval[m]['name']=n
+# filename should be a file containing the json response from
+#  https://api.d4h.org/v2/team/members; it is read one member at a time (see members.py)
+# memberIndex: optional members.MemberIndex; if specified, the index is refreshed from
+#  filename (only members modified since its last refresh), and the entries come from the index
+def getEmailsFromMembersJson(filename,subset=None,memberIndex=None):
+	if subset:
+		logging.info('only reading member info for '+str(len(subset))+' members')
+	if memberIndex:
+		memberIndex.refresh(D4HExportSource(filename))
+		rval=memberIndex.testDictEntries(subset)
+	else:
+		rval=readMembersJson(filename,subset)
+	logging.info('D4H members data read from file: '+filename+' ('+str(len(rval))+' members)')
 	return rval
 
+# raises ValueError if the mapIDs would run outside the test's mapID range, since
+#  submissions for those maps could not be graded
 def assignTests(firstMapID):
 	global testDict
+	lastMapID=firstMapID+len(testDict)-1
+	if firstMapID<test.firstMapID or lastMapID>test.lastMapID:
+		raise ValueError('mapIDs '+str(firstMapID)+' to '+str(lastMapID)+' for '+str(len(testDict))+' members are outside the mapID range of test '
+			+test.name+' ('+str(test.firstMapID)+' to '+str(test.lastMapID)+'); extend the range in the test spec')
 	mapID=firstMapID
 	for sarID in testDict.keys():
 		testDict[sarID]['mapID']=mapID
@@ -200,46 +261,58 @@ def assignTests(firstMapID):
 def sendTests(sarIDList=None):
 	global testDict
 	if not sarIDList:
-		sarIDList=testDict.keys()
+		sarIDList=list(testDict.keys())
 	for sarID in sarIDList:
-		sarID=str(sarID) # keys are strings, since some may include letters like 1S9
-		d=testDict.get(sarID,None)
-		if not d:
-			logging.info('ERROR: sendTest sarID '+str(sarID)+' has no entry in testDict.')
-			continue
-		mapID=d.get('mapID',None)
-		if not mapID:
-			logging.info('ERROR: sendTest sarID '+str(sarID)+' has no specified mapID.')
-			continue
-		email=d.get('email',None)
-		if not email:
-			logging.info('ERROR: sendTest sarID '+str(sarID)+' has no associated email address.')
-			continue
-		logging.info('Sending Map ID '+str(mapID)+' to SAR '+str(sarID)+' at '+str(email))
-		emailSubject='Repeater Locations Test: Your Map ID is '+str(mapID)
-		mapLink='https://caver456.pythonanywhere.com/repeaterTest/repeaterTest_'+str(mapID)+'.pdf'
-		emailBody='PDF: '+mapLink
-		rval=sendEmail(
-			from_email='caver456@gmail.com',
-			to_emails=email,
-			subject='Repeater Locations Test: Your Map ID is '+str(mapID),
-			html_content='''
-			1. Repeater Test Instructions: <a href="https://caver456.pythonanywhere.com/repeaterTest/repeaterTestInstructions.pdf">Click Here</a><br>
-			2. Your customized repeater test map PDF: <a href="%mapLink%">Click Here</a><br>
-			3. Your Map ID: %mapID%<br>
-			4. The test: <a href="https://www.jotform.com/form/233555430790053?SARNumber=%sarID%&mapID=%mapID%">Click Here</a>'''.replace('%mapLink%',mapLink).replace('%mapID%',str(mapID)).replace('%sarID%',sarID)
-		)
-		# on sharepoint, which required login for at least one tester:
-		# 1. Repeater Test Instructions: <a href="https://ncssar.sharepoint.com/:w:/s/MasterFile/EYFwFd0cnBpKnCCNhdQkCbsBJu3GD3aTHlUY2itlrBkEpA?e=t6n9Yx">Click Here</a><br>
-		if rval:
-			testDict[sarID]['assignmentSent']=time.strftime('%a %b %d %Y %H:%M:%S')
+		sendTest(sarID)
+
+# send the assignment email to one member; returns True if the email was sent
+#  reminder: send it again as a reminder (sets reminderSent and counts remindersSent,
+#   instead of setting assignmentSent)
+def sendTest(sarID,reminder=False):
+	global testDict
+	sarID=str(sarID) # keys are strings, since some may include letters like 1S9
+	d=testDict.get(sarID,None)
+	if not d:
+		logging.info('ERROR: sendTest sarID '+str(sarID)+' has no entry in testDict.')
+		return False
+	mapID=d.get('mapID',None)
+	if not mapID:
+		logging.info('ERROR: sendTest sarID '+str(sarID)+' has no specified mapID.')
+		return False
+	email=d.get('email',None)
+	if not email:
+		logging.info('ERROR: sendTest sarID '+str(sarID)+' has no associated email address.')
+		return False
+	logging.info('Sending Map ID '+str(mapID)+' to SAR '+str(sarID)+' at '+str(email))
+	mapLink=mapURLBase+'repeaterTest_'+str(mapID)+'.pdf'
+	previewLink=previewURLBase+'repeaterTest_'+str(mapID)+'.'+previewFormat
+	rval=sendEmail(
+		from_email='caver456@gmail.com',
+		to_emails=email,
+		subject=('Reminder - ' if reminder else '')+'Repeater Locations Test: Your Map ID is '+str(mapID),
+		html_content='''
+		1. Repeater Test Instructions: <a href="%instructionsURL%">Click Here</a><br>
+		2. Your customized repeater test map PDF: <a href="%mapLink%">Click Here</a> (quick view for phones: <a href="%previewLink%">Click Here</a>)<br>
+		3. Your Map ID: %mapID%<br>
+		4. The test: <a href="%jotformURL%?SARNumber=%sarID%&mapID=%mapID%">Click Here</a>'''.replace('%instructionsURL%',instructionsURL).replace('%jotformURL%',jotformURL).replace('%mapLink%',mapLink).replace('%previewLink%',previewLink).replace('%mapID%',str(mapID)).replace('%sarID%',sarID)
+	)
+	# on sharepoint, which required login for at least one tester:
+	# 1. Repeater Test Instructions: <a href="https://ncssar.sharepoint.com/:w:/s/MasterFile/EYFwFd0cnBpKnCCNhdQkCbsBJu3GD3aTHlUY2itlrBkEpA?e=t6n9Yx">Click Here</a><br>
+	if rval and reminder:
+		testDict[sarID]['reminderSent']=time.strftime('%a %b %d %Y %H:%M:%S')
+		testDict[sarID]['remindersSent']=testDict[sarID].get('remindersSent',0)+1
+	elif rval:
+		testDict[sarID]['assignmentSent']=time.strftime('%a %b %d %Y %H:%M:%S')
+	return rval
 
-def sendEmail(from_email,to_emails,subject,html_content):
+# plain_text_content: optional text/plain alternative to html_content
+def sendEmail(from_email,to_emails,subject,html_content,plain_text_content=None):
 	msg=Mail(
 		from_email=from_email,
 		to_emails=to_emails,
 		subject=subject,
-		html_content=html_content
+		html_content=html_content,
+		plain_text_content=plain_text_content
 	)
 	try:
 		sendgrid_client = SendGridAPIClient(SENDGRID_API_KEY)
@@ -253,7 +326,13 @@ def sendEmail(from_email,to_emails,subject,html_content):
 	logging.info('  email sent')
 	return True
 
-def gradeResponse(mapID='2000',responseDict={}):
+# notify: True = email the graded results; False = don't; 'ifChanged' = only if the grade changed
+# record: add the result to summary.txt (False when re-sending the results of a submission
+#  that was already recorded); the item statistics always count the member's latest
+#  submission, in place of their previous one (see itemStats.py)
+# spec: the test to grade as (default: the test whose mapID range has mapID); 'grade --key'
+#  passes the selected test, since an explicit key file decides which maps exist
+def gradeResponse(mapID='2000',responseDict={},notify=True,record=True,spec=None):
 	global solutionDicts
 	logging.info('gradeResponse called for mapID='+str(mapID))
 	if not responseDict:
@@ -263,10 +342,17 @@ def gradeResponse(mapID='2000',responseDict={}):
 	logging.info(json.dumps(responseDict,indent=3))
 	scoreDict={}
 	scorePct={}
-	gradedText=''
+	report=[] # graded report lines, rendered by renderReport (see gradedReport.py)
 
 	sarID=responseDict['SARNumber']
 
+	# the repeaters, locations and scoring weights of the test that this map belongs to
+	spec=spec or testSpecs.forMapID(mapID)
+	if not spec:
+		logging.info('ERROR: specified mapID '+str(mapID)+' is not in the mapID range of any test in '+testSpecFile+' (to grade against a key file anyway, give it with --key)')
+		return
+	(repeaters,locations,letters,weights)=(spec.repeaters,spec.locations,spec.letters,spec.weights)
+
 	gradedFileName='repeaterTest_graded_'+str(mapID)+'.txt'
 
 	###########
@@ -279,7 +365,7 @@ def gradeResponse(mapID='2000',responseDict={}):
 		return
 	partOne=responseDict.get('partOne',None)
 	if not partOne:
-		gradedText+='\nERROR: partOne not found in response data'
+		report.append(('error',{'message':'partOne not found in response data'}))
 		logging.info('ERROR: partOne not found in response data')
 		return
 
@@ -306,17 +392,13 @@ def gradeResponse(mapID='2000',responseDict={}):
 
 	partOneResponseDict={}
 	# 1-24-24: at this point, partOne should be a list of dicts, each with a single key (the column number);
-	#  if so, replace keys (column numbers) with repeater names based on list index
-	if partOne.__class__.__name__=='list':
-		out={}
-		for n in range(len(partOne)):
-			e=partOne[n]
-			if e.__class__.__name__=='list' and len(e)==1:
-				letter=e[0]
-			else:
-				letter=list(partOne[n].values())[0]
-			out[letter]=repeaters[n]
-		partOneResponseDict=out
+	#  replace keys (column numbers) with repeater names based on list index
+	#  (parsePartOne also handles the older dict-of-dicts format; the item statistics are kept
+	#  by letter, and the grading below goes by row, from letterList)
+	letterList=parsePartOne(partOne)[:len(repeaters)]
+	for (n,letter) in enumerate(letterList):
+		if letter:
+			partOneResponseDict[letter]=repeaters[n]
 		
 	# logging.info('partOne after processing:')
 	# logging.info(json.dumps(partOne,indent=3))
@@ -333,23 +415,27 @@ def gradeResponse(mapID='2000',responseDict={}):
 	# responseDict2={v:k for k,v in responseDict.items()}
 	solutionDict2={v:k for k,v in solutionDict.items()}
 
-	gradedText+='\nNCSSAR Repeater Test - Results for SAR'+str(sarID)+'  Map ID '+str(mapID)
-	gradedText+='\n==================================='
-	gradedText+='\nPart One - match map letters to repeater names'
-	gradedText+='\n-----------------------------------'
+	report+=[
+		('title',{'sarID':sarID,'mapID':mapID}),
+		('doubleRule',{}),
+		('partOneHeading',{}),
+		('rule',{})
+	]
+	# grade by row: a letter is correct if it was chosen on the correct repeater's row, even
+	#  if it was also chosen on another row (partOneResponseDict only keeps one row per letter)
 	for letter in letters:
 		correctRepeater=solutionDict2[letter]
-		guessedRepeater=partOneResponseDict[letter]
-		if guessedRepeater==correctRepeater:
-			gradedText+='\n  CORRECT: '+letter+' = '+correctRepeater
+		guessedRepeaters=[repeaters[n] for (n,l) in enumerate(letterList) if l==letter]
+		if correctRepeater in guessedRepeaters:
+			report.append(('partOneCorrect',{'letter':letter,'repeater':correctRepeater}))
 			scoreDict['partOne']+=1
 		else:
-			gradedText+='\nINCORRECT: '+letter+' = '+correctRepeater+'  (you guessed '+guessedRepeater+')'
-	gradedText+='\n-----------------------------------'
+			report.append(('partOneIncorrect',{'letter':letter,'repeater':correctRepeater,'guessed':strp(guessedRepeaters) or 'nothing'}))
+	report.append(('rule',{}))
 	score=scoreDict['partOne']
 	pct=round(float(score/len(repeaters)*100))
 	scorePct['partOne']=pct
-	gradedText+='\nPart One Score: '+str(pct)+'%  ('+str(score)+' of '+str(len(repeaters))+')'
+	report.append(('partOneScore',{'pct':pct,'score':score,'count':len(repeaters)}))
 
 	###########
 	# PART TWO
@@ -358,7 +444,7 @@ def gradeResponse(mapID='2000',responseDict={}):
 	solutionDict=solutionDicts['partTwo']
 	partTwo=responseDict.get('partTwo',None)
 	if not partTwo:
-		gradedText+='\nERROR: partTwo not found in response data'
+		report.append(('error',{'message':'partTwo not found in response data'}))
 		logging.info('ERROR: partTwo not found in response data')
 		return
 	# # decode then deserialize, to turn this into valid json:
@@ -372,8 +458,8 @@ def gradeResponse(mapID='2000',responseDict={}):
 
 	# 1-24-24: partTwo val is a list of lists
 
-	for n in range(len(partTwo)):
-		partTwoResponseDict[locations[n]]=partTwo[n]
+	for (n,selected) in enumerate(parsePartTwo(partTwo)[:len(locations)]):
+		partTwoResponseDict[locations[n]]=selected
 
 	# for rowNum in partTwo.keys():
 	# 	repeaterResponses=[v for v in partTwo[rowNum].values() if v]
@@ -387,73 +473,87 @@ def gradeResponse(mapID='2000',responseDict={}):
 	# responseDict2={v:k for k,v in responseDict.items()}
 	# solutionDict2={v:k for k,v in solutionDict.items()}
 
-	gradedText+='\n\n==================================='
-	gradedText+='\nPart Two - repeaters likely to work at listed locations'
-	gradedText+='\n-----------------------------------'
+	report+=[
+		('blank',{}),
+		('doubleRule',{}),
+		('partTwoHeading',{}),
+		('rule',{})
+	]
 	# maxPossibleScore=0
 	targetScore=0
+	locationScores={}
 	for location in locations:
 		requiredRepeaters=solutionDict[location]['required']
 		optionalRepeaters=solutionDict[location]['optional']
 		unlikelyRepeaters=solutionDict[location]['unlikely']
 		guessedRepeaters=partTwoResponseDict[location]
-		requiredRepeatersGuessed=[]
-		optionalRepeatersGuessed=[]
-		unlikelyRepeatersGuessed=[]
-		for repeater in guessedRepeaters:
-			if repeater in requiredRepeaters:
-				requiredRepeatersGuessed.append(repeater)
-			elif repeater in optionalRepeaters:
-				optionalRepeatersGuessed.append(repeater)
-			elif repeater in unlikelyRepeaters:
-				unlikelyRepeatersGuessed.append(repeater)
-		gradedText+='\n\n'+location+':  you selected '+strp(guessedRepeaters)
-		# print('\n'+location+':     requiredRepeatersGuessed: '+strp(requiredRepeatersGuessed),file=outfile)
-		# print('\n'+location+':     optionalRepeatersGuessed: '+strp(optionalRepeatersGuessed),file=outfile)
-		# print('\n'+location+':     unlikelyRepeatersGuessed: '+strp(unlikelyRepeatersGuessed),file=outfile)
-		if len(requiredRepeatersGuessed)==len(requiredRepeaters):
-			gradedText+='\n    CORRECT: Your selections included all of the most likely repeaters ('+strp(requiredRepeaters)+')'
-			scoreDict['partTwo']+=10
-		elif len(requiredRepeatersGuessed)==len(requiredRepeaters)-1:
-			gradedText+='\n    PARTIAL: Your selections included all but one of the most likely repeaters ('+strp(requiredRepeaters)+')'
-			scoreDict['partTwo']+=6
+		result=scorePartTwoLocation(solutionDict[location],guessedRepeaters,weights)
+		report+=[('blank',{}),('location',{'location':location,'selected':strp(guessedRepeaters)})]
+		if result['outcome']=='CORRECT':
+			report.append(('partTwoCorrect',{'required':strp(requiredRepeaters)}))
+		elif result['outcome']=='PARTIAL':
+			report.append(('partTwoPartial',{'required':strp(requiredRepeaters)}))
 		else:
-			gradedText+='\n  INCORRECT: Your selections did not include all of the most likely repeaters ('+strp(requiredRepeaters)+')'
-		olen=len(optionalRepeatersGuessed)
+			report.append(('partTwoIncorrect',{'required':strp(requiredRepeaters)}))
+		olen=len(result['optional'])
 		if olen>0:
-			gradedText+='\n      BONUS: You selected '+str(olen)+' of the other possible repeaters ('+strp(optionalRepeaters)+')'
-			scoreDict['partTwo']+=(olen*2)
-		ulen=len(unlikelyRepeatersGuessed)
+			report.append(('partTwoBonus',{'count':olen,'optional':strp(optionalRepeaters)}))
+		ulen=len(result['unlikely'])
 		if ulen>0:
-			gradedText+='\n  DEDUCTION: You selected '+str(ulen)+' of the highly-unlikely repeaters ('+strp(unlikelyRepeaters)+')'
-			scoreDict['partTwo']-=ulen
+			report.append(('partTwoDeduction',{'count':ulen,'unlikely':strp(unlikelyRepeaters)}))
+		scoreDict['partTwo']+=result['points']
+		locationScores[location]=result['points']
 		# maxPossibleScore+=10+olen
-		targetScore+=10
-	gradedText+='\n-----------------------------------'
+		targetScore+=weights['target']
+
+	# update the running item-level statistics: this submission replaces the member's previous
+	#  one, if that was for a map of this test (solutionDict is the partTwo solution at this point)
+	previousGuesses=testDict[sarID].get('guesses',None)
+	previousKey=solutionDicts['partOne'].get(str(previousGuesses['mapID']),None) if previousGuesses else None
+	previous=guessesResult(previousGuesses,previousKey,solutionDict,repeaters,locations) if previousKey else None
+	replaceResult(itemStatsFile,repeaters,locations,previous,(solutionDict2,partOneResponseDict,solutionDict,partTwoResponseDict))
+
+	report.append(('rule',{}))
 	score=scoreDict['partTwo']
 	# pct=round(float(score/maxPossibleScore*100))
 	pct=round(float(score/targetScore*100))
 	scorePct['partTwo']=pct
 	# print('Part Two Score: '+str(pct)+'%  (your score: '+str(score)+'   maximum possible: '+str(maxPossibleScore)+')',file=outfile)
-	gradedText+='\nPart Two Score: '+str(pct)+'%  (your score: '+str(score)+'   target score: '+str(targetScore)+')'
+	report.append(('partTwoScore',{'pct':pct,'score':score,'target':targetScore}))
 
-	summary='SAR'+sarID+' : Map ID '+mapID+' : '+time.strftime('%a %b %d %H:%M:%S')
 	grade='Part One: '+str(scorePct['partOne'])+'%    Part Two: '+str(scorePct['partTwo'])+'%'
-	summary+='\n'+grade
-	summary+='\n----------------------------------------'
-	with open('summary.txt','a') as sf:
-		print(summary,file=sf)
-
+	summaryLines=[
+		('summaryHeader',{'sarID':sarID,'mapID':mapID,'time':time.strftime('%a %b %d %H:%M:%S')}),
+		('summaryGrade',{'grade':grade}),
+		('summaryRule',{})
+	]
+	summary=renderText(summaryLines)
+	if record:
+		with open('summary.txt','a') as sf:
+			print(summary,file=sf)
+
+	previousGrade=testDict[sarID].get('grade',None)
 	testDict[sarID]['graded']=time.strftime('%a %b %d %Y %H:%M:%S')
 	testDict[sarID]['grade']=grade
+	testDict[sarID]['test']=spec.name+' v'+str(spec.version)
+	testDict[sarID]['pct']=scorePct
+	# keep the answers and the per-location scores, so that regrade can find the
+	#  submissions affected by a change to the answer keys
+	testDict[sarID]['guesses']={'mapID':mapID,'partOne':partOne,'partTwo':partTwo}
+	testDict[sarID]['scores']={'partOne':scoreDict['partOne'],'partTwo':locationScores}
+	if not notify or (notify=='ifChanged' and grade==previousGrade):
+		return grade
+	(text,htmlContent)=renderReport(summaryLines+[('blank',{})]+report)
 	rval=sendEmail(
 		from_email='caver456@gmail.com',
 		to_emails=testDict[sarID]['email'],
 		subject='Repeater Test graded results',
-		html_content=(summary+'\n'+gradedText).replace('\n','<br>').replace(' ','&nbsp;')
+		html_content=htmlContent,
+		plain_text_content=text
 		)
 	if rval:
 		testDict[sarID]['gradedEmailSent']=time.strftime('%a %b %d %Y %H:%M:%S')
+	return grade
 
 # def makePDFs():
 
@@ -521,109 +621,394 @@ def gradeResponse(mapID='2000',responseDict={}):
 # 			writer.write(output_stream)
 
 
-def makePDFs():
+# build the PDF for one map: key is that map's partOne solution dict (repeater name : letter)
+def makePDF(mapID,key,template,outDir='.'):
 	# this solution works for all but Read Mode on the phone:
 	# https://stackoverflow.com/a/73655665/3577105
 	#  the main difference is that it doesn't rely upon NeedAppearances,
 	#   and actually creates stream objects instead
-	template = PdfReader(fillable_pdf)
+	logging.info('building PDF for '+str(mapID)+'...')
+	# Initialize writer.
+	writer = PdfWriter()
 
-	partOneDict=solutionDicts['partOne']
-	for mapID in partOneDict.keys():
-		logging.info('building PDF for '+mapID+'...')
-		# Initialize writer.
-		writer = PdfWriter()
+	# Add the template page.
+	writer.add_page(template.pages[0])
 
-		# Add the template page.
-		writer.add_page(template.pages[0])
+	# Get page annotations.
+	page_annotations = writer.pages[0][PageAttributes.ANNOTS]
+	# page_annotations = writer.pages[0]['/Annots']
+	
+	# remove spaces from key names to get corresponding pdf field names
+	data={k.replace(' ',''):v for k,v in key.items()}
+	data['MAPID']=str(mapID)
+
+	# Loop through page annotations (fields).
+	for index in range(len(page_annotations)):  # type: ignore
+		# Get annotation object.
+		annotation = page_annotations[index].get_object()  # type: ignore
+
+		# Get existing values needed to create the new stream and update the field.
+		field = annotation.get(NameObject("/T"))
+		new_value = data.get(field, 'N/A')
+		ap = annotation.get(AnnotationDictionaryAttributes.AP)
+		x_object = ap.get(NameObject("/N")).get_object()
+		font = annotation.get(InteractiveFormDictEntries.DA)
+		rect = annotation.get(AnnotationDictionaryAttributes.Rect)
+
+		# Calculate the text position.
+		font_size = float(font.split(" ")[1])
+		w = round(float(rect[2] - rect[0] - 2), 2)
+		h = round(float(rect[3] - rect[1] - 2), 2)
+		text_position_h = h / 2 - font_size / 3  # approximation
+
+		# Create a new XObject stream.
+		new_stream = f'''
+			/Tx BMC 
+			q
+			1 1 {w} {h} re W n
+			BT
+			{font}
+			2 {text_position_h} Td
+			({new_value}) Tj
+			ET
+			Q
+			EMC
+		'''
+
+		# Add Filter type to XObject.
+		x_object.update(
+			{
+				NameObject(StreamAttributes.FILTER): NameObject(FilterTypes.FLATE_DECODE)
+			}
+		)
 
-		# Get page annotations.
-		page_annotations = writer.pages[0][PageAttributes.ANNOTS]
-		# page_annotations = writer.pages[0]['/Annots']
-		
-		# remove spaces from key names to get corresponding pdf field names
-		data={k.replace(' ',''):v for k,v in partOneDict[mapID].items()}
-		data['MAPID']=mapID
-
-		# Loop through page annotations (fields).
-		for index in range(len(page_annotations)):  # type: ignore
-			# Get annotation object.
-			annotation = page_annotations[index].get_object()  # type: ignore
-
-			# Get existing values needed to create the new stream and update the field.
-			field = annotation.get(NameObject("/T"))
-			new_value = data.get(field, 'N/A')
-			ap = annotation.get(AnnotationDictionaryAttributes.AP)
-			x_object = ap.get(NameObject("/N")).get_object()
-			font = annotation.get(InteractiveFormDictEntries.DA)
-			rect = annotation.get(AnnotationDictionaryAttributes.Rect)
-
-			# Calculate the text position.
-			font_size = float(font.split(" ")[1])
-			w = round(float(rect[2] - rect[0] - 2), 2)
-			h = round(float(rect[3] - rect[1] - 2), 2)
-			text_position_h = h / 2 - font_size / 3  # approximation
-
-			# Create a new XObject stream.
-			new_stream = f'''
-				/Tx BMC 
-				q
-				1 1 {w} {h} re W n
-				BT
-				{font}
-				2 {text_position_h} Td
-				({new_value}) Tj
-				ET
-				Q
-				EMC
-			'''
-
-			# Add Filter type to XObject.
-			x_object.update(
-				{
-					NameObject(StreamAttributes.FILTER): NameObject(FilterTypes.FLATE_DECODE)
-				}
-			)
-
-			# Update and encode XObject stream.
-			x_object._data = FlateDecode.encode(encode_pdfdocencoding(new_stream))
-
-			# Update annotation dictionary.
-			annotation.update(
-				{
-					# Update Value.
-					NameObject(FieldDictionaryAttributes.V): TextStringObject(
-						new_value
-					),
-					# Update Default Value.
-					NameObject(FieldDictionaryAttributes.DV): TextStringObject(
-						new_value
-					),
-					# Set Read Only flag.
-					NameObject(FieldDictionaryAttributes.Ff): NumberObject(
-						FieldFlag(1)
-					)
-				}
-			)
-
-		# Clone document root & metadata from template.
-		# This is required so that the document doesn't try to save before closing.
-		# writer.clone_reader_document_root(template)
-
-		# write "output".
-		with open('repeaterTest_'+str(mapID)+'.pdf', 'wb') as output_stream:
-			writer.write(output_stream)
-
-def saveTestDict():
-	logging.info('saving testDict to testDict.json')
-	with open('testDict.json','w') as td:
-		json.dump(testDict,td,indent=3)
-
-def loadTestDict():
+		# Update and encode XObject stream.
+		x_object._data = FlateDecode.encode(encode_pdfdocencoding(new_stream))
+
+		# Update annotation dictionary.
+		annotation.update(
+			{
+				# Update Value.
+				NameObject(FieldDictionaryAttributes.V): TextStringObject(
+					new_value
+				),
+				# Update Default Value.
+				NameObject(FieldDictionaryAttributes.DV): TextStringObject(
+					new_value
+				),
+				# Set Read Only flag.
+				NameObject(FieldDictionaryAttributes.Ff): NumberObject(
+					FieldFlag(1)
+				)
+			}
+		)
+
+	# Clone document root & metadata from template.
+	# This is required so that the document doesn't try to save before closing.
+	# writer.clone_reader_document_root(template)
+
+	# write "output".
+	fileName=os.path.join(outDir,'repeaterTest_'+str(mapID)+'.pdf')
+	with open(fileName, 'wb') as output_stream:
+		writer.write(output_stream)
+	return fileName
+
+# the template is opened once per render worker process, rather than once per map
+renderTemplate=None
+
+def initRenderWorker(templateFile):
+	global renderTemplate
+	renderTemplate=PdfReader(templateFile)
+
+# verify: read the new PDF back and check it against the key (see pdfVerify.py); a PDF
+#  that doesn't match is reported as not built
+# sizeBudget: maximum bytes per map PDF; a larger PDF is removed and reported as not built
+def renderWorker(mapID,key,outDir,verify=True,sizeBudget=None):
+	fileName=makePDF(mapID,key,renderTemplate,outDir)
+	if verify:
+		problems=verifyPDF(fileName,mapID,key)
+		if problems:
+			raise ValueError(fileName+' does not match the key: '+'; '.join(problems))
+	if sizeBudget:
+		size=os.path.getsize(fileName)
+		if size>sizeBudget:
+			os.remove(fileName)
+			raise ValueError(fileName+' is '+str(size)+' bytes, over the size budget of '+str(sizeBudget)+' bytes')
+	return fileName
+
+# generator: render the PDFs for the specified maps in a process pool, yielding
+#  (mapID,fileName) for each map as soon as its PDF is written; fileName is None
+#  if that map could not be built (or, with verify, if it failed verification)
+def iterRenderPDFs(mapIDs=None,outDir='.',templateFile=None,workers=None,verify=True,sizeBudget=None):
+	partOneDict=solutionDicts['partOne']
+	if mapIDs is None:
+		mapIDs=list(partOneDict.keys())
+	with ProcessPoolExecutor(max_workers=workers,initializer=initRenderWorker,initargs=(templateFile or fillable_pdf,)) as pool:
+		futures={}
+		for mapID in mapIDs:
+			mapID=str(mapID)
+			key=partOneDict.get(mapID,None)
+			if not key:
+				logging.info('ERROR: mapID '+mapID+' has no corresponding entry in solutionDicts')
+				yield (mapID,None)
+				continue
+			futures[pool.submit(renderWorker,mapID,key,outDir,verify,sizeBudget)]=mapID
+		for future in as_completed(futures):
+			mapID=futures[future]
+			try:
+				fileName=future.result()
+			except Exception as e:
+				logging.info('ERROR: PDF for mapID '+mapID+' was not built: '+str(e))
+				fileName=None
+			yield (mapID,fileName)
+
+def makePDFs(mapIDs=None,outDir='.',templateFile=None,workers=None,verify=True,sizeBudget=None):
+	built=[]
+	for (mapID,fileName) in iterRenderPDFs(mapIDs,outDir,templateFile,workers,verify,sizeBudget):
+		if fileName:
+			built.append(fileName)
+	logging.info(str(len(built))+' PDFs built'+(' and verified' if verify else '')+' in '+outDir)
+	return built
+
+def verifyWorker(args):
+	(mapID,fileName,key)=args
+	return (mapID,verifyPDF(fileName,mapID,key))
+
+# check PDFs that were already built (e.g. before uploading them), in a process pool
+#  returns a report: checked, passed, and failed (key = mapID, val = list of problems)
+def verifyPDFs(mapIDs=None,outDir='.',workers=None):
+	partOneDict=solutionDicts['partOne']
+	if mapIDs is None:
+		mapIDs=list(partOneDict.keys())
+	jobs=[]
+	failed={}
+	for mapID in mapIDs:
+		mapID=str(mapID)
+		key=partOneDict.get(mapID,None)
+		if not key:
+			failed[mapID]=['no entry in solutionDicts']
+			continue
+		jobs.append((mapID,os.path.join(outDir,'repeaterTest_'+mapID+'.pdf'),key))
+	with ProcessPoolExecutor(max_workers=workers) as pool:
+		# maps are small, quick jobs, so hand them to the workers in chunks
+		chunkSize=max(1,len(jobs)//((workers or os.cpu_count() or 1)*8))
+		for (mapID,problems) in pool.map(verifyWorker,jobs,chunksize=chunkSize):
+			if problems:
+				failed[mapID]=problems
+	for (mapID,problems) in failed.items():
+		logging.info('ERROR: map '+mapID+': '+'; '.join(problems))
+	report={'checked':len(mapIDs),'passed':len(mapIDs)-len(failed),'failed':failed}
+	logging.info('verifyPDFs: '+str(report['passed'])+' of '+str(report['checked'])+' PDFs in '+outDir+' match their keys')
+	return report
+
+# previews (see previews.py): the template's map image is written once, as a shared base
+#  image, and each map gets only its labels:
+#   svg - a small overlay file per map that references the base image; built in this process,
+#     since it's just text
+#   webp, png - the labels drawn into a copy of the base image (requires Pillow); the base
+#     image is decoded once per worker process
+previewLayout=None
+previewBase=None
+
+def initPreviewWorker(templateFile,maxWidth):
+	global previewLayout,previewBase
+	previewLayout=readTemplateLayout(templateFile)
+	previewBase=baseRaster(previewLayout,maxWidth)
+
+def previewWorker(mapID,key,outDir,fmt):
+	fileName=os.path.join(outDir,'repeaterTest_'+str(mapID)+'.'+fmt)
+	with open(fileName,'wb') as f:
+		f.write(rasterPreview(previewLayout,previewBase,mapID,key,fmt))
+	return fileName
+
+# maxWidth: width in pixels of the base image (default: the template's image as-is)
+#  returns the list of preview files written
+def makePreviews(mapIDs=None,outDir='.',templateFile=None,workers=None,fmt='svg',maxWidth=None):
+	partOneDict=solutionDicts['partOne']
+	if mapIDs is None:
+		mapIDs=list(partOneDict.keys())
+	templateFile=templateFile or fillable_pdf
+	jobs=[]
+	for mapID in mapIDs:
+		mapID=str(mapID)
+		key=partOneDict.get(mapID,None)
+		if not key:
+			logging.info('ERROR: mapID '+mapID+' has no corresponding entry in solutionDicts')
+			continue
+		jobs.append((mapID,key))
+	built=[]
+	if fmt=='svg':
+		layout=readTemplateLayout(templateFile)
+		baseName=writeBaseImage(layout,outDir,maxWidth)
+		logging.info('preview base image: '+os.path.join(outDir,baseName))
+		for (mapID,key) in jobs:
+			fileName=os.path.join(outDir,'repeaterTest_'+mapID+'.svg')
+			with open(fileName,'w') as f:
+				f.write(svgPreview(layout,baseName,mapID,key))
+			built.append(fileName)
+	else:
+		with ProcessPoolExecutor(max_workers=workers,initializer=initPreviewWorker,initargs=(templateFile,maxWidth)) as pool:
+			futures={pool.submit(previewWorker,mapID,key,outDir,fmt):mapID for (mapID,key) in jobs}
+			for future in as_completed(futures):
+				try:
+					built.append(future.result())
+				except Exception as e:
+					logging.info('ERROR: preview for mapID '+futures[future]+' was not built: '+str(e))
+	logging.info(str(len(built))+' '+fmt+' previews built in '+outDir)
+	return built
+
+# testDict is kept one entry per member, in testDict.sqlite (see stateStore.py); a
+#  testDict.json that is there replaces it (and is renamed testDict.json.imported)
+def saveTestDict(fileName=None):
+	fileName=fileName or testDictFile
+	logging.info('saving testDict to '+memberStoreFile(fileName))
+	saveMembers(testDict,fileName)
+
+def loadTestDict(fileName=None):
 	global testDict
-	logging.info('loading testDict from testDict.json')
-	with open('testDict.json','r') as td:
-		testDict=json.load(td)
+	fileName=fileName or testDictFile
+	if not os.path.isfile(memberStoreFile(fileName)) and not os.path.isfile(fileName):
+		raise FileNotFoundError('no testDict: neither '+memberStoreFile(fileName)+' nor '+fileName+' exists')
+	logging.info('loading testDict from '+memberStoreFile(fileName))
+	testDict=loadMembers(fileName)
+
+# 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM' local time --> epoch (None stays None)
+def parseLocalTime(s):
+	if not s:
+		return None
+	for fmt in ['%Y-%m-%d %H:%M','%Y-%m-%d']:
+		try:
+			return time.mktime(time.strptime(s,fmt))
+		except ValueError:
+			pass
+	raise ValueError('time '+repr(s)+' is not YYYY-MM-DD or YYYY-MM-DD HH:MM')
+
+# read a list of SAR numbers, one per line, e.g. whoNeedsRepeaterTest_20240124.txt
+def readSARIDList(fileName):
+	with open(fileName,'r') as f:
+		return [line.strip() for line in f.read().splitlines() if line.strip()]
+
+# start a cohort in one streaming pass: each map's PDF is rendered in a process pool,
+#  and the assignment email(s) for that map go out from a thread pool as soon as
+#  the PDF is written, so sending overlaps rendering instead of waiting for all PDFs
+def runCohort(sarIDList=None,outDir='.',templateFile=None,renderWorkers=None,sendWorkers=4,send=True,verify=True,sizeBudget=None):
+	if not sarIDList:
+		sarIDList=list(testDict.keys())
+	sarIDsByMapID={}
+	for sarID in sarIDList:
+		sarID=str(sarID)
+		mapID=testDict.get(sarID,{}).get('mapID',None)
+		if not mapID:
+			logging.info('ERROR: runCohort sarID '+sarID+' has no specified mapID.')
+			continue
+		sarIDsByMapID.setdefault(str(mapID),[]).append(sarID)
+	sent=[]
+	with ThreadPoolExecutor(max_workers=sendWorkers) as sendPool:
+		sendFutures={}
+		for (mapID,fileName) in iterRenderPDFs(list(sarIDsByMapID.keys()),outDir,templateFile,renderWorkers,verify,sizeBudget):
+			if not fileName:
+				continue
+			if send:
+				for sarID in sarIDsByMapID[mapID]:
+					sendFutures[sendPool.submit(sendTest,sarID)]=sarID
+		for future in as_completed(sendFutures):
+			if future.result():
+				sent.append(sendFutures[future])
+	logging.info('runCohort: '+str(len(sent))+' assignment emails sent')
+	return sent
+
+# regrade after a correction to the answer keys: solutionDicts must already hold the new
+#  keys, and oldSolutionDicts the keys the existing grades were computed with; only the
+#  affected submissions (see regrade.py) are regraded
+#  email: send the new results to members whose grade actually changed
+def regrade(oldSolutionDicts,email=False):
+	changedMapIDs=diffKeys(oldSolutionDicts['partOne'],solutionDicts['partOne'])
+	changedLocations=diffKeys(oldSolutionDicts['partTwo'],solutionDicts['partTwo'])
+	# only this test's submissions (other tests have their own keys and weights)
+	members={sarID:d for (sarID,d) in testDict.items() if d.get('guesses',None) and testSpecs.forMapID(d['guesses']['mapID'])==test}
+	affected=findAffected(members,changedMapIDs,changedLocations,solutionDicts['partTwo'],locations,test.weights)
+	logging.info('regrade: '+str(len(changedMapIDs))+' changed map IDs, '+str(len(changedLocations))+' changed locations '+str(changedLocations)+'; '+str(len(affected))+' submissions affected')
+	# the item statistics count each member's latest submission (see itemStats.py); re-count
+	#  the ones counted under a changed key under the new key, so that gradeResponse's
+	#  replacement of an affected member's submission (by the same one) comes out even
+	changedMapIDs=set(changedMapIDs)
+	with lockedFile(itemStatsFile):
+		stats=loadStats(itemStatsFile,repeaters,locations)
+		for (sarID,d) in members.items():
+			guesses=d['guesses']
+			mapID=str(guesses['mapID'])
+			(oldKey,newKey)=(oldSolutionDicts['partOne'].get(mapID,None),solutionDicts['partOne'].get(mapID,None))
+			if not oldKey or not newKey or (mapID not in changedMapIDs and not changedLocations):
+				continue
+			updateStats(stats,*guessesResult(guesses,oldKey,oldSolutionDicts['partTwo'],repeaters,locations),weight=-1)
+			updateStats(stats,*guessesResult(guesses,newKey,solutionDicts['partTwo'],repeaters,locations))
+		saveStats(stats,itemStatsFile)
+	changed=[]
+	for sarID in affected:
+		guesses=testDict[sarID]['guesses']
+		mapID=str(guesses['mapID'])
+		previousGrade=testDict[sarID].get('grade',None)
+		responseDict={'SARNumber':sarID,'mapID':mapID,'partOne':guesses['partOne'],'partTwo':guesses['partTwo']}
+		grade=gradeResponse(mapID,responseDict,notify='ifChanged' if email else False)
+		if grade!=previousGrade:
+			logging.info('regrade: SAR '+sarID+': '+str(previousGrade)+' --> '+str(grade))
+			changed.append(sarID)
+	logging.info('regrade: '+str(len(changed))+' grades changed')
+	return changed
+
+# run one follow-up job for one member (see followUp.py); returns True if an email was sent
+def runFollowUpJob(sarID,job):
+	if job=='sendAssignment':
+		return sendTest(sarID)
+	if job=='remind':
+		return sendTest(sarID,reminder=True)
+	if job=='resendGraded':
+		d=testDict[sarID]
+		guesses=d['guesses']
+		d['gradedResendAttempted']=time.strftime('%a %b %d %Y %H:%M:%S')
+		d['gradedResends']=d.get('gradedResends',0)+1
+		responseDict={'SARNumber':sarID,'mapID':str(guesses['mapID']),'partOne':guesses['partOne'],'partTwo':guesses['partTwo']}
+		gradeResponse(str(guesses['mapID']),responseDict,notify=True,record=False)
+		return 'gradedEmailSent' in d
+
+# follow up on the cohort: every interval seconds, send the reminder / resend jobs that are
+#  due, in batches of up to batchSize, from a pool of sendWorkers threads
+# testDict is re-read each time around if it changed (the webhook keeps grading meanwhile),
+#  but only changed entries are re-indexed; each member's new fields are merged into their
+#  own entry (see stateStore.py), so grades written by the webhook in the meantime are kept
+#  once: run one batch and return (e.g. from a scheduled task)
+#  dryRun: just log the jobs that are due
+# returns the list of (sarID, job, emailSent) that were run
+def runFollowUps(fileName=None,cadence=None,batchSize=50,sendWorkers=4,interval=3600,once=False,dryRun=False):
+	global testDict
+	fileName=fileName or testDictFile
+	index=FollowUpIndex(cadence)
+	done=[]
+	while True:
+		d=index.refreshFromStore(fileName)
+		if d is not None:
+			testDict=d
+		logging.info('follow-up status: '+json.dumps(index.summary()))
+		jobs=index.dueJobs(limit=batchSize)
+		if dryRun:
+			for (sarID,job) in jobs:
+				logging.info('  due: SAR '+sarID+': '+job)
+			return [(sarID,job,False) for (sarID,job) in jobs]
+		before={sarID:dict(testDict[sarID]) for (sarID,job) in jobs}
+		with ThreadPoolExecutor(max_workers=sendWorkers) as pool:
+			futures={pool.submit(runFollowUpJob,sarID,job):(sarID,job) for (sarID,job) in jobs}
+			for future in as_completed(futures):
+				(sarID,job)=futures[future]
+				sent=future.result()
+				logging.info('follow-up: SAR '+sarID+': '+job+(' sent' if sent else ' FAILED'))
+				changed={k:v for (k,v) in testDict[sarID].items() if before[sarID].get(k,None)!=v}
+				if changed:
+					updateMember(fileName,sarID,changed)
+				index.update(sarID,testDict[sarID])
+				done.append((sarID,job,sent))
+		if once:
+			return done
+		time.sleep(interval)
 
 ##################
 ##################
@@ -633,10 +1018,11 @@ def loadTestDict():
 
 # what to run 'offline' (not from pythonanywhere):
 #  - build testDict using only those members that need the qualification
-#  - assignTests  --> upload testDict.json to pythonanywhere - should only contain emails and mapIDs
+#  - assignTests  --> upload testDict.sqlite (or test-dict --export, as testDict.json) to pythonanywhere - should only contain emails and mapIDs
 #  - sendTests
 #  - buildSolutionDict --> upload to pythonanywhere
 #  - makePDFs --> upload PDFs to pythonanywhere
+#  (or, 'cohort' does assignTests, makePDFs and sendTests in one pass)
 
 # what to run 'online' (on pythonanywhere, from webhook handler)
 #  - loadTestDict
@@ -644,46 +1030,401 @@ def loadTestDict():
 #  - gradeResponse (called with the data from the webhook payload)
 #  - saveTestDict
 
-# testDict will either be created from scratch here, or, loaded from a file
-testDict={}
-
-# # initialize testDict: key = SAR ID; val = dict, with one entry for now:
-# #   key = 'email', val = member's email address from D4H
-
-# whoNeedsRepeaterTest=[35]
-# with open('whoNeedsRepeaterTest_20240124.txt','r') as who:
-# 	whoNeedsRepeaterTest=who.read().splitlines()
-
-# testDict=getEmailsFromMembersJson('members.json',subset=whoNeedsRepeaterTest)
-
-# # logging.info('testDict before assignTests ('+str(len(testDict.keys()))+' entries):\n'+json.dumps(testDict,indent=3))
+# history:
+# sendTests([50,138,116,139,46,74,25]) # round 1 - early adopters - sent ~1-25-24
+# sendTests([15,144,54,73,20,51,124,59,27,62,65,93,115,29,60]) # round 2 - sent 1-29-24
+
+# the template for render and cohort: with --optimize, a recompressed copy (see
+#  templateOptimize.py), made once for the build and removed after it
+@contextlib.contextmanager
+def buildTemplate(args):
+	if not args.optimize:
+		yield args.template
+		return
+	(fd,fileName)=tempfile.mkstemp(suffix='.pdf',prefix='template_')
+	os.close(fd)
+	try:
+		logging.info(reportText(optimizeTemplate(args.template or fillable_pdf,fileName,args.quality,args.max_dpi)))
+		yield fileName
+	finally:
+		os.remove(fileName)
+
+def sizeBudgetBytes(args):
+	return round(args.size_budget*1024) if args.size_budget else None
+
+def main(argv=None):
+	global testDict,testSpecs
+	parser=argparse.ArgumentParser(description='NCSSAR repeater locations test')
+	parser.add_argument('--log-dir',default='.',help='directory for the timestamped log file')
+	parser.add_argument('--test-dict',default=testDictFile,help='testDict file (default: %(default)s)')
+	parser.add_argument('--spec',default=testSpecFile,help='test spec file (default: %(default)s)')
+	parser.add_argument('--test',default=None,help='name of the test in the spec to work on (default: the current test)')
+	sub=parser.add_subparsers(dest='command',required=True)
+
+	p=sub.add_parser('build-keys',help='generate a new set of partOne answer keys')
+	p.add_argument('--first-map-id',type=int,default=None,help="default: the test's firstMapID")
+	p.add_argument('--number-of-maps',type=int,default=None,help="default: the rest of the test's mapID range")
+	p.add_argument('--out',default=None,help='output file (default: timestamped solutionDict_partOne file)')
+	p.add_argument('--min-distance',type=int,default=12,help='minimum number of letters that differ between any two maps')
+	p.add_argument('--balanced',action='store_true',help='spread each repeater evenly over the letters')
+	p.add_argument('--seed',type=int,default=None)
+
+	def addMemberArgs(p):
+		p.add_argument('--members',required=True,help='json response from https://api.d4h.org/v2/team/members')
+		p.add_argument('--subset',default=None,help='file listing the SAR numbers that need the test, one per line')
+		p.add_argument('--member-index',default=None,help='cached member index, refreshed with the members modified since its last refresh')
+		p.add_argument('--first-map-id',type=int,default=None,help="default: the test's firstMapID")
+
+	def addRenderArgs(p):
+		p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey)")
+		p.add_argument('--template',default=None,help="fillable map PDF (default: the test's template)")
+		p.add_argument('--out-dir',default='.')
+		p.add_argument('--workers',type=int,default=None,help='number of render processes (default: one per cpu)')
+		p.add_argument('--no-verify',action='store_true',help="don't read each PDF back to check it against the key")
+		p.add_argument('--optimize',action='store_true',help="recompress and downsample the template's map image once, before rendering (see templateOptimize.py)")
+		p.add_argument('--quality',type=int,default=templateQuality,help='JPEG quality of the optimized map image (default: %(default)s)')
+		p.add_argument('--max-dpi',type=float,default=templateMaxDPI,help='resolution of the optimized map image, at its size on the page (default: %(default)s)')
+		p.add_argument('--size-budget',type=float,default=None,help='maximum KB per map PDF; a map over budget is not built (and not sent), and render fails')
+
+	p=sub.add_parser('assign',help='build testDict from D4H members and assign a mapID to each member')
+	addMemberArgs(p)
+
+	p=sub.add_parser('render',help='build the map PDFs')
+	addRenderArgs(p)
+	p.add_argument('--map-ids',nargs='*',default=None,help='default: every map in the key file')
+
+	p=sub.add_parser('verify',help='check that the built PDFs show the letters and map IDs from the key')
+	p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey)")
+	p.add_argument('--out-dir',default='.',help='directory holding the PDFs')
+	p.add_argument('--map-ids',nargs='*',default=None,help='default: every map in the key file')
+	p.add_argument('--workers',type=int,default=None,help='number of processes (default: one per cpu)')
+	p.add_argument('--report',default=None,help='write the report to this json file')
+
+	p=sub.add_parser('previews',help='build lightweight map previews for phones (see previews.py)')
+	p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey)")
+	p.add_argument('--template',default=None,help="fillable map PDF (default: the test's template)")
+	p.add_argument('--out-dir',default='.')
+	p.add_argument('--map-ids',nargs='*',default=None,help='default: every map in the key file')
+	p.add_argument('--format',choices=['svg','webp','png'],default='svg',help='webp and png require Pillow')
+	p.add_argument('--max-width',type=int,default=None,help='downscale the map image to this many pixels wide (requires Pillow)')
+	p.add_argument('--workers',type=int,default=None,help='number of processes for webp/png (default: one per cpu)')
+
+	p=sub.add_parser('cohort',help='assign, render and send for a whole cohort in one streaming pass')
+	addMemberArgs(p)
+	addRenderArgs(p)
+	p.add_argument('--send-workers',type=int,default=4)
+	p.add_argument('--no-send',action='store_true',help='assign and render only')
+
+	p=sub.add_parser('send',help='send the assignment emails')
+	p.add_argument('--sar-ids',nargs='*',default=None,help='default: every member in testDict')
+
+	p=sub.add_parser('grade',help='grade a saved jotform response')
+	p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey); with --key, the response is graded as a map of the selected test (--test) if the key has its mapID, whatever the mapID ranges in the spec")
+	p.add_argument('--part-two',default=None,help="partTwo solutions file (default: the test's partTwoKey)")
+	p.add_argument('--response',default='response.json',help='extracted jotform data')
+	p.add_argument('--map-id',default=None,help='default: the mapID in the response')
+
+	p=sub.add_parser('collusion',help='report suspiciously similar submissions')
+	p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey)")
+	p.add_argument('--part-two',default=None,help="partTwo solutions file (default: the test's partTwoKey)")
+	p.add_argument('--submissions',nargs='+',required=True,help='.json or .jsonl files of extracted jotform data')
+	p.add_argument('--threshold',type=float,default=0.5,help='minimum similarity of the wrong/unusual answers')
+	p.add_argument('--min-shared-wrong',type=int,default=3,help='minimum number of identical wrong answers')
+	p.add_argument('--out',default='collusionReport.json')
+
+	p=sub.add_parser('stats',help='item-level results: part one miss rates and confusions, part two selection rates')
+	p.add_argument('--stats',default=None,help="stats file updated by gradeResponse (default: the test's itemStats)")
+	p.add_argument('--json',action='store_true',help='print the report as json')
+
+	p=sub.add_parser('simulate',help='Monte Carlo part two score distributions for guessing strategies')
+	p.add_argument('--part-two',default=None,help="partTwo solutions file (default: the test's partTwoKey)")
+	p.add_argument('--strategies',nargs='+',default=['random:3','bernoulli:0.25','all','informed:0.8,0.3,0.1'],help='see scoreSim.py')
+	p.add_argument('--samples',type=int,default=1000000)
+	p.add_argument('--seed',type=int,default=None)
+	p.add_argument('--weights',default=None,help='json dict overriding any of: '+', '.join(defaultWeights.keys()))
+	p.add_argument('--out',default=None,help='also write the full results to this json file')
+
+	p=sub.add_parser('test-dict',help='export testDict to a json file (e.g. to edit it by hand), or replace it with one')
+	g=p.add_mutually_exclusive_group(required=True)
+	g.add_argument('--export',default=None,metavar='FILE')
+	g.add_argument('--import',dest='import_file',default=None,metavar='FILE')
+
+	p=sub.add_parser('status',help='member counts by follow-up status, and the follow-up jobs that are pending')
+	p.add_argument('--list',choices=statuses,default=None,help='also list the SAR numbers in this status')
+	p.add_argument('--json',action='store_true',help='print the summary as json')
+
+	p=sub.add_parser('follow-up',help='send reminders and resend graded results on a schedule')
+	p.add_argument('--once',action='store_true',help='run one batch and exit (e.g. from a scheduled task)')
+	p.add_argument('--dry-run',action='store_true',help='only list the jobs that are due')
+	p.add_argument('--interval',type=float,default=3600,help='seconds between batches')
+	p.add_argument('--batch-size',type=int,default=50)
+	p.add_argument('--send-workers',type=int,default=4)
+	p.add_argument('--send-assignments',action='store_true',help='also send assignment emails that were never sent')
+	p.add_argument('--remind-after',type=float,default=3,help='days after the assignment email')
+	p.add_argument('--remind-every',type=float,default=3,help='days between reminders')
+	p.add_argument('--max-reminders',type=int,default=2)
+	p.add_argument('--resend-after',type=float,default=10,help='minutes after grading without a graded results email')
+	p.add_argument('--max-resends',type=int,default=3)
+	p.add_argument('--key',default=None,help="partOne solutions file, for resending graded results (default: the test's partOneKey)")
+	p.add_argument('--part-two',default=None,help="partTwo solutions file (default: the test's partTwoKey)")
+
+	p=sub.add_parser('pack',help='write compact binary archives of the answer keys and the graded responses (see codec.py)')
+	p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey)")
+	p.add_argument('--part-two',default=None,help="partTwo solutions file (default: the test's partTwoKey)")
+	p.add_argument('--out-keys',default='keys.bin')
+	p.add_argument('--out-responses',default='responses.bin',help='from the guesses saved in testDict')
+
+	p=sub.add_parser('grade-archive',help='grade every response in a response archive against a key archive')
+	p.add_argument('--keys',default='keys.bin')
+	p.add_argument('--responses',default='responses.bin')
+	p.add_argument('--out',default=None,help='write the grades to this json file')
+	p.add_argument('--compare',action='store_true',help='report grades that differ from the ones in testDict')
+
+	p=sub.add_parser('replay',help='list, export or regrade the webhook submissions archived by signin_api (see submissionLog.py)')
+	p.add_argument('--log',default='submissions',help='submission log directory')
+	p.add_argument('--sar-ids',nargs='*',default=None)
+	p.add_argument('--map-ids',nargs='*',default=None)
+	p.add_argument('--since',default=None,help='YYYY-MM-DD or "YYYY-MM-DD HH:MM" (local time)')
+	p.add_argument('--until',default=None,help='YYYY-MM-DD or "YYYY-MM-DD HH:MM" (local time)')
+	p.add_argument('--latest',action='store_true',help='only the latest submission from each member')
+	p.add_argument('--out',default=None,help='write the submissions to this .jsonl file (e.g. for collusion)')
+	p.add_argument('--grade',action='store_true',help='grade the submissions again into testDict (item statistics and summary.txt are not updated)')
+	p.add_argument('--email',action='store_true',help='with --grade, email members whose grade changed')
+	p.add_argument('--key',default=None,help="partOne solutions file (default: the test's partOneKey)")
+	p.add_argument('--part-two',default=None,help="partTwo solutions file (default: the test's partTwoKey)")
+
+	p=sub.add_parser('compact-log',help='recompress the finished segments of the submission log into larger blocks')
+	p.add_argument('--log',default='submissions',help='submission log directory')
+
+	p=sub.add_parser('digest',help="email the operator the digest of graded results queued by signin_api's webhook")
+	p.add_argument('--now',action='store_true',help="send whatever is queued, even if the oldest result hasn't waited --interval yet")
+	p.add_argument('--interval',type=float,default=15,help='minutes the oldest queued result waits for more to join it')
+	p.add_argument('--dry-run',action='store_true',help='only count the queued results')
+
+	p=sub.add_parser('d4h-push',help='push the qualifications of the members who passed since the last push to D4H, in batches')
+	p.add_argument('--members',default=None,help='json response from https://api.d4h.org/v2/team/members (for the D4H member ids)')
+	p.add_argument('--member-index',default=None,help='member index (for the D4H member ids), instead of --members')
+	p.add_argument('--qualification-id',default=os.getenv('D4H_QUALIFICATION_ID'),help='D4H qualification to add (default: $D4H_QUALIFICATION_ID)')
+	p.add_argument('--url',default=d4hURL,help='D4H API url (default: %(default)s); the token is $D4H_API_TOKEN')
+	p.add_argument('--batch-size',type=int,default=batchSize,help='members per request (default: %(default)s)')
+	p.add_argument('--part-one-pct',type=float,default=passPct['partOne'],help='passing part one percentage (default: %(default)s)')
+	p.add_argument('--part-two-pct',type=float,default=passPct['partTwo'],help='passing part two percentage (default: %(default)s)')
+	p.add_argument('--dry-run',action='store_true',help="log the batches, but don't send them or change testDict")
+	p.add_argument('--stand-in',action='store_true',help='push to a local D4H stand-in instead of --url, and log what it received')
+	p.add_argument('--stand-in-failures',type=int,default=0,help='requests the stand-in answers 503 before working (to exercise the retries)')
+
+	p=sub.add_parser('regrade',help='regrade only the submissions affected by a change to the answer keys')
+	p.add_argument('--old-key',required=True,help='partOne solutions file the existing grades used')
+	p.add_argument('--old-part-two',required=True,help='partTwo solutions file the existing grades used')
+	p.add_argument('--key',default=None,help="corrected partOne solutions file (default: the test's partOneKey)")
+	p.add_argument('--part-two',default=None,help="corrected partTwo solutions file (default: the test's partTwoKey)")
+	p.add_argument('--email',action='store_true',help='email members whose grade changed')
+
+	args=parser.parse_args(argv)
+	setupLogging(args.log_dir)
+	testSpecs=loadSpecs(args.spec)
+	if args.test and args.test not in testSpecs.byName:
+		parser.error('no test named '+args.test+' in '+args.spec+' (tests: '+', '.join(testSpecs.byName.keys())+')')
+	useTest(testSpecs[args.test] if args.test else testSpecs.current)
+
+	if args.command=='stats':
+		report=statsReport(loadStats(args.stats or itemStatsFile,repeaters,locations))
+		print(json.dumps(report,indent=3) if args.json else statsReportText(report))
+		return
 
-# # add to each member's testDict entry: key = 'mapID', val = integer map number
-# assignTests(firstMapID)
+	if args.command=='simulate':
+		with open(args.part_two or partTwoFile,'r') as f:
+			partTwoSolution=json.load(f)
+		weights=dict(test.weights,**json.loads(args.weights)) if args.weights else dict(test.weights)
+		results=[simulate(partTwoSolution,repeaters,locations,s,args.samples,weights,args.seed) for s in args.strategies]
+		logging.info(simulationReportText(results))
+		if args.out:
+			with open(args.out,'w') as f:
+				json.dump(results,f,indent=3)
+		return
 
-# logging.info('testDict after assignTests ('+str(len(testDict.keys()))+' entries):\n'+json.dumps(testDict,indent=3))
+	if args.command=='test-dict':
+		if args.export:
+			saveJSON(loadMembers(args.test_dict),args.export,indent=3)
+			logging.info('testDict exported to '+args.export)
+		else:
+			saveMembers(loadJSON(args.import_file,{}),args.test_dict)
+			logging.info('testDict replaced with '+args.import_file)
+		return
 
-# saveTestDict()
+	if args.command=='status':
+		index=FollowUpIndex()
+		index.refreshFromStore(args.test_dict)
+		summary=index.summary()
+		if args.list:
+			summary['list']={args.list:index.members(args.list)}
+		print(json.dumps(summary,indent=3) if args.json else '\n'.join(
+			[str(summary['members'])+' members']+['  '+s.ljust(20)+str(n) for (s,n) in summary['status'].items()]
+			+['pending follow-up jobs: '+', '.join(j+' '+str(n) for (j,n) in summary['pendingJobs'].items()),'next due: '+str(summary['nextDue'])]
+			+([args.list+': '+' '.join(summary['list'][args.list])] if args.list else [])))
+		return
 
-loadTestDict()
+	if args.command=='follow-up':
+		cadence={
+			'sendAssignments':args.send_assignments,
+			'remindAfter':args.remind_after*86400,
+			'remindEvery':args.remind_every*86400,
+			'maxReminders':args.max_reminders,
+			'resendAfter':args.resend_after*60,
+			'maxResends':args.max_resends
+		}
+		readSolutionDicts(args.key,args.part_two)
+		runFollowUps(args.test_dict,cadence,args.batch_size,args.send_workers,args.interval,args.once,args.dry_run)
+		return
 
-logging.info('testDict after load:\n'+json.dumps(testDict,indent=3))
+	if args.command=='digest':
+		# the outbox is kept next to testDict, like rtPath on the server
+		directory=os.path.dirname(os.path.abspath(args.test_dict))
+		if args.dry_run:
+			logging.info(str(len(pending(directory)))+' graded results queued for the operator digest')
+			return
+		n=sendDigest(directory,sendEmail,args.interval*60,args.now)
+		logging.info('operator digest: '+str(n)+' graded results sent')
+		return
 
-# send email to members
-# sendTests([50,138,116,139,46,74,25]) # round 1 - early adopters - sent ~1-25-24
-# sendTests([35])
-sendTests([15,144,54,73,20,51,124,59,27,62,65,93,115,29,60]) # round 2 - sent 1-29-24
+	if args.command=='d4h-push':
+		if not (args.members or args.member_index):
+			parser.error('d4h-push needs --members or --member-index for the D4H member ids')
+		if not args.qualification_id:
+			parser.error('d4h-push needs --qualification-id (or $D4H_QUALIFICATION_ID)')
+		memberIDs=MemberIndex(args.member_index).memberIDs() if args.member_index else readMemberIDs(args.members)
+		pct={'partOne':args.part_one_pct,'partTwo':args.part_two_pct}
+		standIn=D4HStandIn(failures=args.stand_in_failures) if args.stand_in else None
+		session=D4HSession(standIn.url if standIn else args.url,os.getenv('D4H_API_TOKEN'),backoff=0.1 if standIn else 1.0)
+		try:
+			report=pushQualifications(args.test_dict,memberIDs,args.qualification_id,session,pct,args.batch_size,args.dry_run)
+		finally:
+			session.close()
+			if standIn:
+				standIn.stop()
+		logging.info('D4H qualifications: '+str(report['passed'])+' newly passed, '+str(report['pushed'])+' pushed in '+str(report['batches'])+' batches, '
+			+str(len(report['skipped']))+' skipped, '+str(len(report['failed']))+' failed; '+json.dumps(session.stats))
+		for (sarID,reason) in list(report['skipped'].items())+list(report['failed'].items()):
+			logging.info('  SAR '+str(sarID)+': '+reason)
+		if standIn:
+			logging.info('stand-in received '+str(sum(len(q) for q in standIn.qualifications.values()))+' qualifications: '+json.dumps(standIn.stats))
+		return
 
-# solutionDicts={}
-# buildSolutionDict()
-# readSolutionDicts()
-# makePDFs()
-# logging.info('guessDict 2021:')
-# logging.info(json.dumps(guessDict['2021'],indent=3))
-# gradeResponse('2242')
+	if args.command=='build-keys':
+		first=firstMapID if args.first_map_id is None else args.first_map_id
+		number=test.lastMapID-first if args.number_of_maps is None else args.number_of_maps
+		if first<test.firstMapID or first+number>test.lastMapID:
+			parser.error('mapIDs '+str(first)+' to '+str(first+number)+' are outside the mapID range of test '+test.name+' ('+str(test.firstMapID)+' to '+str(test.lastMapID)+')')
+		buildSolutionDict(list(range(first,first+number+1)),args.out,args.min_distance,args.balanced,args.seed)
+		return
 
-# saveTestDict()
+	if args.command in ['assign','cohort']:
+		subset=readSARIDList(args.subset) if args.subset else None
+		testDict=getEmailsFromMembersJson(args.members,subset=subset,memberIndex=MemberIndex(args.member_index) if args.member_index else None)
+		try:
+			assignTests(firstMapID if args.first_map_id is None else args.first_map_id)
+		except ValueError as e:
+			parser.error(str(e))
+		logging.info('testDict after assignTests ('+str(len(testDict.keys()))+' entries)')
+		saveTestDict(args.test_dict)
+		if args.command=='assign':
+			return
+	elif args.command in ['send','grade','regrade','pack'] or (args.command=='grade-archive' and args.compare) or (args.command=='replay' and args.grade):
+		loadTestDict(args.test_dict)
+
+	if args.command=='render':
+		readSolutionDicts(args.key)
+		mapIDs=args.map_ids if args.map_ids is not None else list(solutionDicts['partOne'].keys())
+		with buildTemplate(args) as templateFile:
+			built=makePDFs(mapIDs,args.out_dir,templateFile,args.workers,verify=not args.no_verify,sizeBudget=sizeBudgetBytes(args))
+		if len(built)<len(mapIDs):
+			logging.info('ERROR: '+str(len(mapIDs)-len(built))+' of '+str(len(mapIDs))+' PDFs were not built')
+			return 1
+	elif args.command=='verify':
+		readSolutionDicts(args.key)
+		report=verifyPDFs(args.map_ids,args.out_dir,args.workers)
+		if args.report:
+			with open(args.report,'w') as f:
+				json.dump(report,f,indent=3)
+		if report['failed']:
+			return 1
+	elif args.command=='previews':
+		readSolutionDicts(args.key)
+		makePreviews(args.map_ids,args.out_dir,args.template,args.workers,args.format,args.max_width)
+	elif args.command=='cohort':
+		readSolutionDicts(args.key)
+		with buildTemplate(args) as templateFile:
+			runCohort(None,args.out_dir,templateFile,args.workers,args.send_workers,send=not args.no_send,verify=not args.no_verify,sizeBudget=sizeBudgetBytes(args))
+		saveTestDict(args.test_dict)
+	elif args.command=='send':
+		sendTests(args.sar_ids)
+		saveTestDict(args.test_dict)
+	elif args.command=='collusion':
+		readSolutionDicts(args.key,args.part_two)
+		suspicious=findSuspiciousPairs(loadSubmissions(args.submissions),solutionDicts,repeaters,locations,args.threshold,args.min_shared_wrong)
+		for s in suspicious:
+			logging.info('SAR '+s['sarIDs'][0]+' and SAR '+s['sarIDs'][1]+': similarity '+str(s['jaccard'])+', identical wrong answers: '+str(s['partOneSharedWrong'])+' in part one, '+str(s['partTwoSharedWrong'])+' in part two')
+		with open(args.out,'w') as f:
+			json.dump(suspicious,f,indent=3)
+		logging.info(str(len(suspicious))+' suspicious pairs written to '+args.out)
+	elif args.command=='pack':
+		readSolutionDicts(args.key,args.part_two)
+		n=writeKeyArchive(args.out_keys,solutionDicts['partOne'],solutionDicts['partTwo'],repeaters,locations,letters)
+		logging.info(str(n)+' answer keys written to '+args.out_keys)
+		n=writeResponseArchive(args.out_responses,testDict,repeaters,locations,letters)
+		logging.info(str(n)+' graded responses written to '+args.out_responses)
+	elif args.command=='grade-archive':
+		grades=gradeArchive(KeyArchive(args.keys),ResponseArchive(args.responses),test.weights)
+		logging.info(str(len(grades))+' responses graded from '+args.responses)
+		if args.compare:
+			differ=[sarID for (sarID,grade) in grades.items() if testDict.get(sarID,{}).get('grade',None)!=grade]
+			for sarID in differ:
+				logging.info('  SAR '+sarID+': archive grade '+str(grades[sarID])+', testDict grade '+str(testDict.get(sarID,{}).get('grade',None)))
+			logging.info(str(len(differ))+' grades differ from testDict')
+		if args.out:
+			with open(args.out,'w') as f:
+				json.dump(grades,f,indent=3)
+	elif args.command=='replay':
+		log=SubmissionLog(args.log)
+		entries=log.entries(args.sar_ids,args.map_ids,parseLocalTime(args.since),parseLocalTime(args.until),args.latest)
+		logging.info(str(len(entries))+' submissions selected from '+args.log)
+		if args.out:
+			n=0
+			with open(args.out,'w') as f:
+				for (e,payload) in log.payloads(entries):
+					f.write(json.dumps(payload)+'\n')
+					n+=1
+			logging.info(str(n)+' submissions written to '+args.out)
+		if args.grade:
+			readSolutionDicts(args.key,args.part_two)
+			n=log.replay(lambda mapID,payload:gradeResponse(mapID,payload,notify='ifChanged' if args.email else False,record=False),entries)
+			logging.info(str(n)+' submissions graded')
+			saveTestDict(args.test_dict)
+		if not args.out and not args.grade:
+			for e in entries:
+				logging.info(time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(e['received']))+'  SAR '+e['sarID'].ljust(6)+'  map '+e['mapID'])
+	elif args.command=='compact-log':
+		log=SubmissionLog(args.log)
+		for segment in log.segments()[:-1]:
+			(before,after)=log.compact(segment)
+			logging.info('segment '+str(segment)+': '+str(before)+' -> '+str(after)+' bytes')
+	elif args.command=='regrade':
+		readSolutionDicts(args.old_key,args.old_part_two)
+		oldSolutionDicts=dict(solutionDicts)
+		readSolutionDicts(args.key,args.part_two)
+		regrade(oldSolutionDicts,args.email)
+		saveTestDict(args.test_dict)
+	elif args.command=='grade':
+		readSolutionDicts(args.key,args.part_two)
+		with open(args.response,'r') as f:
+			responseDict=json.load(f)
+		grade=gradeResponse(str(args.map_id or responseDict.get('mapID')),responseDict,spec=test if args.key else None)
+		saveTestDict(args.test_dict)
+		if grade is None:
+			return 1
 
+if __name__=='__main__':
+	sys.exit(main())
 
 # class repeaterTest():
 # 	def __init__(self):
@@ -0,0 +1,53 @@
+# responses.py - parse the partOne and partTwo InputTable answers from a jotform submission
+
+# it looks like JotForm may have significantly changed the structure of their InputTable responses
+#  sometime in January 2024 (or, it could be operator confusion...) - both formats are handled here
+
+# old:
+# response={...,"partOne": "{\"0\":{\"0\":\"A\",\"1\":false,\"2\":false,...
+#  a (json-encoded) dict of dicts, one per row, each one having an entry for each column,
+#  where the selected column has the column name and all others are False
+
+# new:
+# resonse={...,"partOne": [{"4": "E"}, {"13": "N"}, {"1": "B"}, {"16": "Q"}, ["A"], {"21": "V"}, ...
+#  an ordered list of dicts, with index corresonding to row number (zero-based); each dict
+#   has just one key:val pair, col# (string) : colName;
+#  except, there appears to be a bug: column zero comes out as a list containing only the col name, not a dict.
+#  partTwo is a list of lists: the selected column names for each row
+
+import json
+
+# turn the old string format into a list of rows (each row is a dict of col#:value)
+def decodeInputTable(value):
+	if isinstance(value,str):
+		try:
+			value=json.loads(value)
+		except ValueError:
+			# decode then deserialize, to turn this into valid json:
+			# https://stackoverflow.com/a/42452833/3577105
+			value=json.loads(value.encode().decode('unicode-escape'))
+	if isinstance(value,dict):
+		value=[value[k] for k in sorted(value.keys(),key=int)]
+	return value
+
+# the selected column name(s) in one row, in either format
+def rowSelections(row):
+	if isinstance(row,dict):
+		return [v for v in row.values() if v]
+	if isinstance(row,list):
+		return [v for v in row if v]
+	return [row] if row else []
+
+# partOne: returns a list with one entry per row (repeater), which is the letter
+#  selected for that row, or None if nothing was selected
+def parsePartOne(partOne):
+	out=[]
+	for row in decodeInputTable(partOne):
+		selected=rowSelections(row)
+		out.append(selected[0] if selected else None)
+	return out
+
+# partTwo: returns a list with one entry per row (location), which is the list of
+#  repeater names selected for that location
+def parsePartTwo(partTwo):
+	return [rowSelections(row) for row in decodeInputTable(partTwo)]
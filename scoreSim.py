@@ -0,0 +1,118 @@
+# scoreSim.py - Monte Carlo score distributions for the part two scoring rules
+
+# gradeResponse scores each part two location as:
+#   +10 if all of the required repeaters were selected,
+#   +6 if all but one of the required repeaters were selected,
+#   +2 for each optional repeater selected,
+#   -1 for each unlikely repeater selected,
+#  and the percentage is taken against a target score of 10 per location
+#  (the weights are in scoring.py, and can be overridden here to calibrate them)
+#
+# this simulates millions of synthetic responses against solutionDict_partTwo.json under
+#  different guessing strategies, to see how guessing scores under those rules before
+#  a cohort starts; responses are generated and scored as numpy arrays, in chunks
+#
+# strategies (name:parameters):
+#   random:k - select k repeaters at random at each location
+#   bernoulli:p - select each repeater with probability p
+#   all - select every repeater at every location
+#   none - select nothing
+#   informed:q,o,u - select each required repeater with probability q, each optional
+#     one with probability o and each unlikely one with probability u (partial knowledge)
+#
+# requires numpy
+
+import numpy as np
+from scoring import partTwoWeights
+
+defaultWeights=partTwoWeights
+
+categories=['required','optional','unlikely']
+
+# boolean masks, one row per location: masks[category][location][repeater]
+def categoryMasks(partTwoSolution,repeaters,locations):
+	repeaterIndex={r:n for (n,r) in enumerate(repeaters)}
+	masks={c:np.zeros((len(locations),len(repeaters)),dtype=bool) for c in categories}
+	for (l,location) in enumerate(locations):
+		for c in categories:
+			for r in partTwoSolution[location][c]:
+				masks[c][l,repeaterIndex[r]]=True
+	return masks
+
+def parseStrategy(strategy):
+	(name,sep,params)=strategy.partition(':')
+	params=[float(x) for x in params.split(',')] if params else []
+	return (name,params)
+
+# sample n responses: returns an (n,locations,repeaters) boolean array of selections
+def sampleResponses(rng,n,strategy,masks):
+	(name,params)=parseStrategy(strategy)
+	shape=(n,)+masks['required'].shape
+	if name=='random':
+		k=int(params[0]) if params else 3
+		# the k smallest of a row of random numbers are a uniformly random k-subset
+		ranks=rng.random(shape).argsort(axis=2).argsort(axis=2)
+		return ranks<k
+	if name=='bernoulli':
+		return rng.random(shape)<(params[0] if params else 0.25)
+	if name=='all':
+		return np.ones(shape,dtype=bool)
+	if name=='none':
+		return np.zeros(shape,dtype=bool)
+	if name=='informed':
+		(q,o,u)=(params+[0.8,0.3,0.1][len(params):])[:3]
+		p=masks['required']*q+masks['optional']*o+masks['unlikely']*u
+		return rng.random(shape)<p
+	raise ValueError('unknown strategy: '+strategy)
+
+# score an (n,locations,repeaters) array of selections; returns the part two percentage
+#  for each response, rounded the same way as gradeResponse
+def scoreResponses(selections,masks,weights=defaultWeights):
+	nRequired=masks['required'].sum(axis=1)
+	requiredHits=(selections&masks['required']).sum(axis=2)
+	score=np.where(requiredHits==nRequired,weights['allRequired'],np.where(requiredHits==nRequired-1,weights['allButOneRequired'],0))
+	score=score+weights['optional']*(selections&masks['optional']).sum(axis=2)
+	score=score+weights['unlikely']*(selections&masks['unlikely']).sum(axis=2)
+	targetScore=weights['target']*selections.shape[1]
+	return np.round(score.sum(axis=1)/targetScore*100).astype(np.int64)
+
+# returns a dict summarizing the percentage distribution for one strategy
+#  passThresholds: percentages at which to report the pass rate (fraction scoring >= threshold)
+def simulate(partTwoSolution,repeaters,locations,strategy,samples=1000000,weights=defaultWeights,seed=None,chunkSize=200000,passThresholds=range(0,101,5)):
+	rng=np.random.default_rng(seed)
+	masks=categoryMasks(partTwoSolution,repeaters,locations)
+	counts={}
+	total=0
+	while total<samples:
+		n=min(chunkSize,samples-total)
+		pct=scoreResponses(sampleResponses(rng,n,strategy,masks),masks,weights)
+		(values,valueCounts)=np.unique(pct,return_counts=True)
+		for (v,c) in zip(values.tolist(),valueCounts.tolist()):
+			counts[v]=counts.get(v,0)+c
+		total+=n
+	values=np.array(sorted(counts.keys()))
+	valueCounts=np.array([counts[v] for v in values])
+	cumulative=np.cumsum(valueCounts)
+	def percentile(q):
+		return int(values[np.searchsorted(cumulative,q*total)])
+	return {
+		'strategy':strategy,
+		'samples':total,
+		'mean':round(float((values*valueCounts).sum()/total),2),
+		'std':round(float(np.sqrt((valueCounts*(values-(values*valueCounts).sum()/total)**2).sum()/total)),2),
+		'min':int(values[0]),
+		'p50':percentile(0.5),
+		'p90':percentile(0.9),
+		'p99':percentile(0.99),
+		'max':int(values[-1]),
+		'distribution':{int(v):int(c) for (v,c) in zip(values,valueCounts)},
+		'passRate':{int(t):round(float(valueCounts[values>=t].sum()/total),5) for t in passThresholds}
+	}
+
+def simulationReportText(results):
+	lines=[]
+	for r in results:
+		lines.append(r['strategy']+': '+str(r['samples'])+' samples  mean '+str(r['mean'])+'%  std '+str(r['std'])
+			+'  min/p50/p90/p99/max '+'/'.join(str(r[k]) for k in ['min','p50','p90','p99','max']))
+		lines.append('  pass rate: '+'  '.join(str(t)+'%:'+str(round(p*100,1)) for (t,p) in r['passRate'].items() if t%10==0))
+	return '\n'.join(lines)
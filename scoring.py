@@ -0,0 +1,40 @@
+# scoring.py - part two scoring rules, shared by gradeResponse, regrade and scoreSim
+
+# this module only uses the standard library, so that it can be imported from signin_api
+
+partTwoWeights={
+	'allRequired':10, # all of the required repeaters were selected
+	'allButOneRequired':6, # all but one of the required repeaters were selected
+	'optional':2, # each optional repeater selected
+	'unlikely':-1, # each unlikely repeater selected
+	'target':10 # per location; the percentage is taken against the sum of these
+}
+
+# score one location: solution is solutionDicts['partTwo'][location], guessedRepeaters is
+#  the list of repeaters the member selected there
+# returns a dict:
+#   points - score for this location
+#   outcome - CORRECT, PARTIAL or INCORRECT (for the required repeaters)
+#   required/optional/unlikely - the selected repeaters in each category
+def scorePartTwoLocation(solution,guessedRepeaters,weights=partTwoWeights):
+	result={'required':[],'optional':[],'unlikely':[]}
+	for repeater in guessedRepeaters:
+		if repeater in solution['required']:
+			result['required'].append(repeater)
+		elif repeater in solution['optional']:
+			result['optional'].append(repeater)
+		elif repeater in solution['unlikely']:
+			result['unlikely'].append(repeater)
+	if len(result['required'])==len(solution['required']):
+		result['outcome']='CORRECT'
+		points=weights['allRequired']
+	elif len(result['required'])==len(solution['required'])-1:
+		result['outcome']='PARTIAL'
+		points=weights['allButOneRequired']
+	else:
+		result['outcome']='INCORRECT'
+		points=0
+	points+=len(result['optional'])*weights['optional']
+	points+=len(result['unlikely'])*weights['unlikely']
+	result['points']=points
+	return result
@@ -53,6 +53,15 @@ app.config["DEBUG"] = True
 SIGNIN_API_KEY=os.getenv("SIGNIN_API_KEY")
 SENDGRID_API_KEY=os.getenv("SENDGRID_API_KEY")
 
+# per-client keys, so that each client (e.g. each sign-in kiosk) gets its own rate limits:
+#  SIGNIN_API_CLIENTS="kiosk1:<key>,kiosk2:<key>,..."
+# SIGNIN_API_KEY still works too, as client 'shared'
+apiClients={} # key = api key, val = client name
+for item in os.getenv("SIGNIN_API_CLIENTS","").split(","):
+    (name,sep,key)=item.strip().partition(":")
+    if name and key:
+        apiClients[key]=name
+
 
 # on pythonanywhere, the relative path ./sign-in should be added instead of ../sign-in
 #  since the current working dir while this script is running is /home/caver456
@@ -76,24 +85,45 @@ from signin_push import sdbPush
 from functools import wraps
 from flask import request, abort
 
+# the client name for an Authorization header ('Bearer <auth_token>'), or None
+def clientFor(auth_header):
+    if auth_header:
+        auth_token=auth_header.split(" ")[1]
+    else:
+        auth_token=''
+    client=apiClients.get(auth_token,None)
+    if not client and auth_token and auth_token == SIGNIN_API_KEY:
+        client='shared'
+    return client
+
 # The actual decorator function
+# also applies the client's rate limit for this route (see shed, below)
 def require_appkey(view_function):
     @wraps(view_function)
     # the new, post-decoration function. Note *args and **kwargs here.
     def decorated_function(*args, **kwargs):
-        auth_header=flask.request.headers.get('Authorization')
-        if auth_header: # should be 'Bearer <auth_token>'
-            auth_token=auth_header.split(" ")[1]
-        else:
-            auth_token=''
-        if auth_token and auth_token == SIGNIN_API_KEY:
+        client=clientFor(flask.request.headers.get('Authorization'))
+        if client:
         # if flask.request.args.get('key') and flask.request.args.get('key') == SIGNIN_API_KEY:
-            return view_function(*args, **kwargs)
+            return shed(client) or view_function(*args, **kwargs)
         else:
             flask.abort(401)
     return decorated_function
 ###############################
 
+# rate limits: returns None if this client may go ahead with the current request, or a
+#  429 response with Retry-After if its token bucket for the route is empty; this is
+#  checked before any database or grading work (see rateLimit.py; rateLimiter is set up
+#  below, once rtPath is on the search path)
+def shed(client):
+    (allowed,retryAfter)=rateLimiter.take(client,request.endpoint)
+    if allowed:
+        return None
+    app.logger.info('rate limit: '+client+' '+str(request.endpoint)+' rejected')
+    response=flask.make_response('<h1>429</h1><p>Too many requests; try again in '+str(retryAfter)+' seconds.</p>',429)
+    response.headers['Retry-After']=str(retryAfter)
+    return response
+
 
 #########################################################
 ############## start of repeaterTest code ###############
@@ -104,56 +134,35 @@ rtPath='repeaterTest'
 if not os.path.isdir(rtPath):
     rtPath='.'
 
-repeaters=[
-	'ALDER HILL',
-	'ALTA SIERRA',
-	'BABBITT',
-	'BANNER',
-	'BOREAL',
-	'BOWMAN',
-	'CASCADE SHRS',
-	'CHERRY HILL',
-	'DEADMAN FLAT',
-	'DONNER',
-	'EDWARDS XING',
-	'GROUSE RIDGE',
-	'KENTKY RIDGE',
-	'LOP',
-	'LWW',
-	'MT ROSE',
-	'OREGON',
-	'OWL CREEK',
-	'PILOT PEAK',
-	'PURDON',
-	'ROLLINS LK',
-	'SIERRABUTTES',
-	'SIGNAL',
-	'WOLF MTN'
-]
-locations=[
-	# 'Milton Reservoir',
-	# 'Shingle Falls',
-	'Bridgeport covered bridge',
-	# 'Emerald Pools',
-	'Penner Lake',
-	# 'South Yuba Primitive Camp',
-	'Buckeye Rd at Chalk Bluff Rd',
-	# 'Lake Sterling',
-	# 'Dog Bar Rd at South Fork Wolf Creek',
-	'Peter Grubb Hut',
-	'Prosser Boat Ramp',
-	# 'Sagehen CG',
-	# 'Boyington Mill CG',
-	'Pacific Crest Trail at Meadow Lake Road'
-]
-letters=list(string.ascii_uppercase)[0:len(repeaters)]
-
-def readSolutionDicts():
-	global solutionDicts
-	with open(os.path.join(rtPath,'solutionDict_partOne20240124085012.json'),'r') as f:
+# shared repeater test modules live in the repeaterTest directory
+sys.path.append(os.path.abspath(rtPath))
+from itemStats import replaceResult,guessesResult,loadStats,statsReport
+from scoring import scorePartTwoLocation
+from stateStore import loadMembers,saveMembers,getMember,updateMember,appendText
+from followUp import FollowUpIndex
+from gradedReport import renderReport,renderText
+from testSpec import loadSpecs
+from submissionLog import SubmissionLog
+from operatorDigest import queueResult,digestDue,sendDigest
+from responses import parsePartOne,parsePartTwo
+from keyIndex import loadKeyIndex,checkMapID
+
+# the test definitions (repeaters, locations, scoring weights, mapID ranges and solution
+#  files) are in rtPath/testSpec.json, shared with repeaterTest.py (see testSpec.py); the
+#  compiled spec is cached, and only recompiled when the file changes
+def readTestSpecs():
+	return loadSpecs(os.path.join(rtPath,'testSpec.json'))
+
+# returns a new dict, so that each webhook request works with its own copy
+#  spec: the test whose solution files to read (default: the current test)
+def readSolutionDicts(spec=None):
+	spec=spec or readTestSpecs().current
+	repeaters=spec.repeaters
+	solutionDicts={}
+	with open(os.path.join(rtPath,spec.partOneKey),'r') as f:
 		# logging.info(' reading partOne soltions...')
 		solutionDicts['partOne']=json.load(f)
-	with open(os.path.join(rtPath,'solutionDict_partTwo.json'),'r') as f:
+	with open(os.path.join(rtPath,spec.partTwoKey),'r') as f:
 		# logging.info(' reading partTwo soltions...')
 		solutionDicts['partTwo']=json.load(f)
 		# validate the file, to check for typos or repeated entries
@@ -169,6 +178,21 @@ def readSolutionDicts():
 					for otherCategory in [c for c in categories if c!=category]:
 						if r in solutionDicts['partTwo'][loc][otherCategory]:
 							logging.info('ERROR during read of partTwo solutions: '+str(loc)+': '+str(category)+': '+str(r)+' is also listed in '+str(otherCategory)+'!')
+	return solutionDicts
+
+# compare the part one answers with every test's part one keys, to catch a mistyped
+#  mapID (see keyIndex.py); the indexes are cached, and only rebuilt when a key file changes
+#  letterList: the response's parsePartOne output, which is also what part one is graded from
+#  assigned: the member's mapID in testDict, or None
+#  returns checkMapID's result, or None if the answers can't be checked
+def checkSubmissionMapID(mapID,letterList,assigned):
+	indexes=[]
+	for spec in readTestSpecs().specs:
+		if spec.partOneKey and os.path.isfile(os.path.join(rtPath,spec.partOneKey)):
+			indexes.append(loadKeyIndex(os.path.join(rtPath,spec.partOneKey),spec.repeaters,spec.letters))
+	if not indexes or not any(letterList):
+		return None
+	return checkMapID(mapID,letterList,indexes,assigned)
 
 # print a list of strings as a simple human-readable list:
 # ['A','B','C'] --> A,B,C
@@ -181,12 +205,14 @@ def strp(theList,spaces=True):
 		s=s.replace(', ',',')
 	return s
 
-def sendEmail(from_email,to_emails,subject,html_content):
+# plain_text_content: optional text/plain alternative to html_content
+def sendEmail(from_email,to_emails,subject,html_content,plain_text_content=None):
 	msg=Mail(
 		from_email=from_email,
 		to_emails=to_emails,
 		subject=subject,
-		html_content=html_content
+		html_content=html_content,
+		plain_text_content=plain_text_content
 	)
 	try:
 		sendgrid_client = SendGridAPIClient(SENDGRID_API_KEY)
@@ -200,17 +226,48 @@ def sendEmail(from_email,to_emails,subject,html_content):
 	logging.info('  email sent')
 	return True
 
-def gradeResponse(mapID='2000',responseDict={}):
-	global solutionDicts
+# notify: True = email the graded results; False = don't; 'ifChanged' = only if the grade changed
+# solutionDicts: the keys to grade against (default: read from the files of the test that
+#  the mapID belongs to, after checking the mapID against the answers: a mistyped mapID
+#  is graded against the member's assigned mapID if that one matches, or flagged in
+#  testDict as 'mapIDCheck' for the operator; see keyIndex.py)
+# the member's entry is read once at the start, and the new fields (with gradedEmailSent,
+#  if the graded results email was sent) are saved in one update of that member's entry
+#  (see stateStore.py), so concurrent requests for other members are never overwritten
+def gradeResponse(mapID='2000',responseDict={},notify=True,solutionDicts=None):
 	logging.info('gradeResponse called for mapID='+str(mapID))
 	if not responseDict:
 		with open(os.path.join(rtPath,'response.json'),'r') as f:
 			responseDict=json.load(f)
 		logging.info('responseDict read from file:')
 	logging.info(json.dumps(responseDict,indent=3))
+	# the letter chosen on each part one row (or None); the mapID check and the part one
+	#  grading both use this list (parsePartOne also handles the older dict-of-dicts format;
+	#  see responses.py)
+	try:
+		letterList=parsePartOne(responseDict.get('partOne',None) or [])
+	except (ValueError,TypeError,AttributeError):
+		letterList=[]
+	member=getMember(os.path.join(rtPath,'testDict.json'),responseDict.get('SARNumber',None))
+	check=None
+	if not solutionDicts:
+		check=checkSubmissionMapID(mapID,letterList,member.get('mapID',None) if member else None)
+		if check and check['action']!='grade':
+			logging.info('mapID check: '+check['action']+': '+check['reason']+'; best matches: '+str(check['best']))
+			mapID=check['mapID']
+	spec=readTestSpecs().forMapID(mapID)
+	if not spec:
+		# nothing to grade against; the operator hears about it in the next digest
+		problem='mapID '+str(mapID)+' is not in the mapID range of any test in testSpec.json; not graded'
+		logging.info('ERROR: SAR '+str(responseDict.get('SARNumber',None))+': '+problem)
+		queueResult(rtPath,responseDict.get('SARNumber',None),problem=problem)
+		return
+	(repeaters,locations,letters,weights)=(spec.repeaters,spec.locations,spec.letters,spec.weights)
+	solutionDicts=solutionDicts or readSolutionDicts(spec)
+	letterList=letterList[:len(repeaters)]
 	scoreDict={}
 	scorePct={}
-	gradedText=''
+	report=[] # graded report lines, rendered by renderReport (see gradedReport.py)
 
 	sarID=responseDict['SARNumber']
 
@@ -222,12 +279,14 @@ def gradeResponse(mapID='2000',responseDict={}):
 	scoreDict['partOne']=0
 	solutionDict=solutionDicts['partOne'].get(mapID,None)
 	if not solutionDict:
-		logging.info('ERROR: specified mapID '+str(mapID)+' has no corresponding entry in solutionDicts')
+		problem='mapID '+str(mapID)+' has no answer key in '+spec.partOneKey+'; not graded'
+		logging.info('ERROR: SAR '+str(sarID)+': '+problem)
+		queueResult(rtPath,sarID,problem=problem)
 		return
 	partOne=responseDict.get('partOne',None)
-	if not partOne:
-		gradedText+='\nERROR: partOne not found in response data'
-		logging.info('ERROR: partOne not found in response data')
+	if not partOne or not any(letterList):
+		report.append(('error',{'message':'partOne not found in response data, or not readable'}))
+		logging.info('ERROR: partOne not found in response data, or not readable')
 		return
 
 	# it looks like JotForm may have significantly changed the structure of their InputTable responses
@@ -253,17 +312,11 @@ def gradeResponse(mapID='2000',responseDict={}):
 
 	partOneResponseDict={}
 	# 1-24-24: at this point, partOne should be a list of dicts, each with a single key (the column number);
-	#  if so, replace keys (column numbers) with repeater names based on list index
-	if partOne.__class__.__name__=='list':
-		out={}
-		for n in range(len(partOne)):
-			e=partOne[n]
-			if e.__class__.__name__=='list' and len(e)==1:
-				letter=e[0]
-			else:
-				letter=list(partOne[n].values())[0]
-			out[letter]=repeaters[n]
-		partOneResponseDict=out
+	#  replace keys (column numbers) with repeater names based on list index
+	#  (the item statistics are kept by letter; the grading below goes by row, from letterList)
+	for (n,letter) in enumerate(letterList):
+		if letter:
+			partOneResponseDict[letter]=repeaters[n]
 		
 	# logging.info('partOne after processing:')
 	# logging.info(json.dumps(partOne,indent=3))
@@ -280,23 +333,31 @@ def gradeResponse(mapID='2000',responseDict={}):
 	# responseDict2={v:k for k,v in responseDict.items()}
 	solutionDict2={v:k for k,v in solutionDict.items()}
 
-	gradedText+='\nNCSSAR Repeater Test - Results for SAR'+str(sarID)+'  Map ID '+str(mapID)
-	gradedText+='\n==================================='
-	gradedText+='\nPart One - match map letters to repeater names'
-	gradedText+='\n-----------------------------------'
+	report+=[
+		('title',{'sarID':sarID,'mapID':mapID}),
+		('doubleRule',{}),
+	]
+	if check and check['action']=='reroute':
+		report+=[('mapIDRerouted',{'claimed':check['claimed'],'mapID':mapID}),('blank',{})]
+	report+=[
+		('partOneHeading',{}),
+		('rule',{})
+	]
+	# grade by row: a letter is correct if it was chosen on the correct repeater's row, even
+	#  if it was also chosen on another row (partOneResponseDict only keeps one row per letter)
 	for letter in letters:
 		correctRepeater=solutionDict2[letter]
-		guessedRepeater=partOneResponseDict[letter]
-		if guessedRepeater==correctRepeater:
-			gradedText+='\n  CORRECT: '+letter+' = '+correctRepeater
+		guessedRepeaters=[repeaters[n] for (n,l) in enumerate(letterList) if l==letter]
+		if correctRepeater in guessedRepeaters:
+			report.append(('partOneCorrect',{'letter':letter,'repeater':correctRepeater}))
 			scoreDict['partOne']+=1
 		else:
-			gradedText+='\nINCORRECT: '+letter+' = '+correctRepeater+'  (you guessed '+guessedRepeater+')'
-	gradedText+='\n-----------------------------------'
+			report.append(('partOneIncorrect',{'letter':letter,'repeater':correctRepeater,'guessed':strp(guessedRepeaters) or 'nothing'}))
+	report.append(('rule',{}))
 	score=scoreDict['partOne']
 	pct=round(float(score/len(repeaters)*100))
 	scorePct['partOne']=pct
-	gradedText+='\nPart One Score: '+str(pct)+'%  ('+str(score)+' of '+str(len(repeaters))+')'
+	report.append(('partOneScore',{'pct':pct,'score':score,'count':len(repeaters)}))
 
 	###########
 	# PART TWO
@@ -305,7 +366,7 @@ def gradeResponse(mapID='2000',responseDict={}):
 	solutionDict=solutionDicts['partTwo']
 	partTwo=responseDict.get('partTwo',None)
 	if not partTwo:
-		gradedText+='\nERROR: partTwo not found in response data'
+		report.append(('error',{'message':'partTwo not found in response data'}))
 		logging.info('ERROR: partTwo not found in response data')
 		return
 	# # decode then deserialize, to turn this into valid json:
@@ -319,8 +380,8 @@ def gradeResponse(mapID='2000',responseDict={}):
 
 	# 1-24-24: partTwo val is a list of lists
 
-	for n in range(len(partTwo)):
-		partTwoResponseDict[locations[n]]=partTwo[n]
+	for (n,selected) in enumerate(parsePartTwo(partTwo)[:len(locations)]):
+		partTwoResponseDict[locations[n]]=selected
 
 	# for rowNum in partTwo.keys():
 	# 	repeaterResponses=[v for v in partTwo[rowNum].values() if v]
@@ -334,84 +395,117 @@ def gradeResponse(mapID='2000',responseDict={}):
 	# responseDict2={v:k for k,v in responseDict.items()}
 	# solutionDict2={v:k for k,v in solutionDict.items()}
 
-	gradedText+='\n\n==================================='
-	gradedText+='\nPart Two - repeaters likely to work at listed locations'
-	gradedText+='\n-----------------------------------'
+	report+=[
+		('blank',{}),
+		('doubleRule',{}),
+		('partTwoHeading',{}),
+		('rule',{})
+	]
 	# maxPossibleScore=0
 	targetScore=0
+	locationScores={}
 	for location in locations:
 		requiredRepeaters=solutionDict[location]['required']
 		optionalRepeaters=solutionDict[location]['optional']
 		unlikelyRepeaters=solutionDict[location]['unlikely']
 		guessedRepeaters=partTwoResponseDict[location]
-		requiredRepeatersGuessed=[]
-		optionalRepeatersGuessed=[]
-		unlikelyRepeatersGuessed=[]
-		for repeater in guessedRepeaters:
-			if repeater in requiredRepeaters:
-				requiredRepeatersGuessed.append(repeater)
-			elif repeater in optionalRepeaters:
-				optionalRepeatersGuessed.append(repeater)
-			elif repeater in unlikelyRepeaters:
-				unlikelyRepeatersGuessed.append(repeater)
-		gradedText+='\n\n'+location+':  you selected '+strp(guessedRepeaters)
-		# print('\n'+location+':     requiredRepeatersGuessed: '+strp(requiredRepeatersGuessed),file=outfile)
-		# print('\n'+location+':     optionalRepeatersGuessed: '+strp(optionalRepeatersGuessed),file=outfile)
-		# print('\n'+location+':     unlikelyRepeatersGuessed: '+strp(unlikelyRepeatersGuessed),file=outfile)
-		if len(requiredRepeatersGuessed)==len(requiredRepeaters):
-			gradedText+='\n    CORRECT: Your selections included all of the most likely repeaters ('+strp(requiredRepeaters)+')'
-			scoreDict['partTwo']+=10
-		elif len(requiredRepeatersGuessed)==len(requiredRepeaters)-1:
-			gradedText+='\n    PARTIAL: Your selections included all but one of the most likely repeaters ('+strp(requiredRepeaters)+')'
-			scoreDict['partTwo']+=6
+		result=scorePartTwoLocation(solutionDict[location],guessedRepeaters,weights)
+		report+=[('blank',{}),('location',{'location':location,'selected':strp(guessedRepeaters)})]
+		if result['outcome']=='CORRECT':
+			report.append(('partTwoCorrect',{'required':strp(requiredRepeaters)}))
+		elif result['outcome']=='PARTIAL':
+			report.append(('partTwoPartial',{'required':strp(requiredRepeaters)}))
 		else:
-			gradedText+='\n  INCORRECT: Your selections did not include all of the most likely repeaters ('+strp(requiredRepeaters)+')'
-		olen=len(optionalRepeatersGuessed)
+			report.append(('partTwoIncorrect',{'required':strp(requiredRepeaters)}))
+		olen=len(result['optional'])
 		if olen>0:
-			gradedText+='\n      BONUS: You selected '+str(olen)+' of the other possible repeaters ('+strp(optionalRepeaters)+')'
-			scoreDict['partTwo']+=(olen*2)
-		ulen=len(unlikelyRepeatersGuessed)
+			report.append(('partTwoBonus',{'count':olen,'optional':strp(optionalRepeaters)}))
+		ulen=len(result['unlikely'])
 		if ulen>0:
-			gradedText+='\n  DEDUCTION: You selected '+str(ulen)+' of the highly-unlikely repeaters ('+strp(unlikelyRepeaters)+')'
-			scoreDict['partTwo']-=ulen
+			report.append(('partTwoDeduction',{'count':ulen,'unlikely':strp(unlikelyRepeaters)}))
+		scoreDict['partTwo']+=result['points']
+		locationScores[location]=result['points']
 		# maxPossibleScore+=10+olen
-		targetScore+=10
-	gradedText+='\n-----------------------------------'
+		targetScore+=weights['target']
+
+	# this submission's item-level statistics, counted once the grade is saved below
+	#  (solutionDict is the partTwo solution at this point)
+	counted=(solutionDict2,partOneResponseDict,solutionDict,partTwoResponseDict)
+
+	report.append(('rule',{}))
 	score=scoreDict['partTwo']
 	# pct=round(float(score/maxPossibleScore*100))
 	pct=round(float(score/targetScore*100))
 	scorePct['partTwo']=pct
 	# print('Part Two Score: '+str(pct)+'%  (your score: '+str(score)+'   maximum possible: '+str(maxPossibleScore)+')',file=outfile)
-	gradedText+='\nPart Two Score: '+str(pct)+'%  (your score: '+str(score)+'   target score: '+str(targetScore)+')'
+	report.append(('partTwoScore',{'pct':pct,'score':score,'target':targetScore}))
 
-	summary='SAR'+sarID+' : Map ID '+mapID+' : '+time.strftime('%a %b %d %H:%M:%S')
 	grade='Part One: '+str(scorePct['partOne'])+'%    Part Two: '+str(scorePct['partTwo'])+'%'
-	summary+='\n'+grade
-	summary+='\n----------------------------------------'
-	with open(os.path.join(rtPath,'summary.txt'),'a') as sf:
-		print(summary,file=sf)
-
-	testDict[sarID]['graded']=time.strftime('%a %b %d %Y %H:%M:%S')
-	testDict[sarID]['grade']=grade
-	rval=sendEmail(
-		from_email='caver456@gmail.com',
-		to_emails=['caver456@gmail.com',testDict[sarID]['email']],
-		subject='Repeater Test graded results',
-		html_content=(summary+'\n'+gradedText).replace('\n','<br>').replace(' ','&nbsp;')
-		)
-	if rval:
-		testDict[sarID]['gradedEmailSent']=time.strftime('%a %b %d %Y %H:%M:%S')
-
-def saveTestDict():
-	logging.info('saving testDict to testDict.json')
-	with open(os.path.join(rtPath,'testDict.json'),'w') as td:
-		json.dump(testDict,td,indent=3)
+	summaryLines=[
+		('summaryHeader',{'sarID':sarID,'mapID':mapID,'time':time.strftime('%a %b %d %H:%M:%S')}),
+		('summaryGrade',{'grade':grade}),
+		('summaryRule',{})
+	]
+	summary=renderText(summaryLines)
+	appendText(os.path.join(rtPath,'summary.txt'),summary+'\n')
+
+	# keep the answers and the per-location scores, so that regrade can find the
+	#  submissions affected by a change to the answer keys
+	fields={
+		'graded':time.strftime('%a %b %d %Y %H:%M:%S'),
+		'grade':grade,
+		'test':spec.name+' v'+str(spec.version),
+		'pct':scorePct,
+		'guesses':{'mapID':mapID,'partOne':partOne,'partTwo':partTwo},
+		'scores':{'partOne':scoreDict['partOne'],'partTwo':locationScores}
+	}
+	# a reroute or flag is kept for the operator (and in the digest); a clean submission clears it
+	fields['mapIDCheck']=check if check and check['action']!='grade' else None
+	if member is None:
+		logging.info('ERROR: SAR '+str(sarID)+' is not in testDict; grade not saved')
+		return grade
+	# the email goes before the update, so that its gradedEmailSent is saved with the grade
+	if notify and not (notify=='ifChanged' and grade==member.get('grade',None)):
+		(text,htmlContent)=renderReport(summaryLines+[('blank',{})]+report)
+		if sendGradedEmail(sarID,
+			from_email='caver456@gmail.com',
+			to_emails=member['email'],
+			subject='Repeater Test graded results',
+			html_content=htmlContent,
+			plain_text_content=text
+			):
+			fields['gradedEmailSent']=time.strftime('%a %b %d %Y %H:%M:%S')
+	(previous,member)=updateMember(os.path.join(rtPath,'testDict.json'),sarID,fields)
+	if member is None:
+		logging.info('ERROR: SAR '+str(sarID)+' is not in testDict; grade not saved')
+		return grade
+	# the item statistics count each member's latest submission: this one replaces the
+	#  previous one, if that was for a map of this test (see itemStats.py); requests for the
+	#  same member each replace the one before them, in whatever order they get here
+	previousGuesses=previous.get('guesses',None)
+	previousKey=solutionDicts['partOne'].get(str(previousGuesses['mapID']),None) if previousGuesses else None
+	replaceResult(os.path.join(rtPath,spec.itemStats),repeaters,locations,
+		guessesResult(previousGuesses,previousKey,solutionDict,repeaters,locations) if previousKey else None,counted)
+	# the operator gets this result in the next digest (see operatorDigest.py)
+	queueResult(rtPath,sarID)
+	return grade
+
+# the graded results email, with sendEmail's arguments; returns True if it was sent
+#  asyncServe.py replaces this with a non-blocking send, which returns None (not sent
+#  yet), and calls markGradedEmailSent itself once the email is sent
+def sendGradedEmail(sarID,**email):
+	return sendEmail(**email)
+
+def markGradedEmailSent(sarID):
+	updateMember(os.path.join(rtPath,'testDict.json'),sarID,{'gradedEmailSent':time.strftime('%a %b %d %Y %H:%M:%S')})
+
+def saveTestDict(testDict):
+	logging.info('saving testDict')
+	saveMembers(testDict,os.path.join(rtPath,'testDict.json'))
 
 def loadTestDict():
-	global testDict
-	logging.info('loading testDict from testDict.json')
-	with open(os.path.join(rtPath,'testDict.json'),'r') as td:
-		testDict=json.load(td)
+	logging.info('loading testDict')
+	return loadMembers(os.path.join(rtPath,'testDict.json'))
 
 # from https://gist.github.com/fmaida/faee02b304b0444845703a3d130d928c - thanks to @fmaida
 def extract_jotform_data():
@@ -427,17 +521,32 @@ def extract_jotform_data():
             output[new_key] = value
     return output
 
-testDict={}
-solutionDicts={}
-
 # repeater test - jotform webhook handler
+# all state is per-request: the keys are read into a local dict, and gradeResponse
+#  updates only this member's entry in testDict (see stateStore.py)
+# every submission is archived first, in rtPath/submissions (see submissionLog.py), so
+#  that it can be replayed later ('repeaterTest.py replay'), even if the rate limit then
+#  stops it from being graded
+# a submission that can't be graded (e.g. a mapID outside every test's range) is answered
+#  422 instead of 'accepted'; gradeResponse logs it and queues it for the operator digest
 @app.route('/api/v1/jotform_webhook',methods=['POST'])
 def api_jotformWebhookHandler():
-    global testDict
-    global solutionDicts
     app.logger.info('jotform webhook handler called')
     d=extract_jotform_data()
     app.logger.info('extracted jotform data:'+json.dumps(d))
+    try:
+        SubmissionLog(os.path.join(rtPath,'submissions')).append(d)
+    except Exception as e:
+        logging.info('ERROR: submission not archived: '+str(e))
+    # one member's resubmissions (or jotform's retries of them) are limited on their own;
+    #  only the grading is shed: the submission is already archived, and the operator
+    #  digest says how to grade it
+    rejected=shed('SAR '+str(d['SARNumber']) if d.get('SARNumber') else 'address '+str(request.remote_addr))
+    if rejected:
+        problem='rate limited: archived but not graded; grade it with repeaterTest.py replay --sar-ids '+str(d.get('SARNumber',None))+' --latest --grade'
+        logging.info('ERROR: SAR '+str(d.get('SARNumber',None))+': '+problem)
+        queueResult(rtPath,d.get('SARNumber',None),problem=problem)
+        return rejected
     mapID=str(d.get('mapID',None))
     app.logger.info('map ID:'+mapID)
     
@@ -450,21 +559,97 @@ def api_jotformWebhookHandler():
     # if rval:
     #     app.logger.info('email sent')
 
-    testDict={}
-    solutionDicts={}
-    loadTestDict()
-    readSolutionDicts()
-    gradeResponse(mapID,d)
-    saveTestDict()
+    grade=gradeResponse(mapID,d)
+
+    # the operator's digest of graded results, once the oldest one has waited long enough
+    try:
+        if digestDue(rtPath):
+            n=sendDigest(rtPath,sendEmail)
+            app.logger.info('operator digest: '+str(n)+' results sent')
+    except Exception as e:
+        logging.info('ERROR: operator digest not sent: '+str(e))
 
+    if grade is None:
+        return '<h1>422</h1><p>RepeaterTest response not graded: the map ID is not valid, or the response is incomplete.</p>', 422
     return '<h1>SignIn Database API</h1><p>RepeaterTest response accepted</p>'
 
 
+# repeater test - item-level statistics, maintained by gradeResponse
+#  ?test=name for a test other than the current one in testSpec.json
+@app.route('/api/v1/repeaterTest/stats',methods=['GET'])
+@require_appkey
+def api_repeaterTestStats():
+    specs=readTestSpecs()
+    spec=specs.byName.get(request.args.get('test',specs.current.name),None)
+    if not spec:
+        return "<h1>404</h1><p>No such test in testSpec.json.</p>", 404
+    stats=loadStats(os.path.join(rtPath,spec.itemStats),spec.repeaters,spec.locations)
+    return jsonify(statsReport(stats))
+
+
+# repeater test - member counts by follow-up status and pending follow-up jobs; the index
+#  is kept between requests, and only re-indexes entries that changed in testDict
+followUpIndex=FollowUpIndex()
+
+@app.route('/api/v1/repeaterTest/status',methods=['GET'])
+@require_appkey
+def api_repeaterTestStatus():
+    followUpIndex.refreshFromStore(os.path.join(rtPath,'testDict.json'))
+    return jsonify(followUpIndex.summary())
+
+
+# repeater test - map previews for phones, built by 'repeaterTest.py previews --out-dir previews'
+#  no app key, since the links are in the assignment emails (like the map PDFs themselves)
+#  the shared base image has a content hash in its name, so it can be cached forever; the
+#  per-map files are revalidated by ETag after a day, in case the maps are rebuilt
+@app.route('/api/v1/repeaterTest/preview/<fileName>',methods=['GET'])
+def api_repeaterTestPreview(fileName):
+    maxAge=365*86400 if fileName.startswith('base_') else 86400
+    response=flask.send_from_directory(os.path.abspath(os.path.join(rtPath,'previews')),fileName,max_age=maxAge)
+    if fileName.startswith('base_'):
+        response.cache_control.immutable=True
+    return response
+
+
 #########################################################
 ############### end of repeaterTest code ################
 #########################################################
 
 
+# sign-in database connections: the sdb* calls reuse this worker's sqlite connections,
+#  with their prepared statements, instead of opening a new one each time (see dbPool.py);
+#  any connection a request leaves open is given back when the request ends
+import signin_db
+from dbPool import ConnectionPool,installPool
+dbPool=ConnectionPool()
+dbPoolInstalled=installPool(signin_db,dbPool)
+if not dbPoolInstalled:
+    logging.info('ERROR: signin_db does not open its connections with sqlite3.connect from its own module globals; database connections are NOT pooled (see dbPool.py)')
+    app.logger.error('signin_db database connections are NOT pooled (see dbPool.py)')
+
+@app.teardown_request
+def releaseDBConnections(exc):
+    dbPool.releaseAll()
+
+# whether the pool is in use in this worker, and its counts of opened and reused connections
+@app.route('/api/v1/dbPool',methods=['GET'])
+@require_appkey
+def api_dbPool():
+    return jsonify({'installed':dbPoolInstalled,'stats':dbPool.stats})
+
+
+# per-client, per-route rate limits, from rateLimits.json (re-read when it changes)
+from rateLimit import RateLimiter
+rateLimiter=RateLimiter(os.path.join(rtPath,'rateLimits.json'))
+
+# counts of allowed and rejected (429) requests, by route and by client, since this
+#  worker started
+@app.route('/api/v1/rateLimits',methods=['GET'])
+@require_appkey
+def api_rateLimits():
+    return jsonify(rateLimiter.report())
+
+
 # response = jsonified list of dict and response code
 @app.route('/api/v1/events/new', methods=['POST'])
 @require_appkey
@@ -478,6 +663,7 @@ def api_newEvent():
     else: #kivy UrlRequest sends the dictionary itself
         d=request.json
     r=sdbNewEvent(d)
+    snapshotCache.invalidate()
     app.logger.info("sending response from api_newEvent:"+str(r))
     return jsonify(r)
 
@@ -503,6 +689,48 @@ def api_getEvents():
     return jsonify(sdbGetEvents(lastEditSince,eventStartSince,nonFinalizedOnly))
 
 
+# kiosks can keep this open instead of polling /api/v1/events: each time events change,
+#  the list of changed events (as /api/v1/events?lastEditSince=... would give it) is
+#  sent as a server-sent event; it checks every streamInterval seconds, and ends after
+#  streamDuration seconds, when the client should reconnect with the newest
+#  LastEditEpoch it has seen
+# here, each open stream holds a worker thread; asyncServe.py serves the same route
+#  from one shared poller instead
+streamInterval=2
+streamKeepalive=15
+streamDuration=300
+
+def streamMessage(events):
+    if events is None:
+        return b': keepalive\n\n'
+    return ('event: events\ndata: '+json.dumps(events)+'\n\n').encode()
+
+def newestEdit(events,since):
+    return max([since]+[float(e.get('LastEditEpoch',0) or 0) for e in events])
+
+@app.route('/api/v1/events/stream',methods=['GET'])
+@require_appkey
+def api_streamEvents():
+    try:
+        since=float(request.args.get('lastEditSince',0))
+    except ValueError:
+        since=0.0
+    def generate(since):
+        start=time.time()
+        lastSent=start
+        while time.time()-start<streamDuration:
+            events=sdbGetEvents(since,0,False)
+            if events:
+                since=newestEdit(events,since)
+                yield streamMessage(events)
+                lastSent=time.time()
+            elif time.time()-lastSent>=streamKeepalive:
+                yield streamMessage(None)
+                lastSent=time.time()
+            time.sleep(streamInterval)
+    return flask.Response(generate(since),mimetype='text/event-stream',headers={'Cache-Control':'no-cache'})
+
+
 @app.route('/api/v1/events/<int:eventID>', methods=['GET'])
 @require_appkey
 def api_getEvent(eventID):
@@ -522,6 +750,33 @@ def api_getEventHTML(eventID):
     return getEventHTML(eventID)
 
 
+# kiosk start-up: the roster, the non-finalized events and each one's records in one
+#  compact CBOR document (see snapshot.py), rebuilt only when something changed (the
+#  event, record and finalize routes invalidate it, through rtPath/snapshot.stamp); follow
+#  it with /api/v1/events?lastEditSince=<the snapshot's lastEditSince>
+#  ?format=json gives the same document as json, for a look at it
+from snapshot import SnapshotCache,snapshotVersion,decodeCBOR
+snapshotCache=SnapshotCache(stampFile=os.path.join(rtPath,'snapshot.stamp'))
+
+@app.route('/api/v1/snapshot',methods=['GET'])
+@require_appkey
+def api_getSnapshot():
+    (etag,data,gzipped)=snapshotCache.get(sdbGetEvents,sdbGetEvent,sdbGetRoster)
+    if request.args.get('format')=='json':
+        return jsonify(decodeCBOR(data))
+    if request.headers.get('If-None-Match')==etag:
+        return '',304,{'ETag':etag}
+    gzipOK='gzip' in request.headers.get('Accept-Encoding','')
+    response=flask.make_response(gzipped if gzipOK else data)
+    response.headers['Content-Type']='application/cbor'
+    if gzipOK:
+        response.headers['Content-Encoding']='gzip'
+    response.headers['Vary']='Accept-Encoding'
+    response.headers['ETag']=etag
+    response.headers['X-Snapshot-Version']=str(snapshotVersion)
+    return response
+
+
 # it's cleaner to let the host decide whether to add or to update;
 # if ID, Agency, Name, and InEpoch match those of an existing record,
 #  then update that record; otherwise, add a new record;
@@ -540,7 +795,9 @@ def api_add_or_update(eventID):
         d=json.loads(request.json)
     else: #kivy UrlRequest sends the dictionary itself
         d=request.json
-    return jsonify(sdbAddOrUpdate(eventID,d))
+    r=sdbAddOrUpdate(eventID,d)
+    snapshotCache.invalidate()
+    return jsonify(r)
 
 
 
@@ -553,6 +810,7 @@ def api_add_or_update(eventID):
 def api_finalize(eventID):
     app.logger.info("finalize called for event "+str(eventID))
     rval=sdbPush(eventID)
+    snapshotCache.invalidate()
     if rval["statusCode"]>299:
         return rval["message"],rval["statusCode"]
     return jsonify(rval)
@@ -567,5 +825,6 @@ def page_not_found(e):
 #  check to see if the resolved path directory contains '/home'; this may
 #  need to change when LAN server is incorporated, since really it is just checking
 #  for linux vs windows
-if '/home' not in pr:
+# (only when run as a script, so that benchmarks and load tests can import the app)
+if __name__=='__main__' and '/home' not in pr:
     app.run()
@@ -0,0 +1,240 @@
+# snapshot.py - one compact document with everything a sign-in kiosk needs at start-up
+
+# a kiosk that starts or reconnects used to pull the roster, then the event list, then
+#  each event's records, one request at a time; the snapshot has all of it:
+#   {
+#      "snapshotVersion":1,
+#      "generated":<epoch>,
+#      "lastEditSince":<epoch>, # the newest LastEditEpoch in the snapshot; pass it to
+#                               #  /api/v1/events?lastEditSince=... to get the changes since
+#      "roster":<table>,
+#      "events":<table>, # the non-finalized events
+#      "records":{<eventID>:<table>,...} # each event's records (sdbGetEvent)
+#   }
+#  where a table is {"columns":[...],"rows":[[...],...]}, so the field names of a list
+#  of records are sent once instead of once per record
+#
+# it is encoded as CBOR (RFC 8949; any CBOR library can read it, and decodeCBOR below
+#  does too), and kept gzipped; only these types are used: null, bool, int, float
+#  (64-bit), text, bytes, array, map
+#
+# SnapshotCache rebuilds the snapshot only when the events change (a new, edited or
+#  finalized event), when the roster has changed (checked at most every rosterRecheck
+#  seconds), or after invalidate(); otherwise each request costs one event list query
+#  and a read of the stamp file, and the cached bytes are sent as they are
+# a record change doesn't necessarily change its event's LastEditEpoch (that is up to
+#  signin_db), so signin_api calls invalidate() after every record or event write; the
+#  stamp file carries the invalidation to the caches of the other web workers
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import gzip
+import json
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+
+snapshotVersion=1
+
+#########################################################
+# CBOR
+#########################################################
+
+def encodeHead(major,n):
+	if n<24:
+		return bytes([major<<5|n])
+	if n<0x100:
+		return struct.pack('>BB',major<<5|24,n)
+	if n<0x10000:
+		return struct.pack('>BH',major<<5|25,n)
+	if n<0x100000000:
+		return struct.pack('>BI',major<<5|26,n)
+	if n<0x10000000000000000:
+		return struct.pack('>BQ',major<<5|27,n)
+	raise ValueError('integer too large for CBOR: '+str(n))
+
+def encodeItem(obj,out):
+	if obj is None:
+		out.append(b'\xf6')
+	elif obj is True:
+		out.append(b'\xf5')
+	elif obj is False:
+		out.append(b'\xf4')
+	elif isinstance(obj,int):
+		out.append(encodeHead(0,obj) if obj>=0 else encodeHead(1,-1-obj))
+	elif isinstance(obj,float):
+		out.append(b'\xfb'+struct.pack('>d',obj))
+	elif isinstance(obj,str):
+		b=obj.encode('utf-8')
+		out.append(encodeHead(3,len(b)))
+		out.append(b)
+	elif isinstance(obj,(bytes,bytearray)):
+		out.append(encodeHead(2,len(obj)))
+		out.append(bytes(obj))
+	elif isinstance(obj,(list,tuple)):
+		out.append(encodeHead(4,len(obj)))
+		for item in obj:
+			encodeItem(item,out)
+	elif isinstance(obj,dict):
+		out.append(encodeHead(5,len(obj)))
+		for (k,v) in obj.items():
+			encodeItem(k,out)
+			encodeItem(v,out)
+	else:
+		raise TypeError('cannot encode '+type(obj).__name__+' as CBOR')
+
+def encodeCBOR(obj):
+	out=[]
+	encodeItem(obj,out)
+	return b''.join(out)
+
+# returns (object, position after it)
+def decodeItem(data,pos):
+	initial=data[pos]
+	(major,info)=(initial>>5,initial&0x1f)
+	pos+=1
+	if major==7:
+		if info==20:
+			return (False,pos)
+		if info==21:
+			return (True,pos)
+		if info in (22,23):
+			return (None,pos)
+		if info==25:
+			return (struct.unpack_from('>e',data,pos)[0],pos+2)
+		if info==26:
+			return (struct.unpack_from('>f',data,pos)[0],pos+4)
+		if info==27:
+			return (struct.unpack_from('>d',data,pos)[0],pos+8)
+		raise ValueError('unsupported CBOR simple value '+str(info))
+	if info<24:
+		n=info
+	elif info<28:
+		size=1<<(info-24)
+		n=int.from_bytes(data[pos:pos+size],'big')
+		pos+=size
+	else:
+		raise ValueError('unsupported CBOR length '+str(info)+' (indefinite lengths are not used)')
+	if major==0:
+		return (n,pos)
+	if major==1:
+		return (-1-n,pos)
+	if major==2:
+		return (bytes(data[pos:pos+n]),pos+n)
+	if major==3:
+		return (bytes(data[pos:pos+n]).decode('utf-8'),pos+n)
+	if major==4:
+		items=[]
+		for i in range(n):
+			(item,pos)=decodeItem(data,pos)
+			items.append(item)
+		return (items,pos)
+	if major==5:
+		d={}
+		for i in range(n):
+			(k,pos)=decodeItem(data,pos)
+			(d[k],pos)=decodeItem(data,pos)
+		return (d,pos)
+	if major==6: # tag: just the tagged item
+		return decodeItem(data,pos)
+
+def decodeCBOR(data):
+	(obj,pos)=decodeItem(data,0)
+	if pos!=len(data):
+		raise ValueError('extra bytes after the CBOR item')
+	return obj
+
+#########################################################
+# snapshot
+#########################################################
+
+# list of dicts -> table; columns in order of first appearance, missing values are None
+def table(rows):
+	columns=[]
+	seen=set()
+	for r in rows:
+		for k in r:
+			if k not in seen:
+				seen.add(k)
+				columns.append(k)
+	return {'columns':columns,'rows':[[r.get(c,None) for c in columns] for r in rows]}
+
+def untable(t):
+	return [dict(zip(t['columns'],row)) for row in t['rows']]
+
+# sdbGetEvent gives a list of records; anything else (e.g. an error) means no records
+def asRows(rows):
+	return [dict(r) for r in rows if isinstance(r,dict)] if isinstance(rows,list) else []
+
+def buildSnapshot(roster,events,recordsByEvent,generated=None):
+	return {
+		'snapshotVersion':snapshotVersion,
+		'generated':time.time() if generated is None else generated,
+		'lastEditSince':max([float(e.get('LastEditEpoch',0) or 0) for e in events],default=0.0),
+		'roster':table(asRows(roster)),
+		'events':table(asRows(events)),
+		'records':{e['EventID']:table(asRows(recordsByEvent.get(e['EventID'],[]))) for e in events}
+	}
+
+def digest(obj):
+	return hashlib.sha1(json.dumps(obj,sort_keys=True,default=str).encode()).hexdigest()
+
+class SnapshotCache():
+	# stampFile: a file that invalidate() rewrites with a new token; None for a cache that
+	#  is only used in this process
+	def __init__(self,rosterRecheck=300,level=9,stampFile=None):
+		self.rosterRecheck=rosterRecheck
+		self.level=level
+		self.stampFile=stampFile
+		self.lock=threading.Lock()
+		self.rosterChecked=None
+		self.roster=None
+		self.rosterDigest=None
+		self.key=None
+		self.current=None # (etag, cbor bytes, gzipped bytes)
+		self.stats={'built':0,'cached':0}
+
+	def stamp(self):
+		if not self.stampFile:
+			return None
+		try:
+			with open(self.stampFile,'r') as f:
+				return f.read()
+		except OSError:
+			return None
+
+	# the next get() rebuilds the snapshot, here and in every process sharing the stamp file
+	def invalidate(self):
+		with self.lock:
+			self.key=None
+		if self.stampFile:
+			(fd,tmpName)=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.stampFile)),prefix='.snapshotStamp.')
+			with os.fdopen(fd,'w') as f:
+				f.write(os.urandom(8).hex())
+			os.replace(tmpName,self.stampFile)
+
+	# returns (etag, cbor bytes, gzipped bytes), rebuilding them if anything changed
+	#  getEvents, getEvent, getRoster: the sdb* functions
+	def get(self,getEvents,getEvent,getRoster):
+		events=getEvents(0,0,True)
+		eventsKey=sorted((e['EventID'],e.get('LastEditEpoch',None)) for e in events)
+		stamp=self.stamp()
+		with self.lock:
+			now=time.monotonic()
+			if self.rosterChecked is None or now-self.rosterChecked>=self.rosterRecheck:
+				self.roster=getRoster()
+				self.rosterDigest=digest(self.roster)
+				self.rosterChecked=now
+			key=digest([eventsKey,self.rosterDigest,stamp])
+			if key==self.key:
+				self.stats['cached']+=1
+				return self.current
+			recordsByEvent={e['EventID']:getEvent(e['EventID']) for e in events}
+			data=encodeCBOR(buildSnapshot(self.roster,events,recordsByEvent))
+			self.current=('"'+key+'"',data,gzip.compress(data,self.level,mtime=0))
+			self.key=key
+			self.stats['built']+=1
+			return self.current
@@ -0,0 +1,204 @@
+# stateStore.py - safe updates of the shared state: the members (testDict), and the json
+#  state files (itemStats.json, ...)
+
+# the webhook can be called by several threads (threaded server) or several processes
+#  (multiple web workers) at once; a plain load / modify / save of the whole file lets two
+#  overlapping submissions each save their own copy, and the last save wins
+#
+# so, every read-modify-write of a state file happens while holding:
+#   - a lock per file name, for threads in this process
+#   - an exclusive flock on <fileName>.lock, for other processes (where fcntl exists;
+#     on Windows only the thread lock is used, which is fine for the local dev server)
+# and the new contents are written to a temporary file in the same directory, then
+#  moved over the old file with os.replace, so a reader never sees a partly-written file
+#
+# the members are not a json file: testDict.json was rewritten whole (and fsynced) for
+#  every change to any one member, under one lock, so every webhook waited for every other
+#  one, and the cost grew with the cohort; each member's entry is a row in a sqlite file
+#  instead (the name given with .sqlite in place of .json: testDict.json -> testDict.sqlite):
+#   - updateMember merges fields into one member's entry and writes only that row, in one
+#     short transaction; WAL, so readers don't wait for the writer
+#   - getMember reads one entry; loadMembers / saveMembers read and replace the whole
+#     dict, in its order (the command-line tools)
+#   - membersVersion changes with every write, for readers that keep an index of the
+#     members (see followUp.py)
+#   - a json file of that name (an older testDict.json, or one that was uploaded) replaces
+#     the members the next time the store is opened, and is renamed to <name>.imported
+#     ('repeaterTest.py test-dict' also exports and imports json)
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import json
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+	import fcntl
+except ImportError:
+	fcntl=None
+
+threadLocks={}
+threadLocksLock=threading.Lock()
+
+@contextmanager
+def lockedFile(fileName):
+	key=os.path.abspath(fileName)
+	with threadLocksLock:
+		lock=threadLocks.setdefault(key,threading.Lock())
+	with lock:
+		if fcntl:
+			with open(key+'.lock','a') as lf:
+				fcntl.flock(lf,fcntl.LOCK_EX)
+				try:
+					yield
+				finally:
+					fcntl.flock(lf,fcntl.LOCK_UN)
+		else:
+			yield
+
+def loadJSON(fileName,default=None):
+	if not os.path.isfile(fileName):
+		return default
+	with open(fileName,'r') as f:
+		return json.load(f)
+
+def saveJSON(obj,fileName,indent=None):
+	(fd,tmpName)=tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fileName)),prefix='.'+os.path.basename(fileName)+'.')
+	try:
+		with os.fdopen(fd,'w') as f:
+			json.dump(obj,f,indent=indent)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmpName,fileName)
+	except Exception:
+		os.remove(tmpName)
+		raise
+
+# load, update and save while holding the lock; update(obj) modifies obj in place,
+#  and its return value is returned
+def updateJSON(fileName,update,default=None,indent=None):
+	with lockedFile(fileName):
+		obj=loadJSON(fileName,default)
+		rval=update(obj)
+		saveJSON(obj,fileName,indent)
+	return rval
+
+#########################################################
+# members
+#########################################################
+
+def memberStoreFile(fileName):
+	(base,ext)=os.path.splitext(fileName)
+	return base+'.sqlite' if ext=='.json' else fileName
+
+initializedStores=set() # store files this process has created or checked
+
+def openMembers(fileName):
+	storeFile=os.path.abspath(memberStoreFile(fileName))
+	jsonFile=os.path.abspath(fileName)
+	if storeFile not in initializedStores or (jsonFile!=storeFile and os.path.isfile(jsonFile)):
+		with lockedFile(storeFile):
+			conn=sqlite3.connect(storeFile,timeout=30,isolation_level=None)
+			try:
+				conn.execute('PRAGMA journal_mode=WAL')
+				conn.executescript('''
+					CREATE TABLE IF NOT EXISTS members (sarID TEXT PRIMARY KEY, entry TEXT NOT NULL);
+					CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+					INSERT OR IGNORE INTO meta VALUES ('version',0);''')
+				if jsonFile!=storeFile and os.path.isfile(jsonFile):
+					imported=loadJSON(jsonFile,{})
+					writeMembers(conn,imported)
+					os.replace(jsonFile,jsonFile+'.imported')
+			finally:
+				conn.close()
+		initializedStores.add(storeFile)
+	conn=sqlite3.connect(storeFile,timeout=30,isolation_level=None)
+	conn.execute('PRAGMA synchronous=FULL')
+	return conn
+
+def bumpVersion(conn):
+	conn.execute("UPDATE meta SET value=value+1 WHERE key='version'")
+
+# replace all of the members, in one transaction
+def writeMembers(conn,testDict):
+	conn.execute('BEGIN IMMEDIATE')
+	try:
+		conn.execute('DELETE FROM members')
+		conn.executemany('INSERT INTO members VALUES (?,?)',[(str(sarID),json.dumps(entry)) for (sarID,entry) in testDict.items()])
+		bumpVersion(conn)
+	except Exception:
+		conn.execute('ROLLBACK')
+		raise
+	conn.execute('COMMIT')
+
+def loadMembers(fileName):
+	conn=openMembers(fileName)
+	try:
+		return {sarID:json.loads(entry) for (sarID,entry) in conn.execute('SELECT sarID,entry FROM members ORDER BY rowid')}
+	finally:
+		conn.close()
+
+def saveMembers(testDict,fileName):
+	conn=openMembers(fileName)
+	try:
+		writeMembers(conn,testDict)
+	finally:
+		conn.close()
+
+# one member's entry, or None
+def getMember(fileName,sarID):
+	conn=openMembers(fileName)
+	try:
+		row=conn.execute('SELECT entry FROM members WHERE sarID=?',(str(sarID),)).fetchone()
+	finally:
+		conn.close()
+	return json.loads(row[0]) if row else None
+
+def membersVersion(fileName):
+	conn=openMembers(fileName)
+	try:
+		return conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()[0]
+	finally:
+		conn.close()
+
+# merge fields into several members' entries, in one transaction, leaving all other
+#  members (and all other fields) as they are in the store at that moment
+#  fieldsBySAR: key = SAR number, val = fields
+# returns {sarID : (previous entry, updated entry)} for the members that are in the store
+def updateMembers(fileName,fieldsBySAR):
+	conn=openMembers(fileName)
+	out={}
+	try:
+		conn.execute('BEGIN IMMEDIATE')
+		try:
+			for (sarID,fields) in fieldsBySAR.items():
+				row=conn.execute('SELECT entry FROM members WHERE sarID=?',(str(sarID),)).fetchone()
+				if row is None:
+					continue
+				previous=json.loads(row[0])
+				entry=dict(previous,**fields)
+				conn.execute('UPDATE members SET entry=? WHERE sarID=?',(json.dumps(entry),str(sarID)))
+				out[sarID]=(previous,entry)
+			if out:
+				bumpVersion(conn)
+		except Exception:
+			conn.execute('ROLLBACK')
+			raise
+		conn.execute('COMMIT')
+	finally:
+		conn.close()
+	return out
+
+# merge fields into one member's entry
+# returns (previous entry, updated entry), or (None, None) if sarID is not in the store
+def updateMember(fileName,sarID,fields):
+	return updateMembers(fileName,{sarID:fields}).get(sarID,(None,None))
+
+# append text to a file while holding the lock (summary.txt)
+def appendText(fileName,text):
+	with lockedFile(fileName):
+		with open(fileName,'a') as f:
+			f.write(text)
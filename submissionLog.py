@@ -0,0 +1,212 @@
+# submissionLog.py - append-only, compressed archive of the raw jotform webhook submissions
+
+# every payload from extract_jotform_data is appended to the current segment file as it
+#  arrives, and one line is appended to the index; both are plain appends under a lock
+#  (see stateStore.py), so the webhook pays for one small compress and two small writes
+#
+# directory layout (e.g. rtPath/submissions):
+#   segment_000001.rts, ... - frames; a new segment is started when the current one
+#     reaches segmentSize
+#   index.tsv - one line per submission: received (epoch), SAR number, mapID, segment,
+#     frame offset, record number in the frame
+#
+# frame: 16-byte header (magic, raw length, compressed length, crc32 of the compressed
+#  bytes), then zlib-compressed records; a record is a uint32 length and the payload
+#  as json; the webhook writes one record per frame, and compact() rewrites a finished
+#  segment into frames of about blockSize raw bytes, which compress much better
+#
+# a reader only decompresses the frames that hold the selected submissions, in file
+#  order, so replaying a large selection is mostly sequential reads; a frame that was
+#  only partly written (e.g. the server was stopped mid-write) fails its crc check and
+#  is skipped with an error in the log
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import json
+import time
+import zlib
+import struct
+import logging
+import tempfile
+from stateStore import lockedFile
+
+frameMagic=b'RTSB'
+frameHeader=struct.Struct('<4sIII')
+recordLength=struct.Struct('<I')
+segmentSize=16<<20
+blockSize=256<<10
+indexFields=['received','sarID','mapID','segment','offset','record']
+
+def segmentName(n):
+	return 'segment_'+str(n).zfill(6)+'.rts'
+
+def packRecords(payloads):
+	return b''.join(recordLength.pack(len(p))+p for p in payloads)
+
+def unpackRecords(raw):
+	records=[]
+	pos=0
+	while pos<len(raw):
+		(n,)=recordLength.unpack_from(raw,pos)
+		records.append(raw[pos+4:pos+4+n])
+		pos+=4+n
+	return records
+
+def frame(raw,level=6):
+	compressed=zlib.compress(raw,level)
+	return frameHeader.pack(frameMagic,len(raw),len(compressed),zlib.crc32(compressed))+compressed
+
+# the records of the frame at offset in an open segment file, or None if it is damaged
+def readFrame(f,offset):
+	f.seek(offset)
+	header=f.read(frameHeader.size)
+	if len(header)<frameHeader.size:
+		return None
+	(magic,rawLength,compressedLength,crc)=frameHeader.unpack(header)
+	compressed=f.read(compressedLength)
+	if magic!=frameMagic or len(compressed)<compressedLength or zlib.crc32(compressed)!=crc:
+		return None
+	raw=zlib.decompress(compressed)
+	return unpackRecords(raw) if len(raw)==rawLength else None
+
+def clean(s):
+	return str(s).replace('\t',' ').replace('\n',' ')
+
+class SubmissionLog():
+	def __init__(self,directory):
+		self.directory=directory
+		self.indexFile=os.path.join(directory,'index.tsv')
+
+	def segments(self):
+		if not os.path.isdir(self.directory):
+			return []
+		return sorted(int(f[8:14]) for f in os.listdir(self.directory) if f.startswith('segment_') and f.endswith('.rts'))
+
+	# archive one payload; returns its index entry
+	def append(self,payload,received=None):
+		data=frame(packRecords([json.dumps(payload,separators=(',',':')).encode()]))
+		received=time.time() if received is None else received
+		os.makedirs(self.directory,exist_ok=True)
+		with lockedFile(self.indexFile):
+			segments=self.segments()
+			segment=segments[-1] if segments else 1
+			fileName=os.path.join(self.directory,segmentName(segment))
+			offset=os.path.getsize(fileName) if os.path.isfile(fileName) else 0
+			if offset>=segmentSize:
+				segment+=1
+				fileName=os.path.join(self.directory,segmentName(segment))
+				offset=0
+			with open(fileName,'ab') as f:
+				f.write(data)
+			entry={'received':round(received,3),'sarID':clean(payload.get('SARNumber','')),'mapID':clean(payload.get('mapID','')),'segment':segment,'offset':offset,'record':0}
+			with open(self.indexFile,'a') as f:
+				f.write('\t'.join(str(entry[k]) for k in indexFields)+'\n')
+		return entry
+
+	# index entries, oldest first, optionally filtered:
+	#  sarIDs, mapIDs - collections of SAR numbers / mapIDs to include
+	#  since, until - epoch times
+	#  latest - only the most recent submission from each SAR number
+	def entries(self,sarIDs=None,mapIDs=None,since=None,until=None,latest=False):
+		sarIDs=set(str(s) for s in sarIDs) if sarIDs else None
+		mapIDs=set(str(m) for m in mapIDs) if mapIDs else None
+		out=[]
+		if not os.path.isfile(self.indexFile):
+			return out
+		with open(self.indexFile,'r') as f:
+			for line in f:
+				v=line.rstrip('\n').split('\t')
+				if len(v)!=len(indexFields):
+					continue
+				received=float(v[0])
+				if (sarIDs is None or v[1] in sarIDs) and (mapIDs is None or v[2] in mapIDs) and (since is None or received>=since) and (until is None or received<until):
+					out.append({'received':received,'sarID':v[1],'mapID':v[2],'segment':int(v[3]),'offset':int(v[4]),'record':int(v[5])})
+		if latest:
+			bySARID={}
+			for e in out:
+				bySARID[e['sarID']]=e
+			out=sorted(bySARID.values(),key=lambda e:e['received'])
+		return out
+
+	# generator: (entry, payload) for each entry, read in file order (not in the order given)
+	def payloads(self,entries):
+		f=None
+		segment=None
+		cached=(None,None)
+		for e in sorted(entries,key=lambda e:(e['segment'],e['offset'],e['record'])):
+			if e['segment']!=segment:
+				if f:
+					f.close()
+				segment=e['segment']
+				f=open(os.path.join(self.directory,segmentName(segment)),'rb')
+				cached=(None,None)
+			if cached[0]!=e['offset']:
+				cached=(e['offset'],readFrame(f,e['offset']))
+			records=cached[1]
+			if records is None or e['record']>=len(records):
+				logging.info('ERROR: submission log: damaged frame at '+segmentName(segment)+' offset '+str(e['offset'])+'; SAR '+e['sarID']+' skipped')
+				continue
+			yield (e,json.loads(records[e['record']]))
+		if f:
+			f.close()
+
+	# call grade(mapID,payload) for each selected submission, in file order
+	#  returns the number of submissions replayed
+	def replay(self,grade,entries):
+		n=0
+		for (e,payload) in self.payloads(entries):
+			grade(str(payload.get('mapID',e['mapID'])),payload)
+			n+=1
+		return n
+
+	# rewrite a finished segment (not the one being appended to) into frames of about
+	#  blockSize raw bytes, and update its index lines; returns (old size, new size)
+	#  the webhook can keep appending meanwhile, but don't replay at the same time, since
+	#  the segment and the index are replaced one after the other
+	def compact(self,segment,level=9):
+		with lockedFile(self.indexFile):
+			segments=self.segments()
+			if segment not in segments or segment==segments[-1]:
+				raise ValueError('segment '+str(segment)+' is not a finished segment of '+self.directory)
+			fileName=os.path.join(self.directory,segmentName(segment))
+			entries=[e for e in self.entries() if e['segment']==segment]
+			newOffsets={}
+			(fd,tmpName)=tempfile.mkstemp(dir=self.directory,prefix='.'+segmentName(segment)+'.')
+			with os.fdopen(fd,'wb') as out:
+				block=[]
+				keys=[]
+				def flush():
+					offset=out.tell()
+					out.write(frame(packRecords(block),level))
+					for (n,key) in enumerate(keys):
+						newOffsets[key]=(offset,n)
+					del block[:]
+					del keys[:]
+				size=0
+				for (e,payload) in self.payloads(entries):
+					block.append(json.dumps(payload,separators=(',',':')).encode())
+					keys.append((e['offset'],e['record']))
+					size+=len(block[-1])+4
+					if size>=blockSize:
+						flush()
+						size=0
+				if block:
+					flush()
+				out.flush()
+				os.fsync(out.fileno())
+			(ifd,indexTmp)=tempfile.mkstemp(dir=self.directory,prefix='.index.tsv.')
+			with os.fdopen(ifd,'w') as out, open(self.indexFile,'r') as f:
+				for line in f:
+					v=line.rstrip('\n').split('\t')
+					if len(v)==len(indexFields) and int(v[3])==segment:
+						key=(int(v[4]),int(v[5]))
+						if key not in newOffsets:
+							continue # its frame was damaged, so it wasn't copied
+						(v[4],v[5])=(str(newOffsets[key][0]),str(newOffsets[key][1]))
+						line='\t'.join(v)+'\n'
+					out.write(line)
+			oldSize=os.path.getsize(fileName)
+			os.replace(tmpName,fileName)
+			os.replace(indexTmp,self.indexFile)
+			return (oldSize,os.path.getsize(fileName))
@@ -0,0 +1,135 @@
+# templateOptimize.py - recompress the template's map image once, before the maps are rendered
+
+# every map PDF carries the template's map image, so the image sets the size of every map
+#  (a 2208x1280 JPEG with a soft mask: about 550KB of each 570KB map); members open the
+#  maps on phones, often on a cellular link in the field
+#
+# optimizeTemplate writes a copy of the template with each raster image:
+#  - downsampled to maxDPI at the size it is drawn on the page (images that are already
+#    at or below maxDPI keep their size)
+#  - re-encoded as a JPEG at the given quality (its soft mask, if any, is resized to match
+#    and deflated)
+#  - left as it was if the new encoding isn't smaller
+# the form fields, fonts and vector content are copied unchanged, so makePDF fills the
+#  optimized template exactly like the original
+#
+# fonts: the embedded fonts are listed in the report; pypdf can't subset a font, so a font
+#  that is embedded whole is only reported (the fonts in repeater_map_for_test.pdf are
+#  already subsets, and the Helvetica fonts aren't embedded at all)
+#
+# the map build (repeaterTest.py render/cohort --optimize) optimizes the template once,
+#  and can enforce a per-map size budget (--size-budget): a map over budget is not built
+#
+# requires Pillow
+
+import io
+import re
+import os
+import zlib
+from pypdf import PdfWriter
+from pypdf.generic import NameObject,NumberObject
+
+try:
+	from PIL import Image
+except ImportError:
+	Image=None
+
+quality=60
+maxDPI=150
+
+# the size each image is drawn at, in points: key = image name, val = (width, height)
+#  from the 'w 0 0 h x y cm /ImN Do' sequences in the page contents
+def imagePlacements(page):
+	contents=page.get_contents().get_data().decode('latin-1')
+	return {m.group(3):(abs(float(m.group(1))),abs(float(m.group(2)))) for m in re.finditer(r'([-\d.]+) 0 0 ([-\d.]+) [-\d.]+ [-\d.]+ cm\s*(/\w+) Do',contents)}
+
+# decode an image XObject (DCTDecode, or 8-bit DeviceRGB / DeviceGray) into a Pillow image
+def decodeImage(obj):
+	size=(int(obj['/Width']),int(obj['/Height']))
+	if obj.get('/Filter')=='/DCTDecode':
+		return Image.open(io.BytesIO(bytes(obj._data))).convert('RGB')
+	mode={'/DeviceRGB':'RGB','/DeviceGray':'L'}.get(obj.get('/ColorSpace'),None)
+	if mode is None or int(obj.get('/BitsPerComponent',8))!=8:
+		raise ValueError('unsupported image color space '+str(obj.get('/ColorSpace')))
+	return Image.frombytes(mode,size,obj.get_data())
+
+def jpegBytes(im,q):
+	buf=io.BytesIO()
+	im.save(buf,'JPEG',quality=q,optimize=True,progressive=True)
+	return buf.getvalue()
+
+def setImage(obj,size,data,filterName):
+	obj._data=data
+	obj[NameObject('/Width')]=NumberObject(size[0])
+	obj[NameObject('/Height')]=NumberObject(size[1])
+	obj[NameObject('/Filter')]=NameObject(filterName)
+	obj.pop('/DecodeParms',None)
+
+def isSubset(fontName):
+	return bool(re.match(r'/[A-Z]{6}\+',fontName))
+
+# the embedded fonts: [{'name', 'bytes', 'subset'}, ...]
+def embeddedFonts(page):
+	fonts=[]
+	for f in page['/Resources'].get('/Font',{}).values():
+		f=f.get_object()
+		descriptor=f.get('/FontDescriptor',None)
+		if descriptor is None:
+			continue
+		descriptor=descriptor.get_object()
+		for k in ['/FontFile','/FontFile2','/FontFile3']:
+			if k in descriptor:
+				fonts.append({'name':str(f['/BaseFont']),'bytes':len(descriptor[k].get_object()._data),'subset':isSubset(str(f['/BaseFont']))})
+	return fonts
+
+# write the optimized template to outFile; returns a report: bytes before and after,
+#  and for each image its name, pixel size before and after, and encoded bytes before and after
+def optimizeTemplate(templateFile,outFile,quality=quality,maxDPI=maxDPI):
+	if Image is None:
+		raise ImportError('Pillow is needed to optimize the template images')
+	writer=PdfWriter(clone_from=templateFile)
+	page=writer.pages[0]
+	placements=imagePlacements(page)
+	pageWidth=float(page.mediabox.width)
+	report={'before':os.path.getsize(templateFile),'images':[],'fonts':embeddedFonts(page)}
+	for (name,ref) in page['/Resources'].get('/XObject',{}).items():
+		obj=ref.get_object()
+		if obj.get('/Subtype')!='/Image':
+			continue
+		im=decodeImage(obj)
+		mask=obj['/SMask'].get_object() if '/SMask' in obj else None
+		before={'size':im.size,'bytes':len(obj._data)+(len(mask._data) if mask is not None else 0)}
+		# not drawn directly on the page (e.g. only from a form xobject): assume full page width
+		(drawnWidth,drawnHeight)=placements.get(str(name),(pageWidth,pageWidth*im.height/im.width))
+		width=min(im.width,max(1,round(drawnWidth/72*maxDPI)))
+		size=(width,max(1,round(im.height*width/im.width)))
+		if size!=im.size:
+			im=im.resize(size,Image.LANCZOS)
+		data=jpegBytes(im,quality)
+		maskData=None
+		if mask is not None:
+			m=decodeImage(mask)
+			if m.size!=size:
+				m=m.resize(size,Image.LANCZOS)
+			maskData=zlib.compress(m.tobytes(),9)
+		after=len(data)+(len(maskData) if maskData is not None else 0)
+		if after>=before['bytes']:
+			report['images'].append({'name':str(name),'before':before,'after':before,'changed':False})
+			continue
+		setImage(obj,size,data,'/DCTDecode')
+		if mask is not None:
+			setImage(mask,size,maskData,'/FlateDecode')
+		report['images'].append({'name':str(name),'before':before,'after':{'size':size,'bytes':after},'changed':True})
+	with open(outFile,'wb') as f:
+		writer.write(f)
+	report['after']=os.path.getsize(outFile)
+	return report
+
+def reportText(report):
+	lines=['template: '+str(report['before'])+' -> '+str(report['after'])+' bytes']
+	for i in report['images']:
+		lines.append('  image '+i['name']+': '+'x'.join(str(n) for n in i['before']['size'])+' '+str(i['before']['bytes'])+' bytes -> '
+			+('x'.join(str(n) for n in i['after']['size'])+' '+str(i['after']['bytes'])+' bytes' if i['changed'] else 'unchanged (already smaller)'))
+	for f in report['fonts']:
+		lines.append('  font '+f['name']+': '+str(f['bytes'])+' bytes embedded'+('' if f['subset'] else ' (NOT a subset; subset it in the source document)'))
+	return '\n'.join(lines)
@@ -0,0 +1,135 @@
+# testSpec.py - test definitions, read from one versioned spec file (testSpec.json)
+
+# the repeater set, location set, scoring weights and mapID range of each test used to be
+#  copied by hand into repeaterTest.py and signin_api.py; now they come from testSpec.json:
+#   {
+#      "specVersion":1,
+#      "current":"2024-01", # the test that build-keys, render, etc. work on by default
+#      "tests":[
+#         {
+#            "name":"2024-01",
+#            "version":1, # bump when anything below changes for this test
+#            "firstMapID":2200,"lastMapID":2350, # inclusive
+#            "repeaters":[...], # in the order of the rows of the jotform part one table
+#            "locations":[...], # in the order of the rows of the jotform part two table
+#            "weights":{...}, # see scoring.py; missing entries use partTwoWeights
+#            "partOneKey":"...","partTwoKey":"...", # solution files
+#            "itemStats":"itemStats.json", # statistics file (see itemStats.py)
+#            "template":"repeater_map_for_test.pdf" # fillable map PDF
+#         },
+#         ...
+#      ]
+#   }
+#  the file names are used as given: repeaterTest.py opens them relative to the current
+#  directory, and signin_api.py relative to rtPath, as before
+#
+# each test is compiled once into an immutable TestSpec: tuples for the lists, and
+#  read-only dicts for the weights and for the row number of each repeater, location and
+#  letter; several tests can be in use at the same time, as long as their mapID ranges
+#  don't overlap: SpecSet.forMapID finds the test for a submission's mapID with one index
+#  into a table covering all of the ranges
+#
+# this module only uses the standard library, so that it can be imported from signin_api
+
+import os
+import json
+import string
+from types import MappingProxyType
+from collections import namedtuple
+from scoring import partTwoWeights
+
+specVersion=1
+
+TestSpec=namedtuple('TestSpec',['name','version','firstMapID','lastMapID','repeaters','locations','letters',
+	'repeaterIndex','locationIndex','letterIndex','weights','partOneKey','partTwoKey','itemStats','template'])
+
+def readOnlyIndex(items):
+	return MappingProxyType({item:n for (n,item) in enumerate(items)})
+
+# compile one test entry from the spec file; raises ValueError if it is inconsistent
+def compileSpec(entry):
+	name=str(entry['name'])
+	repeaters=tuple(entry['repeaters'])
+	locations=tuple(entry['locations'])
+	if len(set(repeaters))!=len(repeaters):
+		raise ValueError('test '+name+': repeaters are not unique')
+	if len(set(locations))!=len(locations):
+		raise ValueError('test '+name+': locations are not unique')
+	if len(repeaters)>len(string.ascii_uppercase):
+		raise ValueError('test '+name+': more repeaters ('+str(len(repeaters))+') than letters')
+	unknownWeights=set(entry.get('weights',{}).keys())-set(partTwoWeights.keys())
+	if unknownWeights:
+		raise ValueError('test '+name+': unknown weights '+str(sorted(unknownWeights)))
+	firstMapID=int(entry['firstMapID'])
+	lastMapID=int(entry['lastMapID'])
+	if lastMapID<firstMapID:
+		raise ValueError('test '+name+': lastMapID is before firstMapID')
+	letters=tuple(string.ascii_uppercase[0:len(repeaters)])
+	return TestSpec(
+		name=name,
+		version=int(entry.get('version',1)),
+		firstMapID=firstMapID,
+		lastMapID=lastMapID,
+		repeaters=repeaters,
+		locations=locations,
+		letters=letters,
+		repeaterIndex=readOnlyIndex(repeaters),
+		locationIndex=readOnlyIndex(locations),
+		letterIndex=readOnlyIndex(letters),
+		weights=MappingProxyType(dict(partTwoWeights,**entry.get('weights',{}))),
+		partOneKey=entry.get('partOneKey',None),
+		partTwoKey=entry.get('partTwoKey',None),
+		itemStats=entry.get('itemStats','itemStats.json'),
+		template=entry.get('template',None))
+
+class SpecSet():
+	def __init__(self,specs,current=None):
+		self.specs=tuple(specs)
+		if not self.specs:
+			raise ValueError('no tests in the spec')
+		self.byName=MappingProxyType({s.name:s for s in self.specs})
+		if len(self.byName)!=len(self.specs):
+			raise ValueError('test names are not unique')
+		self.current=self.byName[current] if current else self.specs[-1]
+		# one byte per mapID from the lowest to the highest in any test: 0 for none,
+		#  otherwise 1 + the position of the test in self.specs
+		self.minMapID=min(s.firstMapID for s in self.specs)
+		self.table=bytearray(max(s.lastMapID for s in self.specs)-self.minMapID+1)
+		for (n,s) in enumerate(self.specs):
+			start=s.firstMapID-self.minMapID
+			end=s.lastMapID-self.minMapID+1
+			if any(self.table[start:end]):
+				raise ValueError('the mapID range of test '+s.name+' overlaps another test')
+			self.table[start:end]=bytes([n+1])*(end-start)
+
+	# the test that a mapID belongs to, or None
+	def forMapID(self,mapID):
+		try:
+			i=int(mapID)-self.minMapID
+		except (TypeError,ValueError):
+			return None
+		if i<0 or i>=len(self.table) or not self.table[i]:
+			return None
+		return self.specs[self.table[i]-1]
+
+	def __getitem__(self,name):
+		return self.byName[name]
+
+# compiled spec sets, by absolute file name: (mtime, SpecSet); a changed file is recompiled
+specCache={}
+
+def loadSpecs(fileName):
+	fileName=os.path.abspath(fileName)
+	mtime=os.stat(fileName).st_mtime_ns
+	cached=specCache.get(fileName,None)
+	if cached and cached[0]==mtime:
+		return cached[1]
+	with open(fileName,'r') as f:
+		d=json.load(f)
+	if d.get('specVersion',None)!=specVersion:
+		raise ValueError(fileName+': unsupported specVersion '+str(d.get('specVersion',None)))
+	if len(d['tests'])>255:
+		raise ValueError(fileName+': too many tests')
+	specSet=SpecSet([compileSpec(entry) for entry in d['tests']],d.get('current',None))
+	specCache[fileName]=(mtime,specSet)
+	return specSet